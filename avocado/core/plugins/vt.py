@@ -151,6 +151,34 @@ def guest_listing(options, view):
         view.notify(event='minor', msg=out)
 
 
+class LazyTestSuite(object):
+
+    """
+    Test factories of a discovery, generated only as they get consumed.
+
+    Lets the consumer start running the first tests while the rest of the
+    variants are still being expanded. Evaluates to False when there are no
+    tests, as an empty list would.
+    """
+
+    def __init__(self, factories):
+        self._factories = iter(factories)
+        self._pending = []
+
+    def __nonzero__(self):
+        if not self._pending:
+            for factory in self._factories:
+                self._pending.append(factory)
+                break
+        return bool(self._pending)
+
+    def __iter__(self):
+        while self._pending:
+            yield self._pending.pop(0)
+        for factory in self._factories:
+            yield factory
+
+
 class VirtTestLoader(loader.TestLoader):
 
     name = 'vt'
@@ -192,6 +220,7 @@ class VirtTestLoader(loader.TestLoader):
         add_if_not_exist('vt_malloc_perturb', 'yes')
         add_if_not_exist('vt_qemu_sandbox', 'on')
         add_if_not_exist('vt_tests', '')
+        add_if_not_exist('vt_parallel_expansion', 0)
         add_if_not_exist('show_job_log', False)
         add_if_not_exist('test_lister', True)
 
@@ -248,9 +277,21 @@ class VirtTestLoader(loader.TestLoader):
         elif which_tests is loader.DEFAULT and not self.args.vt_config:
             # By default don't run anythinig unless vt_config provided
             return []
-        # Create test_suite
-        test_suite = []
-        for params in (_ for _ in cartesian_parser.get_dicts()):
+        return LazyTestSuite(self._get_test_factories(cartesian_parser))
+
+    def _get_test_factories(self, cartesian_parser):
+        """
+        Generate test factories as the dicts come out of the parser.
+        """
+        if self.args.vt_parallel_expansion > 1:
+            dicts = cartesian_parser.get_dicts_parallel(
+                self.args.vt_parallel_expansion)
+        else:
+            dicts = cartesian_parser.get_dicts()
+        # Keep only the differences between the dicts of the test list,
+        # VirtTest turns them into full Params once the test gets run
+        dicts = cartesian_config.DictCompactor().compact_dicts(dicts)
+        for params in dicts:
             # We want avocado to inject params coming from its multiplexer into
             # the test params. This will allow users to access avocado params
             # from inside virt tests. This feature would only work if the virt
@@ -266,8 +307,7 @@ class VirtTestLoader(loader.TestLoader):
             params['id'] = test_name
             test_parameters = {'name': test_name,
                                'params': params}
-            test_suite.append((VirtTest, test_parameters))
-        return test_suite
+            yield (VirtTest, test_parameters)
 
 
 def cleanup_env(env_filename, env_version):
@@ -409,7 +449,7 @@ class VirtTest(test.Test):
             logging.warning("")
 
         # Find the test
-        subtest_dirs = []
+        test_dirs = []
         test_filter = bootstrap.test_filter
 
         other_subtests_dirs = params.get("other_tests_dirs", "")
@@ -419,32 +459,25 @@ class VirtTest(test.Test):
             if not os.path.isdir(subtestdir):
                 raise error.TestError("Directory %s does not "
                                       "exist" % subtestdir)
-            subtest_dirs += data_dir.SubdirList(subtestdir,
-                                                test_filter)
+            test_dirs.append(subtestdir)
 
         provider = params.get("provider", None)
 
         if provider is None:
             # Verify if we have the correspondent source file for
             # it
-            generic_subdirs = asset.get_test_provider_subdirs(
-                'generic')
-            for generic_subdir in generic_subdirs:
-                subtest_dirs += data_dir.SubdirList(generic_subdir,
-                                                    test_filter)
-            specific_subdirs = asset.get_test_provider_subdirs(
+            test_dirs += asset.get_test_provider_subdirs('generic')
+            test_dirs += asset.get_test_provider_subdirs(
                 params.get("vm_type"))
-            for specific_subdir in specific_subdirs:
-                subtest_dirs += data_dir.SubdirList(
-                    specific_subdir, bootstrap.test_filter)
         else:
             provider_info = asset.get_test_provider_info(provider)
             for key in provider_info['backends']:
-                subtest_dirs += data_dir.SubdirList(
-                    provider_info['backends'][key]['path'],
-                    bootstrap.test_filter)
+                test_dirs.append(provider_info['backends'][key]['path'])
 
-        subtest_dir = None
+        # The indexes are kept across tests, each test dir is only walked
+        # once per job
+        test_indexes = [asset.get_test_dir_index(d, test_filter)
+                        for d in test_dirs]
 
         # Get the test routine corresponding to the specified
         # test type
@@ -456,27 +489,27 @@ class VirtTest(test.Test):
 
         t_types = params.get("type").split()
         # Make sure we can load provider_lib in tests
-        for s in subtest_dirs:
-            if os.path.dirname(s) not in sys.path:
-                sys.path.insert(0, os.path.dirname(s))
+        sys_path = set(sys.path)
+        for index in test_indexes:
+            for s in index.subdirs:
+                if os.path.dirname(s) not in sys_path:
+                    sys.path.insert(0, os.path.dirname(s))
+                    sys_path.add(os.path.dirname(s))
 
         test_modules = {}
         for t_type in t_types:
-            for d in subtest_dirs:
-                module_path = os.path.join(d, "%s.py" % t_type)
-                if os.path.isfile(module_path):
-                    logging.debug("Found subtest module %s",
-                                  module_path)
-                    subtest_dir = d
-                    break
+            subtest_dir = asset.find_test_dir(t_type, test_indexes)
             if subtest_dir is None:
+                subtest_dirs = []
+                for index in test_indexes:
+                    subtest_dirs += index.subdirs
                 msg = ("Could not find test file %s.py on test"
                        "dirs %s" % (t_type, subtest_dirs))
                 raise error.TestError(msg)
+            logging.debug("Found subtest module %s",
+                          os.path.join(subtest_dir, "%s.py" % t_type))
             # Load the test module
-            f, p, d = imp.find_module(t_type, [subtest_dir])
-            test_modules[t_type] = imp.load_module(t_type, f, p, d)
-            f.close()
+            test_modules[t_type] = asset.load_test_module(t_type, subtest_dir)
 
         # TODO: the environment file is deprecated code, and should be removed
         # in future versions. Right now, it's being created on an Avocado temp
@@ -686,6 +719,8 @@ class VirtTestOptionsProcess(object):
             'vt.common', 'nettype', default=None)
         self.options.vt_netdst = settings.get_value(
             'vt.common', 'netdst', default='virbr0')
+        self.options.vt_parallel_expansion = settings.get_value(
+            'vt.common', 'parallel_expansion', key_type=int, default=0)
         # qemu section
         self.options.vt_accel = settings.get_value(
             'vt.qemu', 'accel', default='kvm')
@@ -1070,7 +1105,9 @@ class VirtTestOptionsProcess(object):
                                     self.options.vt_type,
                                     " ".join(SUPPORTED_TEST_TYPES)))
 
-        self.cartesian_parser = cartesian_config.Parser(debug=False)
+        cache_dir = data_dir.get_cache_dir('cartesian')
+        self.cartesian_parser = cartesian_config.Parser(debug=False,
+                                                        cache_dir=cache_dir)
 
         if self.options.vt_config:
             cfg = os.path.abspath(self.options.vt_config)
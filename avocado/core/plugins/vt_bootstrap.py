@@ -66,6 +66,10 @@ class VirtBootstrap(plugin.Plugin):
                                                       "providers to be "
                                                       "updated (git repos "
                                                       "will be pulled)"))
+        self.parser.add_argument("--vt-download-segments", action="store",
+                                 type=int, default=1,
+                                 help=("Number of parallel connections used "
+                                       "to download big JeOS images"))
         self.parser.add_argument("--yes-to-all", action="store_true",
                                  default=False, help=("All interactive "
                                                       "questions will be "
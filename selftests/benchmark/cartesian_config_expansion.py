@@ -0,0 +1,109 @@
+#!/usr/bin/python
+"""
+Benchmark expansion of a synthetic cartesian config with many filters.
+
+The config has 5 variant groups of 10 variants (100k leaves before
+filtering) and a large number of ``only``/``no`` lines. Optionally the
+expansion time is compared with the parser from another git revision:
+
+    selftests/benchmark/cartesian_config_expansion.py --baseline-rev HEAD~1
+"""
+
+import imp
+import optparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.insert(0, basedir)
+
+from virttest import cartesian_config
+
+
+def make_config(groups, width, filters, seed=0):
+    """
+    Generate the synthetic config.
+
+    :param groups: Number of nested variants blocks.
+    :param width: Number of variants in every block.
+    :param filters: Number of filter lines, every tenth one is an ``only``.
+    """
+    rand = random.Random(seed)
+    lines = []
+    for group in xrange(groups):
+        lines.append("variants g%d:" % group)
+        for variant in xrange(width):
+            lines.append("    - g%d_v%d:" % (group, variant))
+            lines.append("        key_%d = value_%d" % (group, variant))
+    for index in xrange(filters):
+        picked = rand.sample(xrange(groups), 3)
+        words = ["g%d_v%d" % (group, rand.randrange(width))
+                 for group in picked]
+        if index % 10:
+            # Mostly 3 label and-words, each drops width**(groups - 3)
+            lines.append("no %s" % "..".join(words))
+        else:
+            # Passes everything, but has to be carried down to the group
+            group = picked[0]
+            lines.append("only %s" % ", ".join("g%d_v%d" % (group, variant)
+                                               for variant in xrange(width)))
+    return "\n".join(lines) + "\n"
+
+
+def expand(module, config):
+    parser = module.Parser()
+    parser.parse_string(config)
+    start = time.time()
+    count = 0
+    for _ in parser.get_dicts():
+        count += 1
+    return count, time.time() - start
+
+
+def load_revision(revision):
+    """
+    Import cartesian_config from another git revision as a separate module.
+    """
+    source = subprocess.check_output(
+        ["git", "show", "%s:virttest/cartesian_config.py" % revision],
+        cwd=basedir)
+    fd, path = tempfile.mkstemp(suffix=".py")
+    try:
+        os.write(fd, source)
+        os.close(fd)
+        return imp.load_source("cartesian_config_baseline", path)
+    finally:
+        os.unlink(path)
+        if os.path.exists(path + "c"):
+            os.unlink(path + "c")
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--groups", type="int", default=5)
+    parser.add_option("--width", type="int", default=10)
+    parser.add_option("--filters", type="int", default=1000)
+    parser.add_option("--baseline-rev", dest="baseline_rev",
+                      help="git revision of the parser to compare with")
+    options, _ = parser.parse_args()
+
+    config = make_config(options.groups, options.width, options.filters)
+    print("%d leaves, %d filter lines" % (options.width ** options.groups,
+                                          options.filters))
+    count, elapsed = expand(cartesian_config, config)
+    print("current:  %d dicts in %.2f s" % (count, elapsed))
+    if options.baseline_rev:
+        baseline = load_revision(options.baseline_rev)
+        base_count, base_elapsed = expand(baseline, config)
+        print("baseline: %d dicts in %.2f s" % (base_count, base_elapsed))
+        if base_count != count:
+            print("ERROR: baseline produced a different number of dicts")
+            sys.exit(1)
+        print("speedup:  %.2fx" % (base_elapsed / elapsed))
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+"""
+Benchmark editing a VMXML holding many devices through libvirt_xml.
+
+Builds a domain with 500 disks and times listing the devices, reading
+per-device accessors, editing and writing the devices back and removing
+them one by one.  Optionally compares with the libvirt_xml and xml_utils
+code from another git revision:
+
+    selftests/benchmark/libvirt_xml_vmxml_edit.py --baseline-rev HEAD~1
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+DISK_XML = ("<disk type='file' device='disk'>"
+            "<driver name='qemu' type='qcow2'/>"
+            "<source file='/var/lib/images/disk%d.qcow2'/>"
+            "<target dev='vd%d' bus='virtio'/>"
+            "</disk>")
+
+
+def make_domain_xml(devices):
+    """
+    Domain XML string with devices disk elements.
+    """
+    disks = "".join(DISK_XML % (index, index) for index in xrange(devices))
+    return ("<domain type='kvm'><name>bench</name>"
+            "<memory unit='KiB'>1048576</memory><vcpu>1</vcpu>"
+            "<os><type arch='x86_64' machine='pc'>hvm</type></os>"
+            "<devices>%s</devices></domain>" % disks)
+
+
+def run(vm_xml, devices, repeat):
+    """
+    Return a list of (operation name, seconds per call) tuples.
+    """
+    domain_xml = make_domain_xml(devices)
+    vmxml = vm_xml.VMXML()
+    vmxml.xml = domain_xml
+
+    def read_targets():
+        for disk in vmxml.get_devices('disk'):
+            disk.target
+
+    def read_sources():
+        for disk in vmxml.get_devices('disk'):
+            disk.source
+
+    def edit_devices():
+        disks = vmxml.get_devices()
+        for disk in disks:
+            target = disk.target
+            target['bus'] = 'scsi'
+            disk.target = target
+        vmxml.set_devices(disks)
+
+    def remove_devices():
+        xmltreefile = vmxml.xmltreefile
+        for node in xmltreefile.findall('devices/disk'):
+            xmltreefile.remove(node)
+        vmxml.xml = domain_xml
+
+    operations = [
+        ("get devices", lambda: vmxml.get_devices()),
+        ("read targets", read_targets),
+        ("read sources", read_sources),
+        ("edit devices", edit_devices),
+        ("remove devices", remove_devices),
+    ]
+    results = []
+    for name, func in operations:
+        start = time.time()
+        for _ in xrange(repeat):
+            func()
+        results.append((name, (time.time() - start) / repeat))
+    return results
+
+
+def run_revision(revision, devices, repeat):
+    """
+    Run this benchmark against virttest exported from another git revision.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        archive = subprocess.Popen(["git", "archive", revision, "virttest"],
+                                   cwd=basedir, stdout=subprocess.PIPE)
+        subprocess.check_call(["tar", "-x", "-C", tmpdir],
+                              stdin=archive.stdout)
+        archive.wait()
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__),
+             "--source-dir", tmpdir, "--devices", str(devices),
+             "--repeat", str(repeat), "--raw"])
+    finally:
+        shutil.rmtree(tmpdir)
+    results = []
+    for line in output.splitlines():
+        name, seconds = line.rsplit(None, 1)
+        results.append((name, float(seconds)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--devices", type="int", default=500)
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--baseline-rev", dest="baseline_rev",
+                      help="git revision of virttest to compare with")
+    parser.add_option("--source-dir", dest="source_dir", default=basedir,
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option("--raw", action="store_true",
+                      help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    sys.path.insert(0, options.source_dir)
+    from virttest.libvirt_xml import vm_xml
+
+    columns = [("current", run(vm_xml, options.devices, options.repeat))]
+    if options.raw:
+        for name, seconds in columns[0][1]:
+            print("%s %f" % (name, seconds))
+        sys.exit(0)
+    if options.baseline_rev:
+        columns.append(("baseline", run_revision(
+            options.baseline_rev, options.devices, options.repeat)))
+
+    print("%d devices, seconds per call" % options.devices)
+    print("%-15s" % "" + "".join("%12s" % name for name, _ in columns))
+    for name, _ in columns[0][1]:
+        times = [dict(results).get(name) for _, results in columns]
+        print("%-15s" % name +
+              "".join("%12s" % ("-" if t is None else "%.4f" % t)
+                      for t in times))
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+"""
+Benchmark the ppm_utils image operations on screendump sized images.
+
+Times read, crop, region md5sum, comparison and fuzzy comparison with numpy
+(when installed), without it, and optionally with ppm_utils from another
+git revision:
+
+    selftests/benchmark/ppm_utils_operations.py --baseline-rev HEAD~1
+"""
+
+import imp
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.insert(0, basedir)
+
+from virttest import ppm_utils
+
+
+def make_images(width, height, seed=0):
+    """
+    Two images with a mostly uniform background differing in a few areas,
+    like two screendumps of a desktop.
+    """
+    rand = random.Random(seed)
+    row = bytearray("\x20\x40\x80" * width)
+    data1 = row * height
+    for _ in xrange(50):
+        x, y = rand.randrange(width - 100), rand.randrange(height - 20)
+        for line in xrange(y, y + 20):
+            start = (line * width + x) * 3
+            data1[start:start + 300] = os.urandom(300)
+    data2 = bytearray(data1)
+    for _ in xrange(10):
+        x, y = rand.randrange(width - 100), rand.randrange(height - 20)
+        for line in xrange(y, y + 20):
+            start = (line * width + x) * 3
+            data2[start:start + 300] = os.urandom(300)
+    return str(data1), str(data2)
+
+
+def run(module, filename, width, height, data1, data2, repeat):
+    """
+    Return a list of (operation name, seconds per call) tuples.
+    """
+    operations = [
+        ("read", lambda: module.image_read_from_ppm_file(filename)),
+        ("crop", lambda: module.image_crop(width, height, data1, 100, 100,
+                                           width / 2, height / 2)),
+        ("region md5sum", lambda: module.get_region_md5sum(
+            width, height, data1, 100, 100, width / 2, height / 2)),
+        ("comparison", lambda: module.image_comparison(width, height,
+                                                       data1, data2)),
+        ("fuzzy compare", lambda: module.image_fuzzy_compare(width, height,
+                                                             data1, data2)),
+    ]
+    if hasattr(module, "image_map_ppm_file"):
+        operations.insert(1, ("map", lambda: module.image_map_ppm_file(
+            filename)))
+    results = []
+    for name, func in operations:
+        start = time.time()
+        for _ in xrange(repeat):
+            func()
+        results.append((name, (time.time() - start) / repeat))
+    return results
+
+
+def load_revision(revision):
+    """
+    Import ppm_utils from another git revision as a separate module.
+    """
+    source = subprocess.check_output(
+        ["git", "show", "%s:virttest/ppm_utils.py" % revision],
+        cwd=basedir)
+    fd, path = tempfile.mkstemp(suffix=".py")
+    try:
+        os.write(fd, source)
+        os.close(fd)
+        return imp.load_source("ppm_utils_baseline", path)
+    finally:
+        os.unlink(path)
+        if os.path.exists(path + "c"):
+            os.unlink(path + "c")
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--width", type="int", default=1920)
+    parser.add_option("--height", type="int", default=1080)
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--baseline-rev", dest="baseline_rev",
+                      help="git revision of ppm_utils to compare with")
+    options, _ = parser.parse_args()
+
+    data1, data2 = make_images(options.width, options.height)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "image.ppm")
+        ppm_utils.image_write_to_ppm_file(filename, options.width,
+                                          options.height, data1)
+        args = (filename, options.width, options.height, data1, data2,
+                options.repeat)
+        columns = []
+        if ppm_utils.numpy is not None:
+            columns.append(("numpy", run(ppm_utils, *args)))
+        numpy = ppm_utils.numpy
+        ppm_utils.numpy = None
+        try:
+            columns.append(("python", run(ppm_utils, *args)))
+        finally:
+            ppm_utils.numpy = numpy
+        if options.baseline_rev:
+            columns.append(("baseline", run(load_revision(
+                options.baseline_rev), *args)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("%dx%d, seconds per call" % (options.width, options.height))
+    print("%-15s" % "" + "".join("%12s" % name for name, _ in columns))
+    for name, _ in columns[0][1]:
+        times = [dict(results).get(name) for _, results in columns]
+        print("%-15s" % name +
+              "".join("%12s" % ("-" if t is None else "%.4f" % t)
+                      for t in times))
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import asset
+from virttest import http_server
+from virttest import utils_misc
+
+
+class TestDirIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.write("tests/boot.py", "NAME = 'boot'\n")
+        self.write("tests/net/ping.py", "NAME = 'ping'\n")
+        self.write("tests/cfg/cfg.py", "")
+        self.write("tests/.hidden/hidden.py", "")
+        self.index = asset.TestDirIndex(os.path.join(self.tmpdir, "tests"),
+                                        ['cfg'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        asset._TEST_MODULES.clear()
+        for name in ("boot", "ping"):
+            sys.modules.pop(name, None)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as module_file:
+            module_file.write(content)
+        return path
+
+    def touch_later(self, path):
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (time.time(), mtime))
+
+    def testFind(self):
+        tests = os.path.join(self.tmpdir, "tests")
+        self.assertEqual(self.index.find("boot"), tests)
+        self.assertEqual(self.index.find("ping"), os.path.join(tests, "net"))
+        self.assertEqual(self.index.find("cfg"), None)
+        self.assertEqual(self.index.find("hidden"), None)
+        self.assertEqual(asset.find_test_dir("ping", [self.index]),
+                         os.path.join(tests, "net"))
+
+    def testInvalidation(self):
+        net = os.path.join(self.tmpdir, "tests", "net")
+        self.write("tests/net/reboot.py", "")
+        self.touch_later(net)
+        self.assertEqual(self.index.find("reboot"), net)
+        os.unlink(os.path.join(net, "ping.py"))
+        self.touch_later(net)
+        self.assertEqual(self.index.find("ping"), None)
+
+    def testLoadTestModule(self):
+        tests = os.path.join(self.tmpdir, "tests")
+        module = asset.load_test_module("boot", tests)
+        self.assertEqual(module.NAME, "boot")
+        self.assertTrue(asset.load_test_module("boot", tests) is module)
+        path = self.write("tests/boot.py", "NAME = 'changed'\n")
+        self.touch_later(path)
+        self.assertEqual(asset.load_test_module("boot", tests).NAME,
+                         "changed")
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, "src")
+        os.mkdir(self.srcdir)
+        self.data = os.urandom(1024 * 1024 + 5)
+        self.sha1 = hashlib.sha1(self.data).hexdigest()
+        with open(os.path.join(self.srcdir, "image.qcow2"), "wb") as image:
+            image.write(self.data)
+        self.destination = os.path.join(self.tmpdir, "image.qcow2")
+        port = utils_misc.find_free_port(8000, 8099)
+        self.url = "http://127.0.0.1:%d/image.qcow2" % port
+        self.terminate = threading.Event()
+        self.thread = threading.Thread(target=http_server.http_server,
+                                       args=(port, self.srcdir,
+                                             self.terminate.isSet),
+                                       kwargs={"threaded": True})
+        self.thread.start()
+        utils_misc.wait_for(
+            lambda: not utils_misc.is_port_free(port, "127.0.0.1"),
+            10, step=0.1)
+        self.segment_min_size = asset.DOWNLOAD_SEGMENT_MIN_SIZE
+
+    def tearDown(self):
+        asset.DOWNLOAD_SEGMENT_MIN_SIZE = self.segment_min_size
+        self.terminate.set()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def check_destination(self):
+        with open(self.destination, "rb") as image:
+            self.assertEqual(image.read(), self.data)
+        self.assertFalse(os.path.exists(self.destination + ".part"))
+        self.assertEqual(asset._get_verified_sha1(self.destination),
+                         self.sha1)
+
+    def testDownload(self):
+        self.assertEqual(asset.download_url(self.url, self.destination),
+                         self.sha1)
+        self.check_destination()
+
+    def testResume(self):
+        with open(self.destination + ".part", "wb") as part:
+            part.write(self.data[:300000])
+        self.assertEqual(asset.download_url(self.url, self.destination),
+                         self.sha1)
+        self.check_destination()
+        # Complete part file
+        os.rename(self.destination, self.destination + ".part")
+        self.assertEqual(asset.download_url(self.url, self.destination),
+                         self.sha1)
+        self.check_destination()
+
+    def testSegments(self):
+        asset.DOWNLOAD_SEGMENT_MIN_SIZE = 100000
+        self.assertEqual(asset.download_url(self.url, self.destination,
+                                            segments=4), self.sha1)
+        self.check_destination()
+        self.assertFalse(os.path.exists(self.destination + ".segments.part"))
+
+    def testVerifiedSha1(self):
+        asset.download_url(self.url, self.destination)
+        with open(self.destination + ".verified") as sidecar:
+            fields = sidecar.read().split()
+        fields[0] = "recorded"
+        with open(self.destination + ".verified", "w") as sidecar:
+            sidecar.write(" ".join(fields))
+        self.assertEqual(asset._get_sha1(self.destination), "recorded")
+        os.utime(self.destination, (0, 0))
+        self.assertEqual(asset._get_sha1(self.destination), self.sha1)
+
+
+if __name__ == "__main__":
+    unittest.main()
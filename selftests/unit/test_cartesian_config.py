@@ -3,7 +3,9 @@
 import unittest
 import os
 import gzip
+import shutil
 import sys
+import tempfile
 
 # simple magic for using scripts within a source tree
 basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -753,5 +755,103 @@ class CartesianConfigTest(unittest.TestCase):
         self._checkConfigDump('testcfg.huge/test1.cfg',
                               'testcfg.huge/test1.cfg.repr.gz')
 
+    def testParseCache(self):
+        configpath = os.path.join(testdatadir, 'testcfg.huge/test1.cfg')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            p = cartesian_config.Parser(cache_dir=cache_dir)
+            p.parse_file(configpath)
+            reference = list(p.get_dicts())
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            p = cartesian_config.Parser(cache_dir=cache_dir)
+            # Loading from cache must not need the parser at all
+            p._parse = None
+            p.parse_file(configpath)
+            self._checkDictionaries(p, reference)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testParseCacheInvalidation(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_dir = os.path.join(tmpdir, 'cache')
+        main_cfg = os.path.join(tmpdir, 'main.cfg')
+        included_cfg = os.path.join(tmpdir, 'included.cfg')
+        try:
+            open(main_cfg, 'w').write("include included.cfg\n"
+                                      "variants:\n"
+                                      "    - a:\n")
+            open(included_cfg, 'w').write("x = 1\n")
+            p = cartesian_config.Parser(main_cfg, cache_dir=cache_dir)
+            self.assertEqual(list(p.get_dicts())[0]['x'], '1')
+
+            open(included_cfg, 'w').write("x = 2\n")
+            p = cartesian_config.Parser(main_cfg, cache_dir=cache_dir)
+            self.assertEqual(list(p.get_dicts())[0]['x'], '2')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testParallelDicts(self):
+        configpath = os.path.join(testdatadir, 'testcfg.huge/test1.cfg')
+        reference = list(cartesian_config.Parser(configpath).get_dicts())
+        p = cartesian_config.Parser(configpath)
+        self.assertEqual(list(p.get_dicts_parallel(4)), reference)
+
+    def testParallelDictsJoinSuffix(self):
+        config = """
+            variants:
+                - a:
+                    x = 1
+                - b:
+                    x = 2
+            variants tests:
+                - c:
+                    variants:
+                        - e:
+                            suffix _e
+                            z = 1
+                        - f:
+                            z = 2
+                - d:
+                    join a b
+            """
+        p = cartesian_config.Parser()
+        p.parse_string(config)
+        reference = list(p.get_dicts())
+        p = cartesian_config.Parser()
+        p.parse_string(config)
+        # Subtree with the join can't be split further
+        self.assertEqual(p._split_paths(8)[-1], (1,))
+        self.assertEqual(list(p.get_dicts_parallel(2)), reference)
+
+    def testCompactDicts(self):
+        configpath = os.path.join(testdatadir, 'testcfg.huge/test1.cfg')
+        reference = list(cartesian_config.Parser(configpath).get_dicts())
+        p = cartesian_config.Parser(configpath)
+        compactor = cartesian_config.DictCompactor()
+        result = list(compactor.compact_dicts(p.get_dicts()))
+        self.assertEqual(result, reference)
+        self.assertEqual([dict(d) for d in result], reference)
+        # Consecutive dicts share one base
+        self.assertTrue(result[1]._base is result[0]._base)
+
+    def testLayeredDict(self):
+        base = {'a': '1', 'b': '2'}
+        d1 = cartesian_config.LayeredDict(base)
+        d2 = d1.copy()
+        d1['a'] = 'x'
+        d1['c'] = '3'
+        del d1['b']
+        self.assertEqual(d1, {'a': 'x', 'c': '3'})
+        self.assertEqual(len(d1), 2)
+        self.assertFalse('b' in d1)
+        self.assertRaises(KeyError, d1.__getitem__, 'b')
+        self.assertRaises(KeyError, d1.__delitem__, 'b')
+        self.assertEqual(d2, {'a': '1', 'b': '2'})
+        self.assertEqual(base, {'a': '1', 'b': '2'})
+        d1['b'] = '4'
+        self.assertEqual(sorted(d1.items()),
+                         [('a', 'x'), ('b', '4'), ('c', '3')])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import dhcp_sniffer
+from virttest import utils_misc
+
+MAC = "52:54:00:12:34:56"
+MAC_BYTES = "\x52\x54\x00\x12\x34\x56"
+
+
+def dhcp_payload(message_type, yiaddr):
+    payload = struct.pack("!BBBBI", 2, 1, 6, 0, 0x1234) + "\0" * 8
+    payload += socket.inet_aton(yiaddr) + "\0" * 8
+    payload += MAC_BYTES + "\0" * 10 + "\0" * 192
+    payload += "\x63\x82\x53\x63"
+    payload += "\x35\x01" + chr(message_type) + "\x00\xff"
+    return payload
+
+
+def dhcpv6_payload(message_type, address):
+    duid = struct.pack("!HHI", 1, 1, 0) + MAC_BYTES
+    iaaddr = socket.inet_pton(socket.AF_INET6, address) + "\0" * 8
+    ia_na = "\0" * 12 + struct.pack("!HH", 5, len(iaaddr)) + iaaddr
+    return (chr(message_type) + "\0\0\1" +
+            struct.pack("!HH", 1, len(duid)) + duid +
+            struct.pack("!HH", 3, len(ia_na)) + ia_na)
+
+
+def ipv4_udp(payload):
+    header = struct.pack("!BBHHHBBH", 0x45, 0, 28 + len(payload), 0, 0,
+                         64, 17, 0) + socket.inet_aton("10.0.0.1") * 2
+    return header + struct.pack("!HHHH", 67, 68, 8 + len(payload),
+                                0) + payload
+
+
+def ipv6_udp(payload):
+    header = (struct.pack("!IHBB", 6 << 28, 8 + len(payload), 17, 64) +
+              socket.inet_pton(socket.AF_INET6, "fe80::1") * 2)
+    return header + struct.pack("!HHHH", 547, 546, 8 + len(payload),
+                                0) + payload
+
+
+def ethernet(ethertype, packet):
+    return "\xff" * 6 + MAC_BYTES + struct.pack("!H", ethertype) + packet
+
+
+def linux_sll(ethertype, packet):
+    return (struct.pack("!HHH", 4, 1, 6) + MAC_BYTES + "\0\0" +
+            struct.pack("!H", ethertype) + packet)
+
+
+def pcap(linktype, frames):
+    data = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, linktype)
+    for frame in frames:
+        data += struct.pack("<IIII", 1000, 0, len(frame), len(frame)) + frame
+    return data
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_dhcp(self):
+        frame = ethernet(0x0800, ipv4_udp(dhcp_payload(5, "10.0.0.5")))
+        self.assertEqual(dhcp_sniffer.parse_frame(1, frame),
+                         (4, "ACK", MAC, "10.0.0.5"))
+        frame = ethernet(0x0800, ipv4_udp(dhcp_payload(1, "0.0.0.0")))
+        self.assertEqual(dhcp_sniffer.parse_frame(1, frame),
+                         (4, "DISCOVER", MAC, None))
+        self.assertEqual(dhcp_sniffer.parse_frame(1, frame[:100]), None)
+
+    def test_dhcpv6(self):
+        frame = linux_sll(0x86dd, ipv6_udp(dhcpv6_payload(7, "fd00::5")))
+        self.assertEqual(dhcp_sniffer.parse_frame(113, frame),
+                         (6, "REPLY", MAC, "fd00::5"))
+
+    def test_pcap_stream(self):
+        frames = [ethernet(0x0800, ipv4_udp(dhcp_payload(5, "10.0.0.%d" % i)))
+                  for i in range(3)]
+        data = pcap(1, frames)
+        stream = dhcp_sniffer.PcapStream()
+        packets = []
+        for offset in range(0, len(data), 100):
+            packets.extend(stream.feed(data[offset:offset + 100]))
+        self.assertEqual([p[2] for p in packets], frames)
+        self.assertEqual(set(p[:2] for p in packets), set([(1000.0, 1)]))
+        self.assertRaises(ValueError, dhcp_sniffer.PcapStream().feed,
+                          "x" * 24)
+
+
+class TestDhcpSniffer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_dir = utils_misc.get_log_file_dir()
+        utils_misc.set_log_file_dir(self.tmpdir)
+
+    def tearDown(self):
+        utils_misc.set_log_file_dir(self.log_dir)
+        shutil.rmtree(self.tmpdir)
+
+    def test_sniffer(self):
+        frames = [
+            linux_sll(0x0800, ipv4_udp(dhcp_payload(2, "10.0.0.5"))),
+            linux_sll(0x0800, ipv4_udp(dhcp_payload(5, "10.0.0.5"))),
+            linux_sll(0x86dd, ipv6_udp(dhcpv6_payload(7, "fd00::5"))),
+        ]
+        capture = os.path.join(self.tmpdir, "capture.pcap")
+        with open(capture, "wb") as capture_file:
+            capture_file.write(pcap(113, frames))
+        leases = []
+        sniffer = dhcp_sniffer.DhcpSniffer(
+            lambda *args: leases.append(args), handler_params=("env",),
+            log_filename="tcpdump.log", command=["cat", capture])
+        utils_misc.wait_for(lambda: not sniffer.is_alive(), 10, step=0.1)
+        sniffer.close()
+        self.assertEqual(leases, [("env", MAC, "10.0.0.5", 4),
+                                  ("env", MAC, "fd00::5", 6)])
+        self.assertEqual(sniffer.get_status(), 0)
+        with open(os.path.join(self.tmpdir, "tcpdump.log")) as log_file:
+            lines = log_file.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith("DHCP ACK %s 10.0.0.5" % MAC))
+        self.assertTrue(lines[2].endswith("DHCPv6 REPLY %s fd00::5" % MAC))
+
+
+if __name__ == "__main__":
+    unittest.main()
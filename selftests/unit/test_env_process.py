@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+import Queue
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from avocado.utils import crypto
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import env_process
+
+# 2x1 pixels PPM image
+PPM_IMAGE = "P6\n2 1\n255\n" + "\x00\x80\xff" * 2
+
+
+class FakeTest(object):
+
+    def __init__(self, debugdir):
+        self.debugdir = debugdir
+        self.iteration = 0
+        self.background_errors = Queue.Queue()
+
+
+class FakeVM(object):
+
+    def __init__(self, name, instance):
+        self.name = name
+        self.instance = instance
+        self.screendumps = 0
+
+    def is_alive(self):
+        return True
+
+    def get_pid(self):
+        return 1234
+
+    def screendump(self, filename, debug=True):
+        self.screendumps += 1
+        with open(filename, "wb") as screendump:
+            screendump.write(PPM_IMAGE)
+
+    def verify_bsod(self, filename):
+        pass
+
+
+class ScreendumpCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = env_process._ScreendumpCache(2)
+        cache.add("a", "a.jpg")
+        cache.add("b", "b.jpg")
+        # Using "a" makes "b" the least recently used entry
+        self.assertEqual(cache.get("a"), "a.jpg")
+        cache.add("c", "c.jpg")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), "a.jpg")
+        self.assertEqual(cache.get("c"), "c.jpg")
+        # Adding an existing hash updates it without evicting anything
+        cache.add("c", "c2.jpg")
+        self.assertEqual(cache.get("a"), "a.jpg")
+        self.assertEqual(cache.get("c"), "c2.jpg")
+
+
+class ScreendumpPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.test = FakeTest(self.tmpdir)
+        self.threads = threading.active_count()
+        self.pipeline = env_process._ScreendumpPipeline(
+            self.test, {"screendump_workers": "2"}, self.tmpdir)
+
+    def tearDown(self):
+        self.pipeline.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_duplicate_hash_reuse(self):
+        ppm = self.write_ppm()
+        image_hash = crypto.hash_file(ppm)
+        os.unlink(ppm)
+        cached = os.path.join(self.tmpdir, "cached.jpg")
+        open(cached, "w").close()
+        self.pipeline.cache.add(image_hash, cached)
+        vms = [FakeVM("vm1", "a"), FakeVM("vm2", "b")]
+        self.pipeline.take(vms)
+        self.pipeline.take(vms)
+        for vm in vms:
+            screendump_dir = os.path.join(
+                self.tmpdir, "screendumps_%s_1234_iter0" % vm.name)
+            files = sorted(os.listdir(screendump_dir))
+            self.assertEqual(files, ["0001.jpg", "0002.jpg"])
+            for name in files:
+                self.assertTrue(os.path.samefile(
+                    os.path.join(screendump_dir, name), cached))
+            self.assertEqual(self.pipeline.timings[vm.instance][:2],
+                             [vm.name, 2])
+        # Temporary PPM files are removed once converted
+        self.assertEqual([name for name in os.listdir(self.tmpdir)
+                          if name.endswith(".ppm")], [])
+
+    def test_shutdown(self):
+        self.pipeline.take([FakeVM("vm1", "a")])
+        self.assertTrue(threading.active_count() > self.threads)
+        self.pipeline.close()
+        self.assertEqual(threading.active_count(), self.threads)
+        self.assertRaises(Exception, self.pipeline.take,
+                          [FakeVM("vm1", "a")])
+
+    def write_ppm(self):
+        path = os.path.join(self.tmpdir, "image.ppm")
+        with open(path, "wb") as image:
+            image.write(PPM_IMAGE)
+        return path
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib2
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import http_server
+from virttest import utils_misc
+
+
+class TestHTTPServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = os.urandom(300 * 1024)
+        with open(os.path.join(self.tmpdir, "disk.iso"), "wb") as iso:
+            iso.write(self.data)
+        self.port = utils_misc.find_free_port(8000, 8099)
+        self.terminate = threading.Event()
+        self.thread = threading.Thread(target=http_server.http_server,
+                                       args=(self.port, self.tmpdir,
+                                             self.terminate.isSet),
+                                       kwargs={"threaded": True})
+        self.thread.start()
+        utils_misc.wait_for(
+            lambda: not utils_misc.is_port_free(self.port, "127.0.0.1"),
+            10, step=0.1)
+
+    def tearDown(self):
+        self.terminate.set()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, byte_range=None):
+        request = urllib2.Request("http://127.0.0.1:%d/disk.iso" % self.port)
+        if byte_range is not None:
+            request.add_header("Range", "bytes=%s" % byte_range)
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, details:
+            return details.code, details.headers, details.read()
+        return response.code, response.headers, response.read()
+
+    def testWholeFile(self):
+        code, _, data = self.get()
+        self.assertEqual(code, 200)
+        self.assertEqual(data, self.data)
+
+    def testRanges(self):
+        size = len(self.data)
+        code, headers, data = self.get("100-199")
+        self.assertEqual(code, 206)
+        self.assertEqual(data, self.data[100:200])
+        self.assertEqual(headers["Content-Range"], "bytes 100-199/%d" % size)
+        code, headers, data = self.get("100000-")
+        self.assertEqual(code, 206)
+        self.assertEqual(data, self.data[100000:])
+        code, headers, data = self.get("-5000")
+        self.assertEqual(code, 206)
+        self.assertEqual(data, self.data[-5000:])
+        self.assertEqual(headers["Content-Range"],
+                         "bytes %d-%d/%d" % (size - 5000, size - 1, size))
+        code, headers, data = self.get("0-%d" % (size * 2))
+        self.assertEqual(data, self.data)
+
+    def testUnsatisfiableRange(self):
+        code, headers, _ = self.get("%d-" % len(self.data))
+        self.assertEqual(code, 416)
+        self.assertEqual(headers["Content-Range"],
+                         "bytes */%d" % len(self.data))
+
+    def testMalformedRange(self):
+        code, _, data = self.get("10-5")
+        self.assertEqual(code, 200)
+        self.assertEqual(data, self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -762,6 +762,8 @@ class testLibrarian(LibvirtXMLTestBase):
         Serial = librarian.get('serial')
         self.assertTrue(issubclass(Serial, devices_base.UntypedDeviceBase))
         self.assertTrue(issubclass(Serial, devices_base.TypedDeviceBase))
+        # Loaded once, not re-created by each lookup
+        self.assertTrue(librarian.get('serial') is Serial)
 
 
 class testStubXML(LibvirtXMLTestBase):
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+import cPickle
+import os
+import sys
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest.remote_commander import messenger
+from virttest.remote_commander import remote_interface
+
+
+class TestMessenger(unittest.TestCase):
+
+    def setUp(self):
+        self.fds = []
+
+    def tearDown(self):
+        for fd in self.fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def make_messenger(self, in_wrapper, out_wrapper, binary=False):
+        """
+        Return writing and reading Messenger connected through a pipe
+        """
+        r_pipe, w_pipe = os.pipe()
+        self.fds.extend((r_pipe, w_pipe))
+        sender = messenger.Messenger(in_wrapper(r_pipe), out_wrapper(w_pipe))
+        receiver = messenger.Messenger(in_wrapper(r_pipe),
+                                       out_wrapper(w_pipe))
+        sender.binary = receiver.binary = binary
+        return sender, receiver
+
+    def check_roundtrip(self, sender, receiver):
+        sender.write_msg("start")
+        sender.write_msg(remote_interface.StdOut("out", 5))
+        self.assertEqual(receiver.read_msg(1), (True, "start"))
+        # Second message was read ahead together with the first one
+        self.assertTrue(receiver.pending())
+        succ, msg = receiver.read_msg(1)
+        self.assertTrue(succ)
+        self.assertEqual((msg.msg, msg.cmd_id), ("out", 5))
+        self.assertFalse(receiver.pending())
+        self.assertEqual(receiver.read_msg(0.1), (None, None))
+
+    def testText(self):
+        self.check_roundtrip(*self.make_messenger(
+            messenger.StdIOWrapperIn, messenger.StdIOWrapperOut))
+
+    def testBase64(self):
+        self.check_roundtrip(*self.make_messenger(
+            messenger.StdIOWrapperInBase64, messenger.StdIOWrapperOutBase64))
+
+    def testBinary(self):
+        self.check_roundtrip(*self.make_messenger(
+            messenger.StdIOWrapperInBase64, messenger.StdIOWrapperOutBase64,
+            binary=True))
+
+    def testBinaryChunked(self):
+        sender, receiver = self.make_messenger(
+            messenger.StdIOWrapperIn, messenger.StdIOWrapperOut, binary=True)
+        chunk_size = messenger.BIN_CHUNK_SIZE
+        messenger.BIN_CHUNK_SIZE = 1000
+        try:
+            data = os.urandom(10500)
+            sender.write_msg(data)
+        finally:
+            messenger.BIN_CHUNK_SIZE = chunk_size
+        self.assertEqual(receiver.read_msg(1), (True, data))
+
+    def testPartialHeader(self):
+        sender, receiver = self.make_messenger(
+            messenger.StdIOWrapperIn, messenger.StdIOWrapperOut, binary=True)
+        pdata = cPickle.dumps("abc", cPickle.HIGHEST_PROTOCOL)
+        framed = messenger._BIN_HEADER.pack(0, len(pdata)) + pdata
+        os.write(sender.stdout.fileno(), framed[:2])
+        self.assertEqual(receiver.read_msg(0.1), (None, None))
+        os.write(sender.stdout.fileno(), framed[2:])
+        self.assertEqual(receiver.read_msg(1), (True, "abc"))
+
+    def testClosed(self):
+        sender, receiver = self.make_messenger(
+            messenger.StdIOWrapperIn, messenger.StdIOWrapperOut, binary=True)
+        sender.stdout.close()
+        self.assertEqual(receiver.read_msg(1), (False, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import ppm_utils
+
+WIDTH = 13
+HEIGHT = 7
+
+
+def make_images(seed=0):
+    """
+    Two images differing in some pixels, some of them in one channel only.
+    """
+    rand = random.Random(seed)
+    data1 = bytearray(rand.randrange(256) for _ in xrange(WIDTH * HEIGHT * 3))
+    data2 = bytearray(data1)
+    for pixel in rand.sample(xrange(WIDTH * HEIGHT), 20):
+        data2[pixel * 3 + rand.randrange(3)] ^= 0x40
+    return str(data1), str(data2)
+
+
+def reference_comparison(width, height, data1, data2):
+    newdata = ""
+    for i in xrange(0, width * height * 3, 3):
+        pixel1 = [ord(c) for c in data1[i:i + 3]]
+        pixel2 = [ord(c) for c in data2[i:i + 3]]
+        value = 128 + (sum(pixel1) / 3 + sum(pixel2) / 3) / 2 / 2
+        if pixel1 == pixel2:
+            newdata += chr(0) + chr(value) + chr(0)
+        else:
+            newdata += chr(value) + chr(0) + chr(0)
+    return newdata
+
+
+class ImageOperations(unittest.TestCase):
+
+    numpy = ppm_utils.numpy
+
+    def setUp(self):
+        self.saved_numpy = ppm_utils.numpy
+        ppm_utils.numpy = self.numpy
+        self.tmpdir = tempfile.mkdtemp()
+        self.data1, self.data2 = make_images()
+
+    def tearDown(self):
+        ppm_utils.numpy = self.saved_numpy
+        shutil.rmtree(self.tmpdir)
+
+    def test_crop(self):
+        width, height, data = ppm_utils.image_crop(WIDTH, HEIGHT, self.data1,
+                                                   2, 3, 4, 10)
+        self.assertEqual((width, height), (4, 4))
+        rows = [self.data1[(y * WIDTH + 2) * 3:(y * WIDTH + 6) * 3]
+                for y in xrange(3, 7)]
+        self.assertEqual(data, "".join(rows))
+
+    def test_region_md5sum(self):
+        cropped = os.path.join(self.tmpdir, "cropped.ppm")
+        md5sum = ppm_utils.get_region_md5sum(WIDTH, HEIGHT, self.data1,
+                                             2, 3, 4, 10)
+        self.assertEqual(md5sum, ppm_utils.get_region_md5sum(
+            WIDTH, HEIGHT, self.data1, 2, 3, 4, 10, cropped))
+        width, height, data = ppm_utils.image_read_from_ppm_file(cropped)
+        self.assertEqual(md5sum, ppm_utils.image_md5sum(width, height, data))
+
+    def test_comparison(self):
+        width, height, data = ppm_utils.image_comparison(
+            WIDTH, HEIGHT, self.data1, self.data2)
+        self.assertEqual((width, height), (WIDTH, HEIGHT))
+        self.assertEqual(data, reference_comparison(WIDTH, HEIGHT,
+                                                    self.data1, self.data2))
+
+    def test_fuzzy_compare(self):
+        self.assertEqual(ppm_utils.image_fuzzy_compare(
+            WIDTH, HEIGHT, self.data1, self.data2), 71.0 / 91)
+        self.assertEqual(ppm_utils.image_fuzzy_compare(
+            WIDTH, HEIGHT, self.data1, self.data1), 1.0)
+
+    def test_map_ppm_file(self):
+        filename = os.path.join(self.tmpdir, "image.ppm")
+        ppm_utils.image_write_to_ppm_file(filename, WIDTH, HEIGHT,
+                                          self.data1)
+        width, height, data = ppm_utils.image_map_ppm_file(filename)
+        self.assertEqual((width, height), (WIDTH, HEIGHT))
+        self.assertEqual(data[:], self.data1)
+        self.assertEqual(ppm_utils.image_md5sum(width, height, data),
+                         ppm_utils.image_md5sum(WIDTH, HEIGHT, self.data1))
+        self.assertEqual(ppm_utils.image_fuzzy_compare(
+            WIDTH, HEIGHT, data, self.data2), 71.0 / 91)
+        self.assertEqual(ppm_utils.image_comparison(
+            WIDTH, HEIGHT, data, self.data2)[2],
+            reference_comparison(WIDTH, HEIGHT, self.data1, self.data2))
+
+
+class ImageOperationsNoNumpy(ImageOperations):
+
+    numpy = None
+
+
+if __name__ == "__main__":
+    unittest.main()
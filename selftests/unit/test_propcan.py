@@ -209,6 +209,19 @@ class TestPropCanBase(unittest.TestCase):
         testdict.update(**kwargs)
         self.assertEqual(testdict, kwargs)
 
+    def test_subclass_slots(self):
+        class FooBar(propcan.PropCanBase):
+            __slots__ = ('foo',)
+
+        class BarFoo(FooBar):
+            __slots__ = FooBar.__slots__ + ('bar',)
+        self.assertEqual(FooBar.__all_slots__, ('foo',))
+        self.assertEqual(set(BarFoo.__all_slots__), set(('foo', 'bar')))
+        testcan = BarFoo(foo=1, bar=2)
+        self.assertEqual(FooBar().__all_slots__, ('foo',))
+        self.assertEqual(testcan, {'foo': 1, 'bar': 2})
+        self.assertRaises(AttributeError, FooBar().__setattr__, 'bar', 2)
+
 
 class TestPropCan(unittest.TestCase):
 
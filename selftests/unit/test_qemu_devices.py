@@ -8,6 +8,8 @@ This is a unittest for qemu_devices library.
 __author__ = """Lukas Doktor (ldoktor@redhat.com)"""
 
 import re
+import shutil
+import tempfile
 import unittest
 import os
 import sys
@@ -563,9 +565,9 @@ class Container(unittest.TestCase):
         self.god.unstub_all()
 
     def create_qdev(self, vm_name='vm1', strict_mode="no",
-                    allow_hotplugged_vm="yes"):
+                    allow_hotplugged_vm="yes", qemu_cmd='/usr/bin/qemu_kvm',
+                    qmp_output=QEMU_QMP):
         """ :return: Initialized qcontainer.DevContainer object """
-        qemu_cmd = '/usr/bin/qemu_kvm'
         qcontainer.process.system_output.expect_call('%s -help' % qemu_cmd,
                                                      timeout=10,
                                                      ignore_status=True,
@@ -610,7 +612,7 @@ class Container(unittest.TestCase):
                                                      ignore_status=True,
                                                      shell=True,
                                                      verbose=False
-                                                     ).and_return(QEMU_QMP)
+                                                     ).and_return(qmp_output)
 
         qdev = qcontainer.DevContainer(qemu_cmd, vm_name, strict_mode, 'no',
                                        allow_hotplugged_vm)
@@ -618,6 +620,59 @@ class Container(unittest.TestCase):
         self.god.check_playback()
         return qdev
 
+    def test_qemu_caps_cache(self):
+        """ Test qemu capabilities are probed once per qemu binary """
+        tmpdir = tempfile.mkdtemp()
+        orig_cache = qcontainer.QEMU_CAPS_CACHE
+        try:
+            qemu_cmd = os.path.join(tmpdir, 'qemu-kvm')
+            open(qemu_cmd, 'w').write('qemu')
+            cache_dir = os.path.join(tmpdir, 'cache')
+            os.mkdir(cache_dir)
+            qcontainer.QEMU_CAPS_CACHE = qcontainer.QemuCapabilitiesCache(
+                cache_dir)
+            qdev = self.create_qdev('vm1', qemu_cmd=qemu_cmd)
+            # No more probes, neither in this process...
+            qdev2 = qcontainer.DevContainer(qemu_cmd, 'vm2')
+            self.god.check_playback()
+            self.assertEqual(qdev2.get_help_text(), QEMU_HELP)
+            self.assertTrue(qdev2.has_qmp_cmd('query-commands'))
+            # ... nor in the next ones
+            qcontainer.QEMU_CAPS_CACHE = qcontainer.QemuCapabilitiesCache(
+                cache_dir)
+            qdev3 = qcontainer.DevContainer(qemu_cmd, 'vm1')
+            self.god.check_playback()
+            self.assertEqual(qdev, qdev3)
+            # Updated binary has to be probed again
+            open(qemu_cmd, 'w').write('updated qemu')
+            self.create_qdev('vm1', qemu_cmd=qemu_cmd)
+        finally:
+            qcontainer.QEMU_CAPS_CACHE = orig_cache
+            shutil.rmtree(tmpdir)
+
+    def test_qemu_caps_cache_failed_probe(self):
+        """ Test failed qemu capability probes are not cached """
+        tmpdir = tempfile.mkdtemp()
+        orig_cache = qcontainer.QEMU_CAPS_CACHE
+        try:
+            qemu_cmd = os.path.join(tmpdir, 'qemu-kvm')
+            open(qemu_cmd, 'w').write('qemu')
+            cache_dir = os.path.join(tmpdir, 'cache')
+            os.mkdir(cache_dir)
+            qcontainer.QEMU_CAPS_CACHE = qcontainer.QemuCapabilitiesCache(
+                cache_dir)
+            # QMP probe timed out
+            qdev = self.create_qdev('vm1', qemu_cmd=qemu_cmd, qmp_output='')
+            self.assertFalse(qdev.has_qmp_cmd('query-commands'))
+            self.assertEqual(os.listdir(cache_dir), [])
+            # Next VM probes again and caches the successful probes
+            qdev = self.create_qdev('vm2', qemu_cmd=qemu_cmd)
+            self.assertTrue(qdev.has_qmp_cmd('query-commands'))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            qcontainer.QEMU_CAPS_CACHE = orig_cache
+            shutil.rmtree(tmpdir)
+
     def test_qdev_functional(self):
         """ Test basic qdev workflow """
         qdev = self.create_qdev('vm1')
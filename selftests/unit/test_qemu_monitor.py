@@ -3,6 +3,12 @@
 import unittest
 import os
 import sys
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
 
 # simple magic for using scripts within a source tree
 basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -193,5 +199,158 @@ sd0: [not inserted]
                                                             out1, out3))
 
 
+class FakeQMPServer(object):
+
+    """
+    Minimal QMP server on a unix socket.  Replies to "slow" come after the
+    given delay from a separate thread, so replies can be out of order.
+    """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(1)
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, obj):
+        with self.send_lock:
+            self.conn.sendall(json.dumps(obj) + "\n")
+
+    def reply(self, req, ret, delay=0):
+        if delay:
+            time.sleep(delay)
+        self.send({"return": ret, "id": req["id"]})
+
+    def serve(self):
+        self.conn = self.sock.accept()[0]
+        self.send({"QMP": {"version": {}, "capabilities": []}})
+        buf = ""
+        while True:
+            data = self.conn.recv(4096)
+            if not data:
+                break
+            buf += data
+            while "\n" in buf:
+                line, buf = buf.split("\n", 1)
+                req = json.loads(line)
+                cmd = req["execute"]
+                if cmd == "query-commands":
+                    self.reply(req, [{"name": "query-status"}])
+                elif cmd == "human-monitor-command":
+                    self.reply(req, "info  -- show info\n")
+                elif cmd == "slow":
+                    t = threading.Thread(target=self.reply,
+                                         args=(req, "slow",
+                                               req["arguments"]["delay"]))
+                    t.start()
+                elif cmd == "stop":
+                    # Split the event in two writes to test partial lines
+                    event = json.dumps({"event": "STOP"}) + "\n"
+                    with self.send_lock:
+                        self.conn.sendall(event[:5])
+                        time.sleep(0.05)
+                        self.conn.sendall(event[5:])
+                    self.reply(req, {})
+                elif "id" in req:
+                    self.reply(req, {})
+                else:
+                    self.send({"return": {}})
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+        self.sock.close()
+
+
+class FakeVM(object):
+    instance = "fake"
+
+
+class QMPEventReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, "qmp")
+        self.server = FakeQMPServer(path)
+        self.monitor = qemu_monitor.QMPMonitor(FakeVM(), "qmp1", path,
+                                               event_reader=True)
+
+    def tearDown(self):
+        self.monitor._close_sock()
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testCmd(self):
+        self.assertEqual(self.monitor.get_greeting()["QMP"]["capabilities"],
+                         [])
+        self.assertEqual(self.monitor._supported_cmds, ["query-status"])
+        self.assertEqual(self.monitor.cmd("query-status"), {})
+        self.assertEqual(self.monitor.cmd_obj({"execute": "cont"}),
+                         {"return": {}})
+
+    def testPipelinedCmds(self):
+        results = {}
+
+        def run(delay):
+            results[delay] = self.monitor.cmd("slow", {"delay": delay})
+        threads = [threading.Thread(target=run, args=(delay,))
+                   for delay in (1.0, 0.1)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        # A fast command is not delayed by the slow ones in flight
+        self.monitor.cmd("query-status")
+        self.assertTrue(time.time() - start < 0.5)
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual(results, {1.0: "slow", 0.1: "slow"})
+
+    def testEvents(self):
+        self.monitor.cmd("stop")
+        self.assertEqual(self.monitor.wait_for_event("STOP", 5),
+                         {"event": "STOP"})
+        self.assertEqual(self.monitor.get_events(), [{"event": "STOP"}])
+        self.monitor.clear_event("STOP")
+        self.assertEqual(self.monitor.get_events(), [])
+        self.assertEqual(self.monitor.wait_for_event("RESUME", 0.1), None)
+
+    def testPopEvents(self):
+        self.monitor.cmd("stop")
+        self.assertEqual(self.monitor.pop_events(["RESUME", "STOP"], 5),
+                         [{"event": "STOP"}])
+        self.assertEqual(self.monitor.get_events(), [])
+        self.assertEqual(self.monitor.pop_events(["STOP"], 0.1), [])
+
+    def testEventsBounded(self):
+        self.monitor._events = qemu_monitor.collections.deque(maxlen=3)
+        for _ in xrange(5):
+            self.monitor.cmd("stop")
+        # Every event was received before the reply to its command
+        self.assertEqual(len(self.monitor.get_events()), 3)
+
+    def testConnectionClosed(self):
+        self.server.close()
+        self.assertRaises(qemu_monitor.MonitorSocketError,
+                          self.monitor.cmd, "slow", {"delay": 1})
+
+    def testReaderFailure(self):
+        def log_lines(line):
+            if threading.current_thread().name.startswith("qmp-reader"):
+                raise qemu_monitor.MonitorLockError("Could not log")
+        self.monitor._log_lines = log_lines
+        start = time.time()
+        self.assertRaises(qemu_monitor.MonitorError,
+                          self.monitor.cmd, "query-status", timeout=2)
+        self.assertTrue(time.time() - start < 1)
+        # Later commands fail right away too
+        self.assertRaises(qemu_monitor.MonitorError,
+                          self.monitor.cmd, "query-status", timeout=2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import qemu_monitor
+from virttest import qemu_vm
+from virttest import utils_params
+from virttest import virt_vm
+from virttest.utils_test import qemu as utils_test_qemu
+
+
+def migration_event(status, seconds):
+    return {"event": "MIGRATION", "data": {"status": status},
+            "timestamp": {"seconds": seconds, "microseconds": 0}}
+
+
+def pass_event(num, seconds, microseconds=0):
+    return {"event": "MIGRATION_PASS", "data": {"pass": num},
+            "timestamp": {"seconds": seconds, "microseconds": microseconds}}
+
+
+class FakeQMPMonitor(qemu_monitor.QMPMonitor):
+
+    """QMP monitor replaying events and 'info migrate' outputs"""
+
+    def __init__(self, events, infos, capability=False):
+        self.name = "qmpmonitor1"
+        self.events = events
+        self.infos = infos
+        self.capability = capability
+        self.capabilities = []
+
+    def __del__(self):
+        # No socket nor log files to close
+        pass
+
+    def get_migrate_capability(self, capability):
+        return self.capability
+
+    def migrate_set_capability(self, state, capability):
+        self.capabilities.append((capability, state))
+
+    def pop_events(self, names, timeout=0):
+        # One event per call, as if they were received one by one
+        if self.events and self.events[0]["event"] in names:
+            return [self.events.pop(0)]
+        return []
+
+    def info(self, what, debug=True):
+        return self.infos.pop(0)
+
+
+class FakeHumanMonitor(qemu_monitor.HumanMonitor):
+
+    def __init__(self):
+        self.name = "hmp1"
+
+    def __del__(self):
+        pass
+
+
+class FakeTest(object):
+
+    def __init__(self):
+        self.keyvals = {}
+
+    def write_test_keyval(self, keyvals):
+        self.keyvals.update(keyvals)
+
+
+class MigrationEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vm = qemu_vm.VM("vm1", utils_params.Params({"nics": ""}),
+                             "/tmp", {})
+
+    def test_completed(self):
+        events = [migration_event("setup", 99), pass_event(1, 100),
+                  pass_event(2, 102, 500000), migration_event("active", 102),
+                  migration_event("completed", 103)]
+        infos = [{"status": "active",
+                  "ram": {"remaining": 1000, "dirty-pages-rate": 10,
+                          "mbps": 100.0}},
+                 {"status": "active",
+                  "ram": {"remaining": 10, "mbps": 120.0}},
+                 {"status": "completed", "total-time": 4000, "downtime": 50,
+                  "ram": {"transferred": 4096, "mbps": 110.0,
+                          "dirty-sync-count": 2}}]
+        self.vm.monitors = [FakeQMPMonitor(events, infos)]
+        checks = []
+        status = self.vm.wait_for_migration_events(60,
+                                                   lambda: checks.append(1))
+        self.assertEqual(status, "completed")
+        self.assertEqual(len(checks), 5)
+        self.assertEqual(self.vm.migration_stats,
+                         {"status": "completed", "passes": 2,
+                          "total_time": 4000, "downtime": 50,
+                          "transferred": 4096, "mbps": 110.0,
+                          "dirty_sync_count": 2,
+                          "pass1_time": "2.500", "pass1_remaining": 1000,
+                          "pass1_dirty_pages_rate": 10, "pass1_mbps": 100.0,
+                          "pass2_time": "0.500", "pass2_remaining": 10,
+                          "pass2_mbps": 120.0})
+        test = FakeTest()
+        utils_test_qemu.write_migration_keyvals(test, self.vm)
+        self.assertEqual(test.keyvals["migration_vm1_pass1_time"], "2.500")
+        self.assertEqual(test.keyvals["migration_vm1_status"], "completed")
+        self.assertEqual(len(test.keyvals), len(self.vm.migration_stats))
+
+    def test_failed(self):
+        events = [migration_event("setup", 99), pass_event(1, 100),
+                  migration_event("failed", 101)]
+        infos = [{"status": "active", "ram": {"remaining": 1000}},
+                 {"status": "failed"}]
+        self.vm.monitors = [FakeQMPMonitor(events, infos)]
+        self.assertEqual(self.vm.wait_for_migration_events(60), "failed")
+        self.assertEqual(self.vm.migration_stats,
+                         {"status": "failed", "passes": 1,
+                          "pass1_time": "1.000", "pass1_remaining": 1000})
+
+    def test_timeout(self):
+        self.vm.monitors = [FakeQMPMonitor([], [])]
+        self.assertRaises(virt_vm.VMMigrateTimeoutError,
+                          self.vm.wait_for_migration_events, 0)
+
+    def test_enable_events(self):
+        monitor = FakeQMPMonitor([pass_event(3, 50)], [], capability=False)
+        self.vm.monitors = [monitor]
+        self.assertTrue(self.vm.enable_migration_events())
+        self.assertEqual(monitor.capabilities, [("events", True)])
+        # Events of previous migrations are dropped
+        self.assertEqual(monitor.events, [])
+        # QEMU without the capability
+        self.vm.monitors = [FakeQMPMonitor([], [], capability=None)]
+        self.assertFalse(self.vm.enable_migration_events())
+
+    def test_hmp_fallback(self):
+        self.vm.monitors = [FakeHumanMonitor()]
+        self.assertFalse(self.vm.enable_migration_events())
+        self.assertEqual(self.vm.migration_stats, {})
+        test = FakeTest()
+        utils_test_qemu.write_migration_keyvals(test, self.vm)
+        self.assertEqual(test.keyvals, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
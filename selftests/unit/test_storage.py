@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import storage
+from virttest import utils_params
+
+
+def make_qcow2_header(backing_file=""):
+    """
+    Just enough of a qcow2 header for get_qcow2_backing_file().
+    """
+    offset = 72 if backing_file else 0
+    header = struct.pack(">4sIQI", "QFI\xfb", 3, offset, len(backing_file))
+    return header.ljust(72, "\0") + backing_file
+
+
+class QcowBackingFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, "image.qcow2")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        with open(self.image, "w") as image:
+            image.write(data)
+
+    def test_backing_file(self):
+        self.write(make_qcow2_header("/images/base.qcow2"))
+        self.assertEqual(storage.get_qcow2_backing_file(self.image),
+                         "/images/base.qcow2")
+
+    def test_no_backing_file(self):
+        self.write(make_qcow2_header())
+        self.assertEqual(storage.get_qcow2_backing_file(self.image), None)
+
+    def test_not_qcow2(self):
+        self.write("\0" * 512)
+        self.assertEqual(storage.get_qcow2_backing_file(self.image), None)
+        self.write("")
+        self.assertEqual(storage.get_qcow2_backing_file(self.image), None)
+
+
+class BackupImage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.params = utils_params.Params({"image_name": "image",
+                                           "image_format": "raw",
+                                           "backup_dir": "backup"})
+        self.image_filename = os.path.join(self.tmpdir, "image.raw")
+        with open(self.image_filename, "w") as image:
+            image.write("pristine")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def backup_and_restore(self, strategy):
+        self.params["image_restore_strategy"] = strategy
+        image = storage.QemuImg(self.params, self.tmpdir, "image")
+        image.backup_image(self.params, self.tmpdir, "backup")
+        backup = os.path.join(self.tmpdir, "backup", "image.raw.backup")
+        self.assertEqual(open(backup).read(), "pristine")
+        with open(self.image_filename, "w") as image_file:
+            image_file.write("dirty")
+        image.backup_image(self.params, self.tmpdir, "restore")
+        self.assertEqual(open(self.image_filename).read(), "pristine")
+        self.assertEqual(open(backup).read(), "pristine")
+        self.assertEqual(os.listdir(os.path.dirname(backup)),
+                         ["image.raw.backup"])
+
+    def test_copy(self):
+        self.backup_and_restore("copy")
+
+    def test_reflink(self):
+        # Falls back to a copy where the filesystem can't clone files
+        self.backup_and_restore("reflink")
+
+    def test_overlay_not_qcow2(self):
+        # Raw images can't have a backing file, falls back to reflink
+        self.backup_and_restore("overlay")
+
+
+if __name__ == "__main__":
+    unittest.main()
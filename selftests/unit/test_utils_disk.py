@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest import utils_disk
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, "cache")
+        os.mkdir(self.cache_dir)
+        self.cache = utils_disk.ImageCache(self.cache_dir, max_entries=2)
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as dst:
+            dst.write(content)
+        return path
+
+    def build(self, content):
+        path = os.path.join(self.tmpdir, "image")
+
+        def build():
+            self.builds.append(content)
+            self.write("image", content)
+        self.cache.build(path, build, content)
+        with open(path) as image:
+            return image.read()
+
+    def test_file_digest(self):
+        path = self.write("a", "content")
+        digest = self.cache.file_digest(path)
+        self.assertEqual(self.cache.file_digest(path), digest)
+        self.write("a", "changed")
+        os.utime(path, (0, 0))
+        self.assertNotEqual(self.cache.file_digest(path), digest)
+
+    def test_tree_digest(self):
+        self.write("tree/a", "a")
+        self.write("tree/sub/b", "b")
+        tree = os.path.join(self.tmpdir, "tree")
+        digest = self.cache.tree_digest(tree)
+        self.assertEqual(self.cache.tree_digest(tree), digest)
+        self.write("tree/sub/b", "c")
+        self.assertNotEqual(self.cache.tree_digest(tree), digest)
+        digest = self.cache.tree_digest(tree)
+        os.rename(os.path.join(tree, "a"), os.path.join(tree, "a2"))
+        self.assertNotEqual(self.cache.tree_digest(tree), digest)
+        digest = self.cache.tree_digest(tree)
+        os.symlink("/nonexistent", os.path.join(tree, "link"))
+        self.assertNotEqual(self.cache.tree_digest(tree), digest)
+
+    def test_build(self):
+        self.assertEqual(self.build("one"), "one")
+        self.assertEqual(self.build("one"), "one")
+        self.assertEqual(self.builds, ["one"])
+        self.assertEqual(self.build("two"), "two")
+        self.assertEqual(self.build("one"), "one")
+        self.assertEqual(self.builds, ["one", "two"])
+
+    def test_prune(self):
+        for content in ("one", "two", "three"):
+            self.build(content)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.build("one")
+        self.assertEqual(self.builds, ["one", "two", "three", "one"])
+
+
+if __name__ == "__main__":
+    unittest.main()
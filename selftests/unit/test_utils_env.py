@@ -5,6 +5,8 @@ import logging
 import os
 import threading
 import sys
+import cPickle
+import sqlite3
 
 # simple magic for using scripts within a source tree
 basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -218,5 +220,140 @@ class TestEnv(unittest.TestCase):
         finally:
             termination_event.set()
 
+
+class Unpicklable(object):
+
+    def __reduce__(self):
+        raise cPickle.PicklingError("Unpicklable")
+
+
+class TestEnvStore(unittest.TestCase):
+
+    def setUp(self):
+        self.envfilename = "/dev/shm/EnvUnittest" + self.id()
+
+    def tearDown(self):
+        if os.path.exists(self.envfilename):
+            os.unlink(self.envfilename)
+
+    def make_env(self):
+        env = utils_env.Env(filename=self.envfilename)
+        env["address_cache"] = {}
+        params = utils_params.Params({"main_vm": 'vm1'})
+        for name in ("vm1", "vm2"):
+            vm = FakeVm(name, params)
+            vm.address_cache = env["address_cache"]
+            env.register_vm(name, vm)
+        env.save()
+        return env
+
+    def test_lazy_load(self):
+        self.make_env()
+        env = utils_env.Env(filename=self.envfilename)
+        self.assertFalse(env.data.is_loaded("vm__vm1"))
+        vm1 = env.get_vm("vm1")
+        self.assertEqual(vm1.name, "vm1")
+        self.assertFalse(env.data.is_loaded("vm__vm2"))
+        self.assertEqual(len(env.get_all_vms()), 2)
+
+    def test_shared_references(self):
+        self.make_env()
+        env = utils_env.Env(filename=self.envfilename)
+        vm1 = env.get_vm("vm1")
+        self.assertTrue(vm1.address_cache is env["address_cache"])
+        self.assertTrue(vm1.address_cache is env.get_vm("vm2").address_cache)
+
+    def test_incremental_save(self):
+        env = self.make_env()
+        conn = sqlite3.connect(self.envfilename)
+
+        def rows():
+            with conn:
+                return set((rowid, cPickle.loads(str(key))) for rowid, key in
+                           conn.execute("SELECT rowid, key FROM env"))
+        old_rows = rows()
+        env["address_cache"]["00:11:22:33:44:55"] = "10.0.0.1"
+        env.save()
+        # Only the changed key was replaced, getting a new rowid
+        changed = rows() - old_rows
+        conn.close()
+        self.assertEqual([key for _, key in changed], ["address_cache"])
+        env2 = utils_env.Env(filename=self.envfilename)
+        self.assertEqual(env2.get_vm("vm1").address_cache,
+                         {"00:11:22:33:44:55": "10.0.0.1"})
+
+    def test_unregister_referenced(self):
+        self.make_env()
+        env = utils_env.Env(filename=self.envfilename)
+        del env["address_cache"]
+        env.unregister_vm("vm2")
+        env.save()
+        env2 = utils_env.Env(filename=self.envfilename)
+        self.assertEqual(env2.get_vm("vm1").address_cache, {})
+        self.assertEqual(env2.get_vm("vm2"), None)
+        self.assertFalse("address_cache" in env2)
+
+    def test_failed_save(self):
+        env = self.make_env()
+        env["broken"] = Unpicklable()
+        env.unregister_vm("vm1")
+        self.assertRaises(cPickle.PicklingError, env.save)
+        env2 = utils_env.Env(filename=self.envfilename)
+        self.assertEqual(env2.get_vm("vm1").name, "vm1")
+        self.assertFalse("broken" in env2)
+
+    def test_old_format(self):
+        params = utils_params.Params({"main_vm": 'vm1'})
+        with open(self.envfilename, "w") as env_file:
+            cPickle.dump({"version": 1, "vm__vm1": FakeVm("vm1", params)},
+                         env_file)
+        env = utils_env.Env(filename=self.envfilename, version=1)
+        self.assertEqual(env.get_vm("vm1").name, "vm1")
+        env.save()
+        env2 = utils_env.Env(filename=self.envfilename, version=1)
+        self.assertFalse(env2.data.is_loaded("vm__vm1"))
+        self.assertEqual(env2.get_vm("vm1").name, "vm1")
+
+    def test_concurrent_load(self):
+        self.make_env()
+        env = utils_env.Env(filename=self.envfilename)
+        store_loads = env.data._store.loads
+
+        def slow_loads(blob, data):
+            time.sleep(0.1)
+            return store_loads(blob, data)
+        env.data._store.loads = slow_loads
+        results = []
+        errors = []
+
+        def get_vm():
+            try:
+                results.append(env.get_vm("vm1"))
+            except Exception, details:
+                errors.append(details)
+        threads = [threading.Thread(target=get_vm) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 4)
+        for vm in results:
+            self.assertTrue(vm is results[0])
+        self.assertTrue(vm.address_cache is env["address_cache"])
+
+    def test_corrupted_value(self):
+        self.make_env()
+        conn = sqlite3.connect(self.envfilename)
+        with conn:
+            conn.execute("UPDATE env SET value = ? WHERE key = ?",
+                         (sqlite3.Binary("garbage"),
+                          sqlite3.Binary(cPickle.dumps("vm__vm2", 2))))
+        conn.close()
+        env = utils_env.Env(filename=self.envfilename)
+        self.assertEqual(env.get_vm("vm2"), None)
+        self.assertEqual(env.get_vm("vm1").name, "vm1")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,8 +2,11 @@
 import unittest
 import logging
 import os
+import re
 import sys
+import time
 
+import aexpect
 from avocado.utils import path
 
 
@@ -14,6 +17,8 @@ if os.path.isdir(os.path.join(basedir, 'virttest')):
 
 from virttest import utils_libguestfs as lgf
 
+LGF_CMD_CHECK = lgf.lgf_cmd_check
+
 
 class LibguestfsTest(unittest.TestCase):
 
@@ -81,5 +86,212 @@ class SlotsCheckTest(unittest.TestCase):
                             "unittest...")
 
 
+class FakeSessionPool(lgf.GuestfsSessionPool):
+
+    """Pool handing out plain objects instead of launched appliances"""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeSessionPool, self).__init__(*args, **kwargs)
+        self.launched = []
+        self.closed = []
+
+    def _launch(self, key):
+        self.launched.append(key)
+        return object()
+
+    def _reset(self, key, session):
+        pass
+
+    def _close(self, session):
+        self.closed.append(session)
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakeSessionPool(idle_timeout=3600, backend="guestfish")
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_reuse(self):
+        with self.pool.session("/tmp/a.img", readonly=True) as session:
+            pass
+        with self.pool.session(["/tmp/a.img"], readonly=True) as again:
+            self.assertTrue(again is session)
+            with self.pool.session("/tmp/a.img", readonly=True) as other:
+                self.assertFalse(other is session)
+            with self.pool.session("/tmp/a.img") as writable:
+                self.assertFalse(writable is session)
+        self.assertEqual(len(self.pool.launched), 3)
+
+    def test_writable_in_use(self):
+        session = self.pool.acquire("/tmp/a.img")
+        self.assertRaises(lgf.LibguestfsCmdError,
+                          self.pool.acquire, "/tmp/a.img")
+        self.pool.release(session)
+        # Writable sessions are not kept
+        self.assertEqual(self.pool.closed, [session])
+        self.assertFalse(self.pool.acquire("/tmp/a.img") is session)
+        self.assertEqual(len(self.pool.launched), 2)
+
+    def test_release_close(self):
+        session = self.pool.acquire("/tmp/a.img", readonly=True)
+        self.pool.release(session, close=True)
+        self.assertEqual(self.pool.closed, [session])
+        self.assertFalse(self.pool.has_idle())
+
+    def test_evict_and_drop(self):
+        a = self.pool.acquire("/tmp/a.img", readonly=True)
+        b = self.pool.acquire(["/tmp/a.img", "/tmp/b.img"], readonly=True)
+        c = self.pool.acquire("/tmp/c.img", readonly=True)
+        for session in (a, b, c):
+            self.pool.release(session)
+        self.pool.evict_idle()
+        self.assertEqual(self.pool.closed, [])
+        self.pool.drop("/tmp/b.img")
+        self.assertEqual(self.pool.closed, [b])
+        self.pool.idle_timeout = 0
+        self.pool.evict_idle()
+        self.assertEqual(sorted(self.pool.closed), sorted([a, b, c]))
+        self.pool.acquire("/tmp/a.img", readonly=True)
+        self.assertEqual(len(self.pool.launched), 4)
+
+    def test_eviction_delay(self):
+        clock = FakeTime(1000.0)
+        lgf.time = clock
+        try:
+            self.pool.release(self.pool.acquire("/tmp/a.img", True))
+            clock.now += 3000
+            self.pool.release(self.pool.acquire("/tmp/b.img", True))
+            self.pool.evict_idle()
+            # The timer fires when /tmp/a.img's session expires
+            timer = self.pool._GuestfsSessionPool__timer
+            self.assertEqual(timer.interval, 600)
+            clock.now += 600
+            self.pool.evict_idle()
+            self.assertEqual(len(self.pool.closed), 1)
+            timer = self.pool._GuestfsSessionPool__timer
+            self.assertEqual(timer.interval, 3000)
+        finally:
+            lgf.time = time
+
+
+class FakeTime(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeGuestfishShell(object):
+
+    """Shell session of a fake pooled GuestfishPersistent"""
+
+    ERROR_REGEX_LIST = lgf.GuestfishSession.ERROR_REGEX_LIST
+
+    def __init__(self):
+        self.commands = []
+        self.timeouts = []
+
+    def match_patterns(self, line, patterns):
+        for index, pattern in enumerate(patterns):
+            if re.search(pattern, line):
+                return index
+
+    def cmd_status_output(self, command, timeout=60):
+        self.commands.append(command)
+        self.timeouts.append(timeout)
+        if command == "fail":
+            return 1, "libguestfs: error: fail\n"
+        if command == "hang":
+            raise aexpect.ShellTimeoutError(command, "")
+        return 0, "%s\n" % command
+
+
+class FakeGuestfishSession(object):
+
+    def __init__(self):
+        self.shell = FakeGuestfishShell()
+
+    def open_session(self):
+        return self.shell
+
+
+class FakeGuestfishPool(FakeSessionPool):
+
+    def _launch(self, key):
+        self.launched.append(key)
+        return FakeGuestfishSession()
+
+
+class PooledGuestfishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakeGuestfishPool(idle_timeout=3600, backend="guestfish")
+        lgf._SESSION_POOLS["guestfish"] = self.pool
+        # Commands run in the fake pool, guestfish is never executed
+        lgf.lgf_cmd_check = lambda cmd: "/usr/bin/%s" % cmd
+
+    def tearDown(self):
+        lgf.lgf_cmd_check = LGF_CMD_CHECK
+        del lgf._SESSION_POOLS["guestfish"]
+        self.pool.close()
+
+    def test_complete_cmd(self):
+        gf = lgf.Guestfish(disk_img="/tmp/a.img", ro_mode=True, pooled=True)
+        gf.set_timeout(30)
+        result = gf.complete_cmd("run : list-filesystems : cat '/a : b'")
+        self.assertEqual(result.exit_status, 0)
+        self.assertEqual(result.stdout, "list-filesystems\ncat '/a : b'\n")
+        gf = lgf.Guestfish(disk_img="/tmp/a.img", ro_mode=True, pooled=True)
+        gf.complete_cmd("run : mountpoints")
+        self.assertEqual(self.pool.launched,
+                         [(("/tmp/a.img",), True)])
+        self.assertTrue(lgf.has_pooled_sessions())
+        lgf.drop_pooled_sessions(["/tmp/a.img"])
+        shell = self.pool.closed[0].shell
+        self.assertEqual(shell.commands, ["list-filesystems",
+                                          "cat '/a : b'", "mountpoints"])
+        self.assertEqual(shell.timeouts, [30, 30, 60])
+        self.assertFalse(lgf.has_pooled_sessions())
+
+    def test_complete_cmd_failure(self):
+        gf = lgf.Guestfish(disk_img="/tmp/a.img", ro_mode=True, pooled=True)
+        gf.set_ignore_status(False)
+        self.assertRaises(lgf.LibguestfsCmdError, gf.complete_cmd,
+                          "run : fail : df")
+        gf.set_ignore_status(True)
+        result = gf.complete_cmd("run : fail : df")
+        self.assertEqual(result.exit_status, 1)
+        self.assertEqual(result.stdout, "")
+        self.assertEqual(result.stderr, "libguestfs: error: fail\n")
+        # The session went back to the pool
+        self.assertEqual(len(self.pool.launched), 1)
+        # ... unless it was left in an unknown state
+        result = gf.complete_cmd("run : hang : df")
+        self.assertEqual(result.exit_status, 1)
+        self.assertEqual(self.pool.closed[0].shell.commands,
+                         ["fail", "fail", "hang"])
+        self.assertFalse(lgf.has_pooled_sessions())
+
+    def test_split_cmds(self):
+        self.assertEqual(lgf.split_guestfish_cmds(
+            "run : write /f 'a : b' : ll \"/my dir\""),
+            ["run", "write /f 'a : b'", "ll '/my dir'"])
+
+    def test_not_pooled(self):
+        for options in ({"inspector": True}, {"libvirt_domain": "vm"},
+                        {"run_mode": "remote"}):
+            gf = lgf.Guestfish(disk_img="/tmp/a.img", pooled=True,
+                               **options)
+            self.assertEqual(gf.pool_key, None)
+        # Pooling is opt-in
+        gf = lgf.Guestfish(disk_img="/tmp/a.img")
+        self.assertEqual(gf.pool_key, None)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,10 @@
 #!/usr/bin/python
 
 import os
+import shutil
 import tempfile
+import threading
+import time
 import unittest
 import sys
 
@@ -95,6 +98,57 @@ git_repo_foo_commit = bc732ad8b2ed8be52160b893735417b43a1e91a8
         self.assertEqual(n6, "1048576.0")
 
 
+class TestLogFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, "serial.log")
+        self.follower = utils_misc.LogFollower(self.log,
+                                               ["Post set up finished",
+                                                "ack"])
+
+    def tearDown(self):
+        self.follower.close()
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data, mode="a"):
+        with open(self.log, mode) as log:
+            log.write(data)
+
+    def test_missing(self):
+        self.assertRaises(IOError, self.follower.poll)
+
+    def test_across_reads(self):
+        self.follower.read_size = 7
+        self.append("booting...\nPost set")
+        self.assertEqual(self.follower.poll(), [])
+        offset = self.follower.offset
+        self.append(" up finished\n")
+        self.assertEqual(self.follower.poll(), ["Post set up finished"])
+        self.assertEqual(self.follower.offset, offset + 13)
+        self.append("ack\n")
+        self.assertEqual(self.follower.poll(), ["Post set up finished",
+                                                "ack"])
+
+    def test_truncated(self):
+        self.append("a" * 100)
+        self.follower.poll()
+        self.append("ack", mode="w")
+        self.assertEqual(self.follower.poll(), ["ack"])
+
+    def test_wait_for(self):
+        self.append("")
+        writer = threading.Timer(0.2, self.append, ["ack\n"])
+        writer.start()
+        try:
+            start = time.time()
+            self.assertEqual(self.follower.wait_for(10), ["ack"])
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            writer.join()
+        self.assertEqual(self.follower.wait_for(0.1), ["ack"])
+
+
 class FakeCmd(object):
 
     def __init__(self, cmd):
@@ -7,6 +7,9 @@ import sys
 import random
 import os
 import shelve
+import shutil
+import subprocess
+import tempfile
 
 from avocado.utils import process
 
@@ -685,10 +688,96 @@ class TestVmNetSubclasses(unittest.TestCase):
 
     def test_99_ifname(self):
         # cleanup
+        for filename in (self.db_filename, self.db_filename + ".macs"):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+
+class TestMacIndex(unittest.TestCase):
+
+    mac_prefix = "9a:00:00:00:00:"
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.tmpdir, "address_pool")
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def virtnet(self, vm_name, nics="nic1 nic2"):
+        params = utils_params.Params({"nics": nics, "vms": vm_name})
+        virtnet = utils_net.VirtNet(params, vm_name, vm_name,
+                                    self.db_filename)
+        virtnet.mac_prefix = self.mac_prefix
+        # MAC generator produces from incrementing byte list
+        virtnet.container_class.LASTBYTE = -1
+        return virtnet
+
+    def index(self, virtnet):
+        virtnet.lock_db()
         try:
-            os.unlink(self.db_filename)
-        except OSError:
-            pass
+            return virtnet.load_mac_index()
+        finally:
+            virtnet.unlock_db()
+
+    def test_batch(self):
+        vm1 = self.virtnet("vm1", "nic1 nic2 nic3")
+        macs = vm1.generate_mac_addresses()
+        self.assertEqual(macs, ["%s%02x" % (self.mac_prefix, byte)
+                                for byte in xrange(3)])
+        self.assertEqual(vm1.mac_list(), macs)
+        # Already set, nothing to do
+        self.assertEqual(vm1.generate_mac_addresses(), [])
+        vm2 = self.virtnet("vm2")
+        self.assertEqual(vm2.generate_mac_addresses(),
+                         ["%s%02x" % (self.mac_prefix, byte)
+                          for byte in xrange(3, 5)])
+        self.assertEqual(sorted(self.index(vm2)["macs"].values()),
+                         ["vm1"] * 3 + ["vm2"] * 2)
+        vm1.free_mac_address("nic2")
+        self.assertFalse(macs[1] in self.index(vm2)["macs"])
+
+    def test_rebuild(self):
+        vm1 = self.virtnet("vm1")
+        macs = vm1.generate_mac_addresses()
+        os.unlink(self.db_filename + ".macs")
+        index = self.index(vm1)
+        self.assertEqual(index["macs"], dict((mac, "vm1") for mac in macs))
+        # Entries of unknown origin are never reclaimed
+        self.assertEqual(index["owners"], {"vm1": None})
+
+    def test_reclaim(self):
+        vm1 = self.virtnet("vm1")
+        vm1.generate_mac_addresses()
+        # Pretend vm1 was saved by a process group which is gone
+        child = subprocess.Popen(["true"], preexec_fn=os.setpgrp)
+        child.wait()
+        vm1.lock_db()
+        index = vm1.load_mac_index()
+        index["owners"]["vm1"] = child.pid
+        vm1.save_mac_index(index)
+        vm1.unlock_db()
+        vm2 = self.virtnet("vm2")
+        self.assertEqual(vm2.generate_mac_addresses(),
+                         ["%s%02x" % (self.mac_prefix, byte)
+                          for byte in xrange(2)])
+        self.assertEqual(self.index(vm2)["owners"].keys(), ["vm2"])
+
+    def test_exhausted(self):
+        vm0 = self.virtnet("vm0", "nic1")
+        vm0.set_mac_address("nic1", "%s02" % self.mac_prefix)
+        vm1 = self.virtnet("vm1")
+        vm1.container_class.LASTBYTE = 0
+        self.assertRaises(utils_net.NetError, vm1.generate_mac_addresses,
+                          None, 1)
+        # The first NIC got its address before the failure
+        self.assertEqual(sorted(self.index(vm1)["macs"].items()),
+                         [("%s01" % self.mac_prefix, "vm1"),
+                          ("%s02" % self.mac_prefix, "vm0")])
 
 
 if __name__ == '__main__':
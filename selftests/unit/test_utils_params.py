@@ -9,6 +9,7 @@ basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if os.path.isdir(os.path.join(basedir, 'virttest')):
     sys.path.append(basedir)
 
+from virttest import cartesian_config
 from virttest import utils_params
 
 BASE_DICT = {
@@ -86,6 +87,16 @@ class TestParams(unittest.TestCase):
     def testGetItem(self):
         self.assertEqual(self.params['image_size'], "10G")
 
+    def testLayeredDict(self):
+        compactor = cartesian_config.DictCompactor()
+        compactor.compact(BASE_DICT)
+        layered = compactor.compact(dict(BASE_DICT, image_size='20G'))
+        params = utils_params.Params(layered)
+        self.assertEqual(params['image_size'], "20G")
+        for key in CORRECT_RESULT_MAPPING.keys():
+            self.assertEquals(params.object_params(key)['image_format'],
+                              CORRECT_RESULT_MAPPING[key]['image_format'])
+
 
 if __name__ == "__main__":
     unittest.main()
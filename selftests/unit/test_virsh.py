@@ -4,6 +4,8 @@ import unittest
 import logging
 import os
 import sys
+import threading
+import time
 
 from avocado.utils import process
 
@@ -218,6 +220,266 @@ class ConstructorsTest(ModuleLoad):
         del vc  # keep pylint happy
 
 
+class FakeLibvirtError(Exception):
+
+    def get_error_message(self):
+        return self.args[0]
+
+
+class FakeDomain(object):
+
+    def __init__(self, dom_id, name, state):
+        self.dom_id = dom_id
+        self.dom_name = name
+        self.dom_state = state
+
+    def ID(self):
+        return self.dom_id
+
+    def name(self):
+        return self.dom_name
+
+    def UUIDString(self):
+        return "%036d" % abs(self.dom_id)
+
+    def state(self):
+        return self.dom_state
+
+    def createWithFlags(self, flags):
+        self.dom_id = 3
+        self.dom_state = [3 if flags & 1 else 1, 1]
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.domains = [FakeDomain(2, "vm2", [1, 1]),
+                        FakeDomain(-1, "vm3", [5, 2]),
+                        FakeDomain(1, "vm1", [3, 1])]
+        self.alive = True
+
+    def isAlive(self):
+        return self.alive
+
+    def close(self):
+        pass
+
+    def lookupByID(self, dom_id):
+        for dom in self.domains:
+            if dom.ID() == dom_id:
+                return dom
+        raise FakeLibvirtError("Domain not found: no domain with matching "
+                               "id %d" % dom_id)
+
+    def lookupByUUIDString(self, uuid):
+        for dom in self.domains:
+            if dom.UUIDString() == uuid:
+                return dom
+        raise FakeLibvirtError("Domain not found")
+
+    def lookupByName(self, name):
+        for dom in self.domains:
+            if dom.name() == name:
+                return dom
+        raise FakeLibvirtError("Domain not found: no domain with matching "
+                               "name '%s'" % name)
+
+    def listAllDomains(self, flags):
+        if flags & 1:
+            return [dom for dom in self.domains if dom.ID() >= 0]
+        if flags & 2:
+            return [dom for dom in self.domains if dom.ID() < 0]
+        return self.domains
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        self.event_callback = callback
+        return 1
+
+    def domainEventDeregisterAny(self, callback_id):
+        self.event_callback = None
+
+    def registerCloseCallback(self, callback, opaque):
+        self.close_callback = callback
+
+    def unregisterCloseCallback(self):
+        self.close_callback = None
+
+    def emit(self, name, event, detail=0):
+        self.event_callback(self, FakeDomain(-1, name, None), event, detail,
+                            None)
+
+
+class FakeLibvirt(object):
+
+    libvirtError = FakeLibvirtError
+    VIR_DOMAIN_EVENT_ID_LIFECYCLE = 0
+
+    def __init__(self):
+        self.opened = []
+        self.timeouts = {}
+
+    def open(self, uri):
+        self.opened.append(uri)
+        return FakeConnection()
+
+    openReadOnly = open
+
+    def virEventAddTimeout(self, interval, callback, opaque):
+        timer = len(self.timeouts) + 1
+        self.timeouts[timer] = callback
+        return timer
+
+    def virEventRemoveTimeout(self, timer):
+        del self.timeouts[timer]
+
+    def tick(self):
+        for timer, callback in self.timeouts.items():
+            callback(timer, None)
+
+
+class VirshAPITest(ModuleLoad):
+
+    def setUp(self):
+        from virttest import virsh_api
+        self.virsh_api = virsh_api
+        self.saved_libvirt = virsh_api.libvirt
+        virsh_api.libvirt = self.libvirt = FakeLibvirt()
+        virsh_api.POOL.clear()
+        self.api_virsh = self.virsh.VirshAPI(uri='qemu:///system')
+
+    def tearDown(self):
+        self.virsh_api.POOL.clear()
+        self.virsh_api.libvirt = self.saved_libvirt
+
+    def test_domstate(self):
+        result = self.api_virsh.domstate("vm1")
+        self.assertEqual(result.exit_status, 0)
+        self.assertEqual(result.stdout.strip(), "paused")
+        result = self.api_virsh.domstate("vm3", "--reason")
+        self.assertEqual(result.stdout.strip(), "shut off (destroyed)")
+        self.assertTrue(self.api_virsh.is_alive("2"))
+        self.assertTrue(self.api_virsh.is_dead("vm3"))
+        self.assertTrue(self.api_virsh.is_dead("vm4"))
+
+    def test_errors(self):
+        result = self.api_virsh.domstate("vm4", ignore_status=True)
+        self.assertEqual(result.exit_status, 1)
+        self.assertTrue("Domain not found" in result.stderr)
+        self.assertRaises(process.CmdError, self.api_virsh.domstate, "vm4",
+                          ignore_status=False)
+
+    def test_list(self):
+        result = self.api_virsh.dom_list("--all")
+        lines = result.stdout.splitlines()
+        self.assertEqual(lines[2:], [" 1     vm1%s paused" % (" " * 27),
+                                     " 2     vm2%s running" % (" " * 27),
+                                     " -     vm3%s shut off" % (" " * 27),
+                                     ""])
+        result = self.api_virsh.dom_list("--name")
+        self.assertEqual(result.stdout.split(), ["vm1", "vm2"])
+
+    def test_start(self):
+        result = self.api_virsh.start("vm3", "--paused")
+        self.assertEqual(result.stdout.strip(), "Domain vm3 started")
+        self.assertEqual(self.api_virsh.domid("vm3").stdout.strip(), "3")
+
+    def test_connection_pool(self):
+        for _ in xrange(3):
+            self.api_virsh.domstate("vm1")
+        self.assertEqual(self.libvirt.opened, ['qemu:///system'])
+        # Dead connections are replaced
+        self.virsh_api.POOL._idle.values()[0][0].alive = False
+        self.api_virsh.domstate("vm1")
+        self.assertEqual(len(self.libvirt.opened), 2)
+
+    def test_not_supported(self):
+        self.assertRaises(self.virsh_api.APINotSupported,
+                          self.virsh_api.domstate, "vm1", "--unknown")
+        self.assertRaises(self.virsh_api.APINotSupported,
+                          self.virsh_api.domstate, "vm1",
+                          unprivileged_user="user")
+        # The virsh executable is run instead
+        result = self.api_virsh.domstate("vm1", "--unknown")
+        self.assertTrue(result.command.startswith(self.virsh.VIRSH_EXEC))
+        self.assertFalse(self.libvirt.opened)
+
+
+class DomainStateTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        from virttest import virsh_api
+        self.virsh_api = virsh_api
+        self.saved_libvirt = virsh_api.libvirt
+        virsh_api.libvirt = self.libvirt = FakeLibvirt()
+        self.tracker = virsh_api.DomainStateTracker('qemu:///system')
+        self.conn = self.tracker._conn
+        self.timers = []
+
+    def tearDown(self):
+        for timer in self.timers:
+            timer.join()
+        self.tracker.close()
+        self.virsh_api.libvirt = self.saved_libvirt
+
+    def later(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.start()
+        self.timers.append(timer)
+
+    def test_initial_states(self):
+        self.assertEqual(self.tracker.state("vm1"), "paused")
+        self.assertEqual(self.tracker.state("vm2"), "running")
+        self.assertEqual(self.tracker.state("vm3"), "shut off")
+        self.assertEqual(self.tracker.state("vm4"), None)
+
+    def test_events(self):
+        self.conn.emit("vm1", 4)
+        self.assertEqual(self.tracker.state("vm1"), "running")
+        self.conn.emit("vm2", 5)
+        self.assertEqual(self.tracker.state("vm2"), "shut off")
+        self.conn.emit("vm4", 0)
+        self.assertEqual(self.tracker.state("vm4"), "shut off")
+        self.conn.emit("vm4", 2)
+        self.assertEqual(self.tracker.state("vm4"), "running")
+        # Undefining a running domain makes it transient
+        self.conn.emit("vm4", 1)
+        self.assertEqual(self.tracker.state("vm4"), "running")
+        self.conn.emit("vm3", 1)
+        self.assertEqual(self.tracker.state("vm3"), None)
+
+    def test_wait_for_state(self):
+        self.later(0.1, self.conn.emit, "vm2", 6)
+        self.later(0.2, self.conn.emit, "vm2", 5)
+        start = time.time()
+        self.assertTrue(self.tracker.wait_for_state(
+            "vm2", self.virsh_api.DEAD_STATES, 10))
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(self.tracker.state("vm2"), "shut off")
+        # Undefined domains
+        self.assertTrue(self.tracker.wait_for_state("vm4", (None,), 0))
+
+    def test_wait_timeout(self):
+        # Waiters check their timeout on ticks of the event loop
+        for delay in (0.1, 0.2, 0.3):
+            self.later(delay, self.libvirt.tick)
+        self.assertFalse(self.tracker.wait_for_state("vm2", ("paused",),
+                                                     0.15))
+
+    def test_connection_closed(self):
+        self.later(0.1, self.conn.close_callback, self.conn, 0, None)
+        self.assertRaises(self.virsh_api.APINotSupported,
+                          self.tracker.wait_for_state, "vm2", ("paused",), 10)
+        self.assertRaises(self.virsh_api.APINotSupported,
+                          self.tracker.state, "vm2")
+        self.assertFalse(self.libvirt.timeouts)
+
+    def test_no_libvirt(self):
+        self.virsh_api.libvirt = None
+        self.assertRaises(self.virsh_api.APINotSupported,
+                          self.virsh_api.state_tracker)
+        self.virsh_api.libvirt = self.libvirt
+
+
 # Ensure the following tests ONLY run if a valid virsh command exists #####
 class ModuleLoadCheckVirsh(unittest.TestCase):
     from virttest import virsh
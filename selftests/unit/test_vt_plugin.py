@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+import argparse
+import os
+import sys
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from avocado.core.plugins import vt
+
+
+class FakeParser(object):
+
+    """Cartesian parser counting the dicts it generated"""
+
+    def __init__(self, count):
+        self.count = count
+        self.generated = 0
+
+    def get_dicts(self):
+        for index in xrange(self.count):
+            self.generated += 1
+            yield {"name": "test%d" % index,
+                   "_short_name_map_file": {"subtests.cfg": "t%d" % index}}
+
+
+class FakeLoader(vt.VirtTestLoader):
+
+    def __init__(self, parser):
+        args = argparse.Namespace(vt_type="qemu", vt_config="fake.cfg")
+        super(FakeLoader, self).__init__(args, {})
+        self.parser = parser
+
+    def _get_parser(self):
+        return self.parser
+
+
+class LazyTestSuiteTest(unittest.TestCase):
+
+    def test_empty(self):
+        suite = vt.LazyTestSuite(iter([]))
+        self.assertFalse(suite)
+        self.assertEqual(list(suite), [])
+
+    def test_nonzero_keeps_factory(self):
+        suite = vt.LazyTestSuite(iter(range(3)))
+        self.assertTrue(suite)
+        self.assertTrue(suite)
+        self.assertEqual(list(suite), [0, 1, 2])
+        self.assertFalse(suite)
+
+    def test_discover_is_lazy(self):
+        parser = FakeParser(3)
+        suite = FakeLoader(parser).discover(None)
+        self.assertEqual(parser.generated, 0)
+        # As the core loader does with the discovered tests
+        tests = []
+        if suite:
+            self.assertEqual(parser.generated, 1)
+            tests.extend(suite)
+        self.assertEqual(parser.generated, 3)
+        self.assertEqual([params["name"] for _, params in tests],
+                         ["t0", "t1", "t2"])
+        for test_class, params in tests:
+            self.assertTrue(test_class is vt.VirtTest)
+            self.assertEqual(params["params"]["id"], params["name"])
+
+
+if __name__ == "__main__":
+    unittest.main()
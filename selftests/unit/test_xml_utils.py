@@ -305,6 +305,77 @@ class test_XMLTreeFile(xml_test_data):
         self.assertFalse(testxml.find('foo/bar/baz') is not None)
         testxml.create_by_xpath('foo/bar/baz')
         self.assertTrue(testxml.find('foo/bar/baz') is not None)
+        self.assertEqual(testxml.get_xpath(testxml.find('foo/bar/baz')),
+                         'foo/bar/baz')
+
+    def test_get_parent(self):
+        testxml = self.class_to_test(self.XMLSTR)
+        cpu = testxml.find('host/cpu')
+        arch = testxml.find('host/cpu/arch')
+        self.assertTrue(testxml.get_parent(arch) is cpu)
+        self.assertTrue(testxml.get_parent(testxml.getroot()) is None)
+        # Removed through the tree
+        testxml.remove(arch)
+        self.assertTrue(testxml.get_parent(arch) is None)
+        self.assertRaises(KeyError, testxml.get_xpath, arch)
+        # Added behind the tree's back
+        guest = testxml.find('guest')
+        guest.append(arch)
+        self.assertTrue(testxml.get_parent(arch) is guest)
+        self.assertEqual(testxml.get_xpath(arch), 'guest/arch')
+        new = ElementTree.SubElement(arch, 'new')
+        self.assertEqual(testxml.get_xpath(new), 'guest/arch/new')
+        # Parsed again
+        testxml.restore()
+        self.assertTrue(testxml.get_parent(cpu) is None)
+        self.assertTrue(testxml.get_parent(testxml.find('host/cpu')) is
+                        testxml.find('host'))
+
+
+class test_MemXMLTreeFile(test_XMLTreeFile):
+
+    class_to_test = xml_utils.MemXMLTreeFile
+
+    def test_sourcebackupfile_closed_file(self):
+        xml = self.class_to_test(self.XMLFILE)
+        self.assertEqual(xml.sourcebackupfile, None)
+
+    def test_sourcebackupfile_closed_string(self):
+        xml = self.class_to_test(self.XMLSTR)
+        self.assertEqual(xml.sourcebackupfile, None)
+
+    def test_init_str(self):
+        xml = self.class_to_test(self.XMLSTR)
+        self.assertEqual(xml.sourcefilename, None)
+        self.assertEqual(self.get_tmp_files(xml_utils.TMPPFX,
+                                            xml_utils.TMPSFX),
+                         [self.XMLFILE])
+
+    def test_init_xml(self):
+        xml = self.class_to_test(self.XMLFILE)
+        self.assertEqual(xml.sourcefilename, self.XMLFILE)
+
+    def test_restore_from_string(self):
+        xmlbackup = self.class_to_test(self.XMLSTR)
+        xmlbackup.find('guest/arch/wordsize').text = 'FOOBAR'
+        xmlbackup.restore()
+        self.assertEqual(str(xmlbackup), self.XMLSTR)
+
+    def test_restore_from_file(self):
+        xmlbackup = self.class_to_test(self.XMLFILE)
+        os.unlink(xmlbackup.sourcefilename)
+        xmlbackup.backup()
+        self.assertTrue(self.is_same_contents(xmlbackup.sourcefilename))
+
+    def test_name(self):
+        xml = self.class_to_test(self.XMLSTR)
+        name = xml.name
+        self.assertTrue(self.is_same_contents(name))
+        xml.find('guest/arch/wordsize').text = 'FOOBAR'
+        self.assertEqual(xml.name, name)
+        self.assertFalse(self.is_same_contents(name))
+        del xml
+        self.assertRaises(OSError, os.stat, name)
 
 
 class test_templatized_xml(xml_test_data):
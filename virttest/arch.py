@@ -38,6 +38,8 @@ if ARCH in ('ppc64', 'ppc64le'):
     NLMSG_ERROR = 2
     # From linux/socket.h
     AF_PACKET = 17
+    # From linux/include/uapi/linux/fs.h
+    FICLONE = 0x80049409
 else:
     # From include/linux/sockios.h
     SIOCSIFHWADDR = 0x8924
@@ -72,6 +74,8 @@ else:
     NLMSG_ERROR = 2
     # From linux/socket.h
     AF_PACKET = 17
+    # From linux/include/uapi/linux/fs.h
+    FICLONE = 0x40049409
 
 
 def get_kvm_module_list():
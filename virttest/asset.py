@@ -9,6 +9,11 @@ import ConfigParser
 import StringIO
 import commands
 import shutil
+import copy
+import imp
+import sys
+import hashlib
+import threading
 from distutils import dir_util  # virtualenv problem pylint: disable=E0611
 
 from avocado.utils import process
@@ -16,6 +21,7 @@ from avocado.utils import genio
 from avocado.utils import crypto
 from avocado.utils import download
 from avocado.utils import git
+from avocado.utils import output
 
 from . import data_dir
 
@@ -201,6 +207,47 @@ def get_known_backends():
     return known_backends
 
 
+# Process wide caches of the test provider data, see
+# _sync_test_providers_dir(), get_test_provider_info(), get_test_dir_index()
+# and load_test_module()
+_TEST_PROVIDERS_SYNC = {}
+_TEST_PROVIDER_INFO = {}
+_TEST_DIR_INDEXES = {}
+_TEST_MODULES = {}
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _sync_test_providers_dir():
+    """
+    Copy the base test-providers.d to the data dir one.
+
+    The copy is skipped when neither the base files nor their copies
+    changed since the last copy done by this process.
+    """
+    tp_base_dir = data_dir.get_base_test_providers_dir()
+    tp_local_dir = data_dir.get_test_providers_dir()
+    names = []
+    for dirpath, _, filenames in os.walk(tp_base_dir):
+        for filename in filenames:
+            names.append(os.path.relpath(os.path.join(dirpath, filename),
+                                         tp_base_dir))
+    mtimes = dict((name, (_get_mtime(os.path.join(tp_base_dir, name)),
+                          _get_mtime(os.path.join(tp_local_dir, name))))
+                  for name in names)
+    if _TEST_PROVIDERS_SYNC.get(tp_local_dir) == mtimes:
+        return
+    dir_util.copy_tree(tp_base_dir, tp_local_dir)
+    _TEST_PROVIDERS_SYNC[tp_local_dir] = dict(
+        (name, (mtimes[name][0], _get_mtime(os.path.join(tp_local_dir, name))))
+        for name in names)
+
+
 def get_test_provider_names(backend=None):
     """
     Get the names of all test providers available in test-providers.d.
@@ -208,9 +255,7 @@ def get_test_provider_names(backend=None):
     :return: List with the names of all test providers.
     """
     provider_name_list = []
-    tp_base_dir = data_dir.get_base_test_providers_dir()
-    tp_local_dir = data_dir.get_test_providers_dir()
-    dir_util.copy_tree(tp_base_dir, tp_local_dir)
+    _sync_test_providers_dir()
     provider_dir = data_dir.get_test_providers_dir()
     for provider in glob.glob(os.path.join(provider_dir, '*.ini')):
         provider_name = os.path.basename(provider).split('.')[0]
@@ -254,11 +299,25 @@ def get_test_provider_info(provider):
     * backends that this provider has tests for. For each backend type the
         provider has tests for, the 'path' will be also available.
 
+    The info is cached until the provider .ini file changes.
+
     :param provider: Test provider name, such as 'io-github-autotest-qemu'.
     """
-    provider_info = {}
     provider_path = os.path.join(data_dir.get_test_providers_dir(),
                                  '%s.ini' % provider)
+    mtime = _get_mtime(provider_path)
+    cached = _TEST_PROVIDER_INFO.get(provider_path)
+    if mtime is not None and cached is not None and cached[0] == mtime:
+        return copy.deepcopy(cached[1])
+    provider_info = _load_test_provider_info(provider, provider_path)
+    if mtime is not None:
+        _TEST_PROVIDER_INFO[provider_path] = (mtime,
+                                              copy.deepcopy(provider_info))
+    return provider_info
+
+
+def _load_test_provider_info(provider, provider_path):
+    provider_info = {}
     provider_cfg = ConfigLoader(provider_path)
     provider_info['name'] = provider
     provider_info['uri'] = provider_cfg.get('provider', 'uri')
@@ -290,6 +349,127 @@ def get_test_provider_info(provider):
     return provider_info
 
 
+class TestDirIndex(object):
+
+    """
+    Index of the test modules beneath a test directory.
+
+    Maps each test type to the first directory of the data_dir.SubdirList
+    of the test directory holding '<type>.py'.  The mtimes of the indexed
+    directories are recorded, a lookup that fails or finds a removed module
+    rebuilds the index if any of them changed.
+    """
+
+    def __init__(self, basedir, filterlist=None):
+        """
+        :param basedir: The test directory
+        :param filterlist: Filter list of data_dir.SubdirList
+        """
+        self.basedir = basedir
+        self.filterlist = filterlist
+        self.subdirs = []
+        self.modules = {}
+        self._mtimes = {}
+        self.build()
+
+    def build(self):
+        """
+        Walk the test directory and (re)build the index.
+        """
+        self.subdirs = data_dir.SubdirList(self.basedir, self.filterlist)
+        self.modules = {}
+        self._mtimes = {}
+        for subdir in self.subdirs:
+            self._mtimes[subdir] = _get_mtime(subdir)
+            try:
+                filenames = os.listdir(subdir)
+            except OSError:
+                continue
+            for filename in filenames:
+                if filename.endswith(".py"):
+                    self.modules.setdefault(filename[:-3], subdir)
+
+    def changed(self):
+        """
+        :return: True if any indexed directory changed since the last build
+        """
+        for subdir, mtime in self._mtimes.iteritems():
+            if _get_mtime(subdir) != mtime:
+                return True
+        return False
+
+    def find(self, t_type):
+        """
+        :param t_type: The test type
+        :return: The directory holding '<t_type>.py' or None
+        """
+        subdir = self.modules.get(t_type)
+        if subdir is not None:
+            if os.path.isfile(os.path.join(subdir, "%s.py" % t_type)):
+                return subdir
+        if not self.changed():
+            return None
+        self.build()
+        return self.modules.get(t_type)
+
+
+def get_test_dir_index(basedir, filterlist=None):
+    """
+    Get the index of the test modules beneath a test directory.
+
+    The indexes are kept for the whole process, so every directory is only
+    walked once per job.
+
+    :param basedir: The test directory
+    :param filterlist: Filter list of data_dir.SubdirList
+    :return: TestDirIndex object
+    """
+    key = (os.path.abspath(basedir), tuple(filterlist or ()))
+    if key not in _TEST_DIR_INDEXES:
+        _TEST_DIR_INDEXES[key] = TestDirIndex(basedir, filterlist)
+    return _TEST_DIR_INDEXES[key]
+
+
+def find_test_dir(t_type, indexes):
+    """
+    Find the directory of a test module.
+
+    :param t_type: The test type
+    :param indexes: TestDirIndex objects, searched in order
+    :return: The directory holding '<t_type>.py' or None
+    """
+    for index in indexes:
+        subdir = index.find(t_type)
+        if subdir is not None:
+            return subdir
+    return None
+
+
+def load_test_module(t_type, subtest_dir):
+    """
+    Import the module of a test.
+
+    Already imported modules are reused, unless their file changed.
+
+    :param t_type: The test type
+    :param subtest_dir: The directory holding '<t_type>.py'
+    :return: The test module
+    """
+    module_path = os.path.join(subtest_dir, "%s.py" % t_type)
+    mtime = _get_mtime(module_path)
+    cached = _TEST_MODULES.get(module_path)
+    if cached is not None and cached[0] == mtime:
+        sys.modules[t_type] = cached[1]
+        return cached[1]
+    f, p, d = imp.find_module(t_type, [subtest_dir])
+    try:
+        test_module = imp.load_module(t_type, f, p, d)
+    finally:
+        f.close()
+    _TEST_MODULES[module_path] = (mtime, test_module)
+    return test_module
+
+
 def download_test_provider(provider, update=False):
     """
     Download a test provider defined on a .ini file inside test-providers.d.
@@ -446,7 +626,262 @@ def uncompress_asset(asset_info, force=False):
                 shutil.copy(destination_uncompressed, backup_file)
 
 
-def download_file(asset_info, interactive=False, force=False):
+# Bytes read at a time from download streams
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Smallest range fetched by one connection of a parallel download
+DOWNLOAD_SEGMENT_MIN_SIZE = 64 * 1024 * 1024
+
+
+def _get_verified_sha1(path):
+    """
+    :return: SHA1 recorded by _set_verified_sha1() for path, or None when
+             there is none or the file changed since
+    """
+    try:
+        stat = os.stat(path)
+        with open(path + ".verified") as sidecar:
+            sha1, size, mtime = sidecar.read().split()
+        if (int(size), float(mtime)) == (stat.st_size, stat.st_mtime):
+            return sha1
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _set_verified_sha1(path, sha1):
+    """
+    Record the SHA1 of path in a sidecar file, along with its size and
+    mtime, so the file does not need to be hashed again while unchanged.
+    """
+    stat = os.stat(path)
+    tmp_path = "%s.verified.%d" % (path, os.getpid())
+    try:
+        with open(tmp_path, "w") as sidecar:
+            sidecar.write("%s %d %r\n" % (sha1, stat.st_size, stat.st_mtime))
+        os.rename(tmp_path, path + ".verified")
+    except (IOError, OSError), details:
+        logging.warning("Failed to record SHA1 of %s: %s", path, details)
+
+
+def _get_sha1(path):
+    """
+    :return: SHA1 of path, hashing it only if it changed since last time
+    """
+    sha1 = _get_verified_sha1(path)
+    if sha1 is None:
+        sha1 = crypto.hash_file(path, algorithm='sha1')
+        _set_verified_sha1(path, sha1)
+    return sha1
+
+
+def _hash_range(digest, path, begin, end):
+    """
+    Update digest with bytes begin to end (exclusive) of path.
+    """
+    with open(path, "rb") as src:
+        src.seek(begin)
+        while begin < end:
+            data = src.read(min(DOWNLOAD_CHUNK_SIZE, end - begin))
+            if not data:
+                raise IOError("%s is shorter than expected" % path)
+            digest.update(data)
+            begin += len(data)
+
+
+def _url_open(url, begin=None, end=None):
+    """
+    Open url, asking for the byte range begin-end (inclusive) if given.
+    """
+    request = urllib2.Request(url)
+    if begin is not None:
+        request.add_header("Range", "bytes=%d-%s" %
+                           (begin, "" if end is None else end))
+    return urllib2.urlopen(request)
+
+
+def _get_content_length(response):
+    try:
+        return int(response.info()["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _Progress(object):
+
+    """
+    Thread safe progress bar of a download, doing nothing if size is unknown
+    """
+
+    def __init__(self, size, title, done=0):
+        self.bar = None
+        self.lock = threading.Lock()
+        if size:
+            self.bar = output.ProgressBar(maximum=size, title=title)
+            self.bar.update_amount(done)
+
+    def add(self, amount):
+        if self.bar is not None:
+            with self.lock:
+                self.bar.append_amount(amount)
+
+
+def _download_stream(url, part, title):
+    """
+    Download url to part, resuming after the data part already holds.
+
+    :return: SHA1 hex digest of the complete part file
+    """
+    digest = hashlib.sha1()
+    offset = 0
+    if os.path.isfile(part):
+        offset = os.path.getsize(part)
+    try:
+        response = _url_open(url, offset or None)
+    except urllib2.HTTPError, details:
+        if details.code != 416 or not offset:
+            raise
+        # Requested range starts at the end, the part file is complete
+        logging.info("%s was already fully downloaded", part)
+        _hash_range(digest, part, 0, offset)
+        return digest.hexdigest()
+    try:
+        if offset and response.getcode() != 206:
+            logging.info("%s does not support resuming, downloading it again",
+                         url)
+            offset = 0
+        size = _get_content_length(response)
+        if offset:
+            logging.info("Resuming download of %s at %s", url,
+                         output.display_data_size(offset))
+            _hash_range(digest, part, 0, offset)
+        logging.info("Downloading %s, %s to %s", os.path.basename(url),
+                     output.display_data_size((size or 0) + offset),
+                     os.path.dirname(part))
+        progress = _Progress(size and size + offset, title, offset)
+        with open(part, "ab" if offset else "wb") as dst:
+            while True:
+                data = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                dst.write(data)
+                progress.add(len(data))
+    finally:
+        response.close()
+    if size is not None and os.path.getsize(part) != size + offset:
+        raise IOError("Download of %s was cut short" % url)
+    return digest.hexdigest()
+
+
+def _download_segments(url, part, title, size, segments):
+    """
+    Download url to part with segments connections fetching byte ranges.
+
+    The ranges are hashed in order as soon as they complete, while the
+    following ones are still being downloaded.
+
+    :return: SHA1 hex digest of the complete part file
+    """
+    logging.info("Downloading %s, %s to %s with %d connections",
+                 os.path.basename(url), output.display_data_size(size),
+                 os.path.dirname(part), segments)
+    with open(part, "wb") as dst:
+        dst.truncate(size)
+    progress = _Progress(size, title)
+    step = size // segments
+    ranges = [(i * step, size if i == segments - 1 else (i + 1) * step)
+              for i in xrange(segments)]
+    errors = []
+
+    def fetch(begin, end):
+        try:
+            response = _url_open(url, begin, end - 1)
+            try:
+                if response.getcode() != 206:
+                    raise IOError("%s ignored the requested range" % url)
+                with open(part, "r+b") as dst:
+                    dst.seek(begin)
+                    while begin < end and not errors:
+                        data = response.read(min(DOWNLOAD_CHUNK_SIZE,
+                                                 end - begin))
+                        if not data:
+                            raise IOError("Download of %s was cut short" %
+                                          url)
+                        dst.write(data)
+                        begin += len(data)
+                        progress.add(len(data))
+            finally:
+                response.close()
+        except Exception, details:
+            errors.append(details)
+
+    threads = []
+    for begin, end in ranges:
+        thread = threading.Thread(target=fetch, args=(begin, end))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    digest = hashlib.sha1()
+    for thread, (begin, end) in zip(threads, ranges):
+        thread.join()
+        if not errors:
+            _hash_range(digest, part, begin, end)
+    if errors:
+        for thread in threads:
+            thread.join()
+        raise errors[0]
+    return digest.hexdigest()
+
+
+def download_url(url, destination, title='', segments=1):
+    """
+    Download url to destination, computing the SHA1 of the data on the fly.
+
+    Data goes to destination.part first, so an interrupted download is
+    resumed with an HTTP range request next time. Files downloaded with
+    several connections (segments > 1, only if the server supports ranges
+    and the file is big enough) use a separate part file, which is not
+    resumed.
+
+    :param title: Title of the progress bar
+    :param segments: Maximum number of parallel connections
+    :return: SHA1 hex digest of the downloaded file
+    """
+    part = destination + ".part"
+    segments_part = destination + ".segments.part"
+    if os.path.isfile(segments_part):
+        os.unlink(segments_part)
+    size = None
+    if segments > 1 and not os.path.isfile(part):
+        # Servers supporting ranges tell the full size in Content-Range
+        response = _url_open(url, 0)
+        try:
+            if response.getcode() == 206:
+                content_range = response.info().get("Content-Range", "")
+                size = int(content_range.rsplit("/", 1)[-1])
+        except ValueError:
+            pass
+        finally:
+            response.close()
+    if size is not None:
+        segments = min(segments, size // DOWNLOAD_SEGMENT_MIN_SIZE)
+    if size is not None and segments > 1:
+        try:
+            sha1 = _download_segments(url, segments_part, title, size,
+                                      segments)
+        except Exception:
+            if os.path.isfile(segments_part):
+                os.unlink(segments_part)
+            raise
+        part = segments_part
+    else:
+        sha1 = _download_stream(url, part, title)
+    os.rename(part, destination)
+    _set_verified_sha1(destination, sha1)
+    return sha1
+
+
+def download_file(asset_info, interactive=False, force=False, segments=1):
     """
     Verifies if file that can be find on url is on destination with right hash.
 
@@ -454,6 +889,7 @@ def download_file(asset_info, interactive=False, force=False):
     appears to be missing or corrupted, let the user know.
 
     :param asset_info: Dictionary returned by get_asset_info
+    :param segments: Number of parallel connections to download with
     """
     file_ok = False
     problems_ignored = False
@@ -488,9 +924,17 @@ def download_file(asset_info, interactive=False, force=False):
         else:
             answer = 'y'
         if answer == 'y':
-            download.url_download_interactive(url, destination,
-                                              "Downloading %s" % title)
+            actual_sha1 = download_url(url, destination,
+                                       "Downloading %s" % title, segments)
             had_to_download = True
+            if sha1 is not None:
+                # Hashed during the download, checking is free
+                if actual_sha1 == sha1:
+                    file_ok = True
+                    logging.info("SHA1 sum check OK")
+                else:
+                    logging.error("Actual SHA1 sum: %s", actual_sha1)
+                    logging.error("File %s is corrupted", destination)
         else:
             logging.warning("Missing file %s", destination)
     else:
@@ -501,7 +945,7 @@ def download_file(asset_info, interactive=False, force=False):
             answer = 'y'
 
         if answer == 'y':
-            actual_sha1 = crypto.hash_file(destination, algorithm='sha1')
+            actual_sha1 = _get_sha1(destination)
             if actual_sha1 != sha1:
                 logging.info("Actual SHA1 sum: %s", actual_sha1)
                 if interactive:
@@ -513,13 +957,12 @@ def download_file(asset_info, interactive=False, force=False):
                 if answer == 'y':
                     logging.info("Updating image to the latest available...")
                     while not file_ok:
-                        download.url_download_interactive(url, destination,
-                                                          title)
-                        sha1_post_download = crypto.hash_file(destination,
-                                                              algorithm='sha1')
+                        sha1_post_download = download_url(url, destination,
+                                                          title, segments)
                         had_to_download = True
                         if sha1_post_download != sha1:
-                            logging.error("Actual SHA1 sum: %s", actual_sha1)
+                            logging.error("Actual SHA1 sum: %s",
+                                          sha1_post_download)
                             if interactive:
                                 answer = genio.ask("The file downloaded %s is "
                                                    "corrupted. Would you like "
@@ -551,7 +994,7 @@ def download_file(asset_info, interactive=False, force=False):
     uncompress_asset(asset_info=asset_info, force=force or had_to_download)
 
 
-def download_asset(asset, interactive=True, restore_image=False):
+def download_asset(asset, interactive=True, restore_image=False, segments=1):
     """
     Download an asset defined on an asset file.
 
@@ -579,8 +1022,9 @@ def download_asset(asset, interactive=True, restore_image=False):
     :param interactive: Whether to ask the user before downloading the file.
     :param restore_image: If the asset is a compressed image, we can uncompress
                           in order to restore the image.
+    :param segments: Number of parallel connections to download with
     """
     asset_info = get_asset_info(asset)
 
     download_file(asset_info=asset_info, interactive=interactive,
-                  force=restore_image)
+                  force=restore_image, segments=segments)
@@ -814,11 +814,13 @@ def bootstrap(options, interactive=False):
         step += 1
         logging.info("%s - Verifying (and possibly downloading) guest image",
                      step)
+        segments = getattr(options, "vt_download_segments", 1)
         for os_info in get_guest_os_info_list(options.vt_type, guest_os):
             os_asset = os_info['asset']
             try:
                 asset.download_asset(os_asset, interactive=interactive,
-                                     restore_image=restore_image)
+                                     restore_image=restore_image,
+                                     segments=segments)
             except AssertionError:
                 pass    # Not all files are managed via asset
 
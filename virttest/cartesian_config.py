@@ -134,15 +134,23 @@ The base of the definitions come verbatim as follows:
 
 import os
 import collections
+import cPickle
+import hashlib
 import optparse
 import logging
+import multiprocessing
 import re
 import sys
+import tempfile
 
 _reserved_keys = set(("name", "shortname", "dep", "_short_name_map_file", "_name_map_file"))
 
 num_failed_cases = 5
 
+# Bump whenever the layout of the parse tree (Node, filters, operators)
+# changes, so stale cache files from older versions get ignored.
+_cache_format_version = 2
+
 
 class ParserError(Exception):
 
@@ -187,17 +195,36 @@ else:
     enum = enumerate
 
 
+def _label_index(labels):
+    """
+    Index labels for fast lookup of filter labels.
+
+    A filter label ``name`` matches any label with that name, while
+    ``(var_name=name)`` matches only the label from that variant, so both
+    forms of every label are indexed. Lookups then only hash plain strings.
+
+    :param labels: Iterable of Label.
+    :return: Frozenset of label names and long names.
+    """
+    index = set()
+    for label in labels:
+        index.add(str(label.name))
+        index.add(label.long_name)
+    return frozenset(index)
+
+
 def _match_adjacent(block, ctx, ctx_set):
     """
     It try to match as many blocks as possible from context.
 
+    :param ctx_set: Label index (see _label_index()) of ctx.
     :return: Count of matched blocks.
     """
-    if block[0] not in ctx_set:
+    if block[0].long_name not in ctx_set:
         return 0
     if len(block) == 1:
         return 1                          # First match and length is 1.
-    if block[1] not in ctx_set:
+    if block[1].long_name not in ctx_set:
         return int(ctx[-1] == block[0])   # Check match with last from ctx.
     k = 0
     i = ctx.index(block[0])
@@ -209,7 +236,7 @@ def _match_adjacent(block, ctx, ctx_set):
             k += 1
             if k >= len(block):           # match all of blocks
                 break
-            if block[k] not in ctx_set:   # block in not in whole ctx.
+            if block[k].long_name not in ctx_set:  # not in whole ctx.
                 break
         i += 1
     return k
@@ -218,38 +245,63 @@ def _match_adjacent(block, ctx, ctx_set):
 def _might_match_adjacent(block, ctx, ctx_set, descendant_labels):
     matched = _match_adjacent(block, ctx, ctx_set)
     for elem in block[matched:]:        # Try to find rest of blocks in subtree
-        if elem not in descendant_labels:
+        if elem.long_name not in descendant_labels:
             # print "Can't match %s, ctx %s" % (block, ctx)
             return False
     return True
 
 
+def _match_word(word, ctx, ctx_set):
+    for block in word:    # Go through ..
+        if _match_adjacent(block, ctx, ctx_set) != len(block):
+            return False
+    return True               # All match
+
+
+def _might_match_word(word, ctx, ctx_set, descendant_labels):
+    for block in word:
+        if not _might_match_adjacent(block, ctx, ctx_set,
+                                     descendant_labels):
+            return False
+    return True
+
+
 # Filter must inherit from object (otherwise type() won't work)
 class Filter(object):
-    __slots__ = ["filter"]
+    __slots__ = ["filter", "indexed_words"]
 
     def __init__(self, lfilter):
         self.filter = lfilter
+        # Labels used by every word (the parts separated by ,) of the filter.
+        # A word can't match unless all its labels are in the context, and
+        # it might match in a subtree only if every label is either in the
+        # context or under the subtree. Checking that against the label
+        # indexes first avoids walking the blocks for most of the nodes.
+        self.indexed_words = [(word, frozenset(label.long_name
+                                               for block in word
+                                               for label in block))
+                              for word in lfilter]
         # print self.filter
 
     def match(self, ctx, ctx_set):
-        for word in self.filter:  # Go through ,
-            for block in word:    # Go through ..
-                if _match_adjacent(block, ctx, ctx_set) != len(block):
-                    break
-            else:
+        for word, word_labels in self.indexed_words:  # Go through ,
+            if not word_labels.issubset(ctx_set):
+                continue
+            if _match_word(word, ctx, ctx_set):
                 # print "Filter pass: %s ctx: %s" % (self.filter, ctx)
-                return True       # All match
+                return True
         return False
 
     def might_match(self, ctx, ctx_set, descendant_labels):
         # There is some posibility to match in children blocks.
-        for word in self.filter:
-            for block in word:
-                if not _might_match_adjacent(block, ctx, ctx_set,
-                                             descendant_labels):
-                    break
-            else:
+        for word, word_labels in self.indexed_words:
+            missing = word_labels.difference(descendant_labels)
+            if not missing:
+                # Whole word can be matched in the subtree
+                return True
+            if not missing.issubset(ctx_set):
+                continue
+            if _might_match_word(word, ctx, ctx_set, descendant_labels):
                 return True
         # print "Filter not pass: %s ctx: %s" % (self.filter, ctx)
         return False
@@ -509,7 +561,7 @@ class Label(object):
 class Node(object):
     __slots__ = ["var_name", "name", "filename", "dep", "content", "children",
                  "labels", "append_to_shortname", "failed_cases", "default",
-                 "q_dict"]
+                 "q_dict", "label_index"]
 
     def __init__(self):
         self.var_name = []
@@ -522,6 +574,19 @@ class Node(object):
         self.append_to_shortname = False
         self.failed_cases = collections.deque()
         self.default = False
+        self.label_index = None
+
+    def get_label_index(self):
+        """
+        Get the label index (see _label_index()) of the labels under node.
+
+        The index is built once and rebuilt only if more labels were parsed
+        into the subtree since then (labels are never removed).
+        """
+        if (self.label_index is None or
+                self.label_index[0] != len(self.labels)):
+            self.label_index = (len(self.labels), _label_index(self.labels))
+        return self.label_index[1]
 
     def dump(self, indent, recurse=False):
         print("%s%s" % (" " * indent, self.name))
@@ -534,6 +599,19 @@ class Node(object):
                 child.dump(indent + 3, recurse)
 
 
+def _file_digest(filename):
+    """
+    Compute SHA1 of a file content, used to validate cached parse trees.
+    """
+    digest = hashlib.sha1()
+    config_file = open(filename, "rb")
+    try:
+        digest.update(config_file.read())
+    finally:
+        config_file.close()
+    return digest.hexdigest()
+
+
 match_subtitute = re.compile("\$\{(.+?)\}")
 
 
@@ -1271,6 +1349,9 @@ def cmd_tokens(tokens1, tokens2):
 
 
 def apply_predict(lexer, node, pre_dict):
+    if not pre_dict:
+        # Nothing to flush, don't make every leaf apply an empty dict
+        return {}
     predict = LApplyPreDict().set_operands(None, pre_dict)
     node.content += [(lexer.filename, lexer.linenum, predict)]
     return {}
@@ -1363,12 +1444,18 @@ class Parser(object):
     # pylint: disable=W0102
 
     def __init__(self, filename=None, defaults=False, expand_defaults=[],
-                 debug=False):
+                 debug=False, cache_dir=None):
         self.node = Node()
         self.debug = debug
         self.defaults = defaults
         self.expand_defaults = [LIdentifier(x) for x in expand_defaults]
 
+        # Directory where parse trees of config files are stored, keyed by
+        # the content of every file involved. None disables the cache.
+        self.cache_dir = cache_dir
+        # Files read by the parse_file() in progress (top file + includes)
+        self.parsed_files = []
+
         self.filename = filename
         if self.filename:
             self.parse_file(self.filename)
@@ -1396,11 +1483,98 @@ class Parser(object):
         """
         Parse a file.
 
+        When the parser was created with a cache_dir and nothing was parsed
+        so far, the resulting tree is stored on disk and reused by later
+        parsers as long as none of the included files changed.
+
         :param filename: Path of the configuration file.
         """
+        cache_path = None
+        if (self.cache_dir and not self.node.content and
+                not self.node.children):
+            cache_path = self._get_cache_path(filename)
+            node = self._load_cache(cache_path)
+            if node is not None:
+                self.node = node
+                self.filename = filename
+                return
+
         self.node.filename = filename
+        self.parsed_files = [os.path.abspath(filename)]
         self.node = self._parse(Lexer(FileReader(filename)), self.node)
         self.filename = filename
+        if cache_path:
+            self._store_cache(cache_path)
+
+    def _get_cache_path(self, filename):
+        """
+        Get the cache file used for a given top level config file.
+
+        Options influencing the shape of the tree are part of the key.
+        """
+        key = repr((_cache_format_version, os.path.abspath(filename),
+                    bool(self.defaults),
+                    sorted(str(x) for x in self.expand_defaults)))
+        return os.path.join(self.cache_dir,
+                            "%s.pickle" % hashlib.sha1(key).hexdigest())
+
+    def _load_cache(self, cache_path):
+        """
+        Load a cached parse tree.
+
+        :return: The cached Node, or None when there's no valid cache entry.
+        """
+        try:
+            cache_file = open(cache_path, "rb")
+        except IOError:
+            return None
+        try:
+            version, files, node = cPickle.load(cache_file)
+        except Exception, details:
+            self._warn("Ignoring unreadable cartesian cache %s: %s",
+                       cache_path, details)
+            return None
+        finally:
+            cache_file.close()
+        if version != _cache_format_version:
+            return None
+        for path, digest in files:
+            try:
+                if _file_digest(path) != digest:
+                    self._debug("Cartesian cache %s outdated by %s",
+                                cache_path, path)
+                    return None
+            except (IOError, OSError):
+                return None
+        self._debug("Using cached parse tree %s", cache_path)
+        return node
+
+    def _store_cache(self, cache_path):
+        """
+        Store the current parse tree, replacing the cache file atomically.
+        """
+        try:
+            files = [(path, _file_digest(path))
+                     for path in sorted(set(self.parsed_files))]
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix=".tmp")
+            try:
+                tmp_file = os.fdopen(fd, "wb")
+                try:
+                    cPickle.dump((_cache_format_version, files, self.node),
+                                 tmp_file, cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    tmp_file.close()
+                os.rename(tmp_path, cache_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except Exception, details:
+            self._warn("Could not store cartesian cache %s: %s",
+                       cache_path, details)
 
     def parse_string(self, s):
         """
@@ -1803,6 +1977,7 @@ class Parser(object):
                         raise MissingIncludeError(lexer.line, lexer.filename,
                                                   lexer.linenum)
                     pre_dict = apply_predict(lexer, node, pre_dict)
+                    self.parsed_files.append(os.path.abspath(filename))
                     lch = Lexer(FileReader(filename))
                     node = self._parse(lch, node, -1)
                     lexer.set_prev_indent(prev_indent)
@@ -1995,6 +2170,111 @@ class Parser(object):
                     d["shortname"] = self.mk_name(d1["shortname"], d2["shortname"])
                     yield d
 
+    def _is_splittable(self, node):
+        """
+        Check if the dicts of node are just the dicts of its children,
+        one child after another.
+        """
+        if not node.children:
+            return False
+        if self.defaults and node.var_name not in self.expand_defaults:
+            # Expansion stops after the default variant
+            return False
+        for _, _, obj in node.content:
+            if isinstance(obj, JoinFilter):
+                # Dicts of the children get multiplied
+                return False
+        return True
+
+    def _get_path_node(self, path):
+        node = self.node
+        for index in path:
+            node = node.children[index]
+        return node
+
+    def _split_paths(self, count):
+        """
+        Split the tree into at least count subtrees, when possible.
+
+        :return: List of paths (tuples of child indexes from the top node) of
+                 the subtrees, in the order get_dicts() visits them.
+        """
+        paths = [()]
+        while len(paths) < count:
+            new_paths = []
+            for path in paths:
+                node = self._get_path_node(path)
+                if self._is_splittable(node):
+                    new_paths += [path + (index,)
+                                  for index in xrange(len(node.children))]
+                else:
+                    new_paths.append(path)
+            if new_paths == paths:
+                break
+            paths = new_paths
+        return paths
+
+    def get_dicts_path(self, path, parent_generator=True):
+        """
+        Generate the dicts of one subtree only.
+
+        Every node on the path temporarily gets just the child from the path,
+        so the subtree is expanded with the same context as in get_dicts().
+
+        :param path: Tuple of child indexes from the top node.
+        :param parent_generator: Whether this is the top level get_dicts().
+        :return: List of dicts.
+        """
+        restore = []
+        node = self.node
+        for index in path:
+            restore.append((node, node.children))
+            node.children = [node.children[index]]
+            node = node.children[0]
+        self.parent_generator = parent_generator
+        try:
+            return list(self.get_dicts())
+        finally:
+            for node, children in reversed(restore):
+                node.children = children
+
+    def get_dicts_parallel(self, processes=None):
+        """
+        Generate the same dicts as get_dicts(), expanding subtrees in worker
+        processes.
+
+        The tree is split into (at least) 4 subtrees per process when the
+        config allows it, every subtree is expanded by a worker and results
+        are yielded in the order get_dicts() would yield them.
+
+        :param processes: Number of worker processes, CPU count by default.
+        :return: A dict generator.
+        """
+        global _parallel_parser
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        paths = self._split_paths(processes * 4)
+        if processes < 2 or len(paths) < 2:
+            for d in self.get_dicts():
+                yield d
+            return
+
+        parent_generator = self.parent_generator
+        self.parent_generator = False
+        # Workers get the parser (with the parsed tree) through fork()
+        _parallel_parser = self
+        pool = multiprocessing.Pool(processes)
+        try:
+            for dicts in pool.imap(_get_dicts_path,
+                                   [(path, parent_generator)
+                                    for path in paths]):
+                for d in dicts:
+                    yield d
+        finally:
+            pool.terminate()
+            pool.join()
+            _parallel_parser = None
+
     def get_dicts_plain(self, node=None, ctx=[], content=[], shortname=[], dep=[]):
         """
         Generate dictionaries from the code parsed so far.  This should
@@ -2096,8 +2376,8 @@ class Parser(object):
                 dep = dep + [".".join([str(label) for label in ctx + dd])]
         # Update ctx
         ctx = ctx + node.name
-        ctx_set = set(ctx)
-        labels = node.labels
+        ctx_set = _label_index(ctx)
+        labels = node.get_label_index()
         # Get the current name
         name = ".".join([str(label) for label in ctx])
 
@@ -2153,6 +2433,155 @@ class Parser(object):
             yield d
 
 
+class LayeredDict(collections.MutableMapping):
+
+    """
+    Copy-on-write dict on top of a read-only dict shared with other dicts.
+
+    Writes and deletes only touch the private layer, so any number of
+    LayeredDicts can share one base dict. Behaves as a regular dict for
+    reading, updating, copying and pickling (e.g. utils_params.Params(d)).
+    """
+    __slots__ = ["_base", "_own", "_deleted"]
+
+    def __init__(self, base=None, own=None, deleted=None):
+        """
+        :param base: Shared dict, never modified through this object.
+        :param own: Private dict with keys overriding/extending base.
+        :param deleted: Set of keys of base hidden by this object.
+        """
+        if base is None:
+            base = {}
+        self._base = base
+        self._own = own or {}
+        self._deleted = deleted or set()
+
+    def __getitem__(self, key):
+        try:
+            return self._own[key]
+        except KeyError:
+            if key in self._deleted:
+                raise
+            return self._base[key]
+
+    def __setitem__(self, key, value):
+        self._own[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key in self._own:
+            del self._own[key]
+            if key in self._base:
+                self._deleted.add(key)
+        elif key in self._base and key not in self._deleted:
+            self._deleted.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._own:
+            return True
+        return key in self._base and key not in self._deleted
+
+    has_key = __contains__
+
+    def __iter__(self):
+        for key in self._base:
+            if key not in self._own and key not in self._deleted:
+                yield key
+        for key in self._own:
+            yield key
+
+    def __len__(self):
+        return (len(self._base) - len(self._deleted) +
+                sum(1 for key in self._own if key not in self._base))
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __reduce__(self):
+        return (self.__class__, (self._base, self._own, self._deleted))
+
+    def copy(self):
+        return self.__class__(self._base, self._own.copy(),
+                              self._deleted.copy())
+
+
+class DictCompactor(object):
+
+    """
+    Store generated dicts as LayeredDicts sharing most of their content.
+
+    Dicts generated one after another from the same config differ in a few
+    keys, so every dict keeps only its differences from the last shared
+    base dict. A new base is started when the differences grow too big.
+    Keys and string values are interned in a table shared by all dicts.
+    """
+
+    # Fraction of the keys allowed to differ from base before rebasing
+    max_difference = 0.25
+
+    def __init__(self):
+        self._strings = {}
+        self._base = {}
+
+    def _intern(self, value):
+        value_type = type(value)
+        if value_type is str:
+            return self._strings.setdefault(value, value)
+        elif value_type is dict:
+            # e.g. _name_map_file, the file names and most of the variant
+            # names repeat over and over
+            return dict((self._intern(key), self._intern(item))
+                        for key, item in value.iteritems())
+        elif value_type is list:
+            return [self._intern(item) for item in value]
+        return value
+
+    def compact(self, d):
+        """
+        :param d: Dict to compact.
+        :return: LayeredDict with the same content as d.
+        """
+        intern = self._intern
+        base = self._base
+        own = {}
+        for key, value in d.iteritems():
+            if (type(value) not in (str, int, tuple) or
+                    key not in base or base[key] != value):
+                own[intern(key)] = intern(value)
+        deleted = set(key for key in base if key not in d)
+        if len(own) + len(deleted) > len(d) * self.max_difference:
+            # Mutable values are never shared, not to leak changes
+            base = dict((intern(key), intern(value))
+                        for key, value in d.iteritems()
+                        if type(value) in (str, int, tuple))
+            own = dict((intern(key), intern(value))
+                       for key, value in d.iteritems() if key not in base)
+            deleted = set()
+            self._base = base
+        return LayeredDict(base, own, deleted)
+
+    def compact_dicts(self, dicts):
+        """
+        Compact dicts from a generator (e.g. Parser.get_dicts()).
+        """
+        for d in dicts:
+            yield self.compact(d)
+
+
+# Parser expanded by the get_dicts_parallel() workers
+_parallel_parser = None
+
+
+def _get_dicts_path(args):
+    """
+    Expand one subtree of _parallel_parser in a get_dicts_parallel() worker.
+    """
+    path, parent_generator = args
+    return _parallel_parser.get_dicts_path(path, parent_generator)
+
+
 def print_dicts_default(options, dicts):
     """Print dictionaries in the default mode"""
     for count, dic in enumerate(dicts):
@@ -2276,6 +2705,8 @@ if __name__ == "__main__":
                            " defaults is enabled.  \"name, name, name\"")
     parser.add_option("-s", "--skip-dups", dest="skipdups", default=True, action="store_false",
                       help="Don't drop variables with different suffixes and same val")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="number of processes used to generate the dicts")
 
     options, args = parser.parse_args()
     if not args:
@@ -2295,5 +2726,8 @@ if __name__ == "__main__":
     if options.debug:
         c.node.dump(0, True)
 
-    dicts = c.get_dicts()
+    if options.jobs > 1:
+        dicts = c.get_dicts_parallel(options.jobs)
+    else:
+        dicts = c.get_dicts()
     print_dicts(options, dicts)
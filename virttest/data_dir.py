@@ -34,6 +34,7 @@ SHARED_DIR = os.path.join(ROOT_DIR, 'shared')
 DEPS_DIR = os.path.join(ROOT_DIR, 'shared', 'deps')
 BASE_DOWNLOAD_DIR = os.path.join(SHARED_DIR, 'downloads')
 DOWNLOAD_DIR = os.path.join(DATA_DIR, 'downloads')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
 TEST_PROVIDERS_DIR = os.path.join(ROOT_DIR, 'test-providers.d')
 BACKING_DATA_DIR = None
 
@@ -213,6 +214,20 @@ def get_tmp_dir(public=True):
     return tmp_dir
 
 
+def get_cache_dir(subdir=None):
+    """
+    Get the dir for persistent caches kept between jobs.
+
+    :param subdir: Optional subdirectory dedicated to one kind of cache.
+    """
+    cache_dir = CACHE_DIR
+    if subdir is not None:
+        cache_dir = os.path.join(cache_dir, subdir)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
 def get_download_dir():
     if not os.path.isdir(DOWNLOAD_DIR):
         shutil.copytree(BASE_DOWNLOAD_DIR, DOWNLOAD_DIR)
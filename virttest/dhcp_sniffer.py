@@ -0,0 +1,347 @@
+"""
+Sniffing of DHCP and DHCPv6 traffic, used to learn the addresses of guests.
+
+tcpdump captures only DHCP client traffic (kernel BPF filter) and writes
+the raw packets in pcap format, which is parsed here instead of the text
+tcpdump prints in verbose mode.
+"""
+
+import collections
+import logging
+import os
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from avocado.utils import path as utils_path
+
+from . import utils_misc
+
+
+# BPF filter: DHCP client port and DHCPv6 client port
+CAPTURE_FILTER = "udp and (port 68 or port 546)"
+# Seconds between writes of the packet log
+LOG_FLUSH_INTERVAL = 1.0
+
+_PCAP_HEADER = struct.Struct("IHHiIII")
+_PCAP_RECORD = struct.Struct("IIII")
+_PCAP_MAGICS = (0xa1b2c3d4, 0xa1b23c4d)
+
+# Link types of the capture
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+_ETH_P_IP = 0x0800
+_ETH_P_IPV6 = 0x86dd
+_ETH_P_8021Q = 0x8100
+
+_DHCP_MAGIC_COOKIE = "\x63\x82\x53\x63"
+_DHCP_MESSAGES = {1: "DISCOVER", 2: "OFFER", 3: "REQUEST", 4: "DECLINE",
+                  5: "ACK", 6: "NAK", 7: "RELEASE", 8: "INFORM"}
+_DHCP6_MESSAGES = {1: "SOLICIT", 2: "ADVERTISE", 3: "REQUEST", 4: "CONFIRM",
+                   5: "RENEW", 6: "REBIND", 7: "REPLY", 8: "RELEASE",
+                   9: "DECLINE", 10: "RECONFIGURE", 11: "INFORMATION-REQUEST"}
+# DHCPv6 messages whose addresses are recorded
+_DHCP6_LEASE_MESSAGES = ("ADVERTISE", "REQUEST", "CONFIRM", "RENEW", "REPLY")
+_DHCP6_OPTION_CLIENTID = 1
+_DHCP6_OPTION_IA_NA = 3
+_DHCP6_OPTION_IA_TA = 4
+_DHCP6_OPTION_IAADDR = 5
+
+
+# family is 4 or 6, mac and ip may be None
+DhcpPacket = collections.namedtuple("DhcpPacket",
+                                    ["family", "message", "mac", "ip"])
+
+
+def _format_mac(data):
+    return ":".join("%02x" % ord(c) for c in data)
+
+
+def parse_dhcp(payload):
+    """
+    :param payload: UDP payload of a DHCP packet
+    :return: DhcpPacket with the client MAC and the assigned IP (yiaddr),
+             or None if payload is not a DHCP packet
+    """
+    if len(payload) < 240 or payload[236:240] != _DHCP_MAGIC_COOKIE:
+        return None
+    htype, hlen = struct.unpack("!BB", payload[1:3])
+    mac = None
+    if htype == 1 and hlen == 6:
+        mac = _format_mac(payload[28:34])
+    ip = socket.inet_ntoa(payload[16:20])
+    if ip == "0.0.0.0":
+        ip = None
+    message = None
+    offset = 240
+    while offset < len(payload):
+        code = ord(payload[offset])
+        if code == 255:
+            break
+        if code == 0:
+            offset += 1
+            continue
+        if offset + 1 >= len(payload):
+            break
+        length = ord(payload[offset + 1])
+        if code == 53 and length == 1 and offset + 2 < len(payload):
+            message = _DHCP_MESSAGES.get(ord(payload[offset + 2]))
+        offset += 2 + length
+    return DhcpPacket(4, message, mac, ip)
+
+
+def _iter_dhcp6_options(data):
+    offset = 0
+    while offset + 4 <= len(data):
+        code, length = struct.unpack("!HH", data[offset:offset + 4])
+        yield code, data[offset + 4:offset + 4 + length]
+        offset += 4 + length
+
+
+def parse_dhcpv6(payload):
+    """
+    :param payload: UDP payload of a DHCPv6 packet
+    :return: DhcpPacket with the client MAC (last 6 bytes of the client
+             DUID) and the first address of its IA options, or None if
+             payload is not a DHCPv6 client/server packet
+    """
+    if len(payload) < 4:
+        return None
+    message = _DHCP6_MESSAGES.get(ord(payload[0]))
+    if message is None:
+        return None
+    mac = ip = None
+    for code, value in _iter_dhcp6_options(payload[4:]):
+        if code == _DHCP6_OPTION_CLIENTID and len(value) >= 10:
+            mac = _format_mac(value[-6:])
+        elif (code in (_DHCP6_OPTION_IA_NA, _DHCP6_OPTION_IA_TA) and
+              ip is None):
+            # IA_NA has IAID, T1 and T2 before its options, IA_TA the IAID
+            header = 12 if code == _DHCP6_OPTION_IA_NA else 4
+            for sub_code, sub_value in _iter_dhcp6_options(value[header:]):
+                if sub_code == _DHCP6_OPTION_IAADDR and len(sub_value) >= 16:
+                    ip = socket.inet_ntop(socket.AF_INET6, sub_value[:16])
+                    break
+    return DhcpPacket(6, message, mac, ip)
+
+
+def _get_network_packet(linktype, frame):
+    """
+    :return: (ethertype, network layer packet) of a captured frame
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, offset = struct.unpack("!H", frame[12:14])[0], 14
+        if ethertype == _ETH_P_8021Q:
+            ethertype, offset = struct.unpack("!H", frame[16:18])[0], 18
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, offset = struct.unpack("!H", frame[14:16])[0], 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype, offset = struct.unpack("!H", frame[0:2])[0], 20
+    elif linktype == LINKTYPE_RAW:
+        version = ord(frame[0]) >> 4 if frame else 0
+        ethertype = {4: _ETH_P_IP, 6: _ETH_P_IPV6}.get(version)
+        offset = 0
+    else:
+        return None, None
+    return ethertype, frame[offset:]
+
+
+def parse_frame(linktype, frame):
+    """
+    :param linktype: Link type of the capture (LINKTYPE_*)
+    :param frame: Captured frame
+    :return: DhcpPacket or None if frame does not hold DHCP traffic
+    """
+    try:
+        ethertype, packet = _get_network_packet(linktype, frame)
+        if ethertype == _ETH_P_IP:
+            header_len = (ord(packet[0]) & 0xf) * 4
+            protocol = ord(packet[9])
+            fragment = struct.unpack("!H", packet[6:8])[0] & 0x1fff
+            if protocol != socket.IPPROTO_UDP or fragment:
+                return None
+            return parse_dhcp(packet[header_len + 8:])
+        elif ethertype == _ETH_P_IPV6:
+            if ord(packet[6]) != socket.IPPROTO_UDP:
+                return None
+            return parse_dhcpv6(packet[48:])
+    except (IndexError, struct.error, ValueError):
+        pass
+    return None
+
+
+class PcapStream(object):
+
+    """
+    Incremental parser of a pcap stream, such as tcpdump -w - output.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.linktype = None
+        self.record = None
+        # Timestamp fraction unit, microseconds or nanoseconds
+        self.scale = None
+
+    def feed(self, data):
+        """
+        Parse more data of the stream.
+
+        :return: List of (timestamp, linktype, frame) of the packets
+                 completed by data
+        :raise ValueError: If the stream is not in pcap format
+        """
+        self.buffer += data
+        packets = []
+        offset = 0
+        if self.record is None:
+            if len(self.buffer) < _PCAP_HEADER.size:
+                return packets
+            magic = struct.unpack("<I", self.buffer[:4])[0]
+            if magic in _PCAP_MAGICS:
+                order = "<"
+            elif struct.unpack(">I", self.buffer[:4])[0] in _PCAP_MAGICS:
+                order = ">"
+            else:
+                raise ValueError("Not a pcap stream")
+            self.record = struct.Struct(order + _PCAP_RECORD.format)
+            header = struct.unpack(order + _PCAP_HEADER.format,
+                                   self.buffer[:_PCAP_HEADER.size])
+            self.linktype = header[6] & 0xffff
+            self.scale = 1e-9 if header[0] == _PCAP_MAGICS[1] else 1e-6
+            offset = _PCAP_HEADER.size
+        while len(self.buffer) - offset >= self.record.size:
+            sec, frac, caplen, _ = self.record.unpack_from(self.buffer,
+                                                           offset)
+            end = offset + self.record.size + caplen
+            if end > len(self.buffer):
+                break
+            packets.append((sec + frac * self.scale, self.linktype,
+                            self.buffer[offset + self.record.size:end]))
+            offset = end
+        self.buffer = self.buffer[offset:]
+        return packets
+
+
+class DhcpSniffer(object):
+
+    """
+    Run tcpdump capturing DHCP traffic, calling handler for each lease.
+
+    handler(*(handler_params + (mac, ip, family))) is called from a
+    background thread for DHCP ACKs and for DHCPv6 messages carrying an
+    address. All DHCP packets are
+    logged to log_filename (relative to utils_misc.get_log_file_dir()),
+    with writes batched every LOG_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, handler, handler_params=(), log_filename=None,
+                 interface="any", command=None):
+        """
+        :param command: Command writing a pcap stream to stdout (default:
+                        tcpdump capturing CAPTURE_FILTER on interface)
+        """
+        if command is None:
+            command = [utils_path.find_command("tcpdump"), "-npi", interface,
+                       "-U", "-w", "-", CAPTURE_FILTER]
+        self.handler = handler
+        self.handler_params = handler_params
+        self.log_filename = log_filename
+        self._log_lines = []
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE,
+                                         close_fds=True)
+        self._thread = threading.Thread(target=self._read_packets)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _flush_log(self):
+        if not self._log_lines or self.log_filename is None:
+            self._log_lines = []
+            return
+        path = utils_misc.get_path(utils_misc.get_log_file_dir(),
+                                   self.log_filename)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "a") as log_file:
+                log_file.writelines(self._log_lines)
+        except (IOError, OSError), details:
+            logging.warn("Can't log DHCP traffic, '%s'", details)
+        self._log_lines = []
+
+    def _handle_packet(self, timestamp, linktype, frame):
+        packet = parse_frame(linktype, frame)
+        if packet is None:
+            return
+        if self.log_filename is not None:
+            self._log_lines.append("%s: DHCP%s %s %s %s\n" % (
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(timestamp)),
+                "" if packet.family == 4 else "v6", packet.message,
+                packet.mac, packet.ip))
+        if packet.mac is None or packet.ip is None:
+            return
+        if ((packet.family == 4 and packet.message == "ACK") or
+                (packet.family == 6 and
+                 packet.message in _DHCP6_LEASE_MESSAGES)):
+            try:
+                self.handler(*(self.handler_params +
+                               (packet.mac, packet.ip, packet.family)))
+            except Exception, details:
+                logging.error("DHCP sniffer handler failed: %s", details)
+
+    def _read_packets(self):
+        stream = PcapStream()
+        fd = self._process.stdout.fileno()
+        last_flush = time.time()
+        try:
+            while True:
+                readable = select.select([fd], [], [], LOG_FLUSH_INTERVAL)[0]
+                if readable:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        break
+                    for packet in stream.feed(data):
+                        self._handle_packet(*packet)
+                if time.time() - last_flush >= LOG_FLUSH_INTERVAL:
+                    self._flush_log()
+                    last_flush = time.time()
+        except ValueError, details:
+            logging.error("Can't parse DHCP capture: %s", details)
+        finally:
+            self._flush_log()
+
+    def is_alive(self):
+        return self._process.poll() is None
+
+    def get_status(self):
+        """
+        :return: Exit status of the capture command, None while running
+        """
+        return self._process.poll()
+
+    def get_output(self):
+        """
+        :return: Error output of the capture command once it ended
+        """
+        if self.is_alive():
+            return ""
+        return self._process.stderr.read()
+
+    def close(self):
+        """
+        Stop capturing and wait for the captured packets to be handled.
+        """
+        if self.is_alive():
+            self._process.terminate()
+        self._process.wait()
+        self._thread.join()
+        self._process.stdout.close()
+        self._process.stderr.close()
@@ -9,6 +9,7 @@ import shutil
 import sys
 import copy
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import aexpect
 from avocado.utils import process as avocado_process
@@ -29,8 +30,16 @@ from . import remote
 from . import data_dir
 from . import utils_net
 from . import utils_disk
+from . import utils_libguestfs
 from . import nfs
 from . import libvirt_vm
+from . import virsh
+
+try:
+    # pylint: disable=E0611
+    from collections import OrderedDict
+except ImportError:
+    from virttest.staging.backports.collections import OrderedDict
 
 try:
     import PIL.Image
@@ -67,6 +76,9 @@ def preprocess_image(test, params, image_name, vm_process_status=None):
 
     image_filename = storage.get_image_filename(params,
                                                 base_dir)
+    # Pooled libguestfs appliances must not have the image open
+    if image_filename:
+        utils_libguestfs.drop_pooled_sessions(image_filename)
 
     create_image = False
     if params.get("force_create_image") == "yes":
@@ -270,6 +282,9 @@ def postprocess_image(test, params, image_name, vm_process_status=None):
     clone_master = params.get("clone_master", None)
     base_dir = data_dir.get_data_dir()
     image = qemu_storage.QemuImg(params, base_dir, image_name)
+    # Pooled libguestfs appliances must not have the image open
+    if image.image_filename:
+        utils_libguestfs.drop_pooled_sessions(image.image_filename)
 
     check_image_flag = params.get("check_image") == "yes"
     if vm_process_status == "running" and check_image_flag:
@@ -731,6 +746,9 @@ def preprocess(test, params, env):
         # Set the LIBVIRT_DEFAULT_URI to make virsh command
         # work on connect_uri as default behavior.
         os.environ['LIBVIRT_DEFAULT_URI'] = connect_uri
+        virsh.LIBVIRT_API = params.get("virsh_libvirt_api", "no") == "yes"
+        virsh.LIBVIRT_EVENTS = params.get("virsh_domain_events",
+                                          "no") == "yes"
 
     # Execute any pre_commands
     if params.get("pre_command"):
@@ -1154,6 +1172,198 @@ def postprocess_on_error(test, params, env):
     params.update(params.object_params("on_error"))
 
 
+class _ScreendumpCache(object):
+
+    """
+    Thread safe map of screendump hashes to converted screendump files,
+    evicting the least recently used entries beyond the given size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_hash):
+        with self._lock:
+            filename = self._files.pop(image_hash, None)
+            if filename is not None:
+                self._files[image_hash] = filename
+            return filename
+
+    def add(self, image_hash, filename):
+        with self._lock:
+            self._files.pop(image_hash, None)
+            self._files[image_hash] = filename
+            while len(self._files) > self.size:
+                self._files.popitem(last=False)
+
+
+class _ScreendumpPipeline(object):
+
+    """
+    Takes screendumps of all VMs at once.  Capturing runs in one thread pool,
+    so slow monitors don't hold up the other VMs; hashing, JPEG conversion
+    and the inactivity checks run in another one, overlapping with the
+    captures still in progress.
+    """
+
+    def __init__(self, test, params, temp_dir):
+        self.test = test
+        self.temp_dir = temp_dir
+        self.random_id = utils_misc.generate_random_string(6)
+        self.quality = int(params.get("screendump_quality", 30))
+        self.inactivity_treshold = float(params.get("inactivity_treshold",
+                                                    1800))
+        self.inactivity_watcher = params.get("inactivity_watcher", "log")
+        self.cache = _ScreendumpCache(int(params.get("screendump_cache_size",
+                                                     1000)))
+        workers = int(params.get("screendump_workers", 8))
+        self.capture_pool = ThreadPool(workers)
+        self.convert_pool = ThreadPool(workers)
+        self.counter = {}
+        self.inactivity = {}
+        # vm.instance -> [vm.name, screendumps, capture time,
+        #                 conversion time, longest total time]
+        self.timings = {}
+
+    def take(self, vms):
+        """
+        Take one screendump of every VM and wait until all are converted.
+
+        :param vms: List of VM objects.
+        """
+        for vm in vms:
+            if vm.instance not in self.counter:
+                self.counter[vm.instance] = 0
+            if vm.instance not in self.inactivity:
+                self.inactivity[vm.instance] = time.time()
+            if vm.instance not in self.timings:
+                self.timings[vm.instance] = [vm.name, 0, 0.0, 0.0, 0.0]
+        captures = [self.capture_pool.apply_async(self._capture, (vm,))
+                    for vm in vms]
+        # Errors of the workers (e.g. BSOD detection) are raised here
+        converts = [capture.get() for capture in captures]
+        for convert in converts:
+            if convert is not None:
+                convert.get()
+
+    def close(self):
+        self.capture_pool.close()
+        self.convert_pool.close()
+        self.capture_pool.join()
+        self.convert_pool.join()
+        for timing in sorted(self.timings.itervalues()):
+            vm_name, count, capture, convert, longest = timing
+            if count:
+                logging.debug("VM '%s' screendumps: %d, average capture "
+                              "%.3f s, average conversion %.3f s, longest "
+                              "%.3f s", vm_name, count, capture / count,
+                              convert / count, longest)
+
+    def _capture(self, vm):
+        """
+        Capture a screendump of vm and queue it for conversion.
+
+        :return: AsyncResult of the conversion, or None
+        """
+        start = time.time()
+        if not vm.is_alive():
+            return
+        vm_pid = vm.get_pid()
+        temp_filename = "scrdump-%s-%s-iter%s.ppm" % (self.random_id,
+                                                      vm.instance,
+                                                      self.test.iteration)
+        temp_filename = os.path.join(self.temp_dir, temp_filename)
+        try:
+            vm.screendump(filename=temp_filename, debug=False)
+        except qemu_monitor.MonitorError, e:
+            logging.warn(e)
+            return
+        except AttributeError, e:
+            logging.warn(e)
+            return
+        if not os.path.exists(temp_filename):
+            logging.warn("VM '%s' failed to produce a screendump", vm.name)
+            return
+        if not ppm_utils.image_verify_ppm_file(temp_filename):
+            logging.warn("VM '%s' produced an invalid screendump", vm.name)
+            os.unlink(temp_filename)
+            return
+        captured = time.time()
+        self.timings[vm.instance][2] += captured - start
+        return self.convert_pool.apply_async(self._convert,
+                                             (vm, vm_pid, temp_filename,
+                                              start, captured))
+
+    def _convert(self, vm, vm_pid, temp_filename, start, captured):
+        """
+        Store the screendump of vm as JPEG, or link it to an identical one.
+        """
+        try:
+            self._convert_screendump(vm, vm_pid, temp_filename)
+        finally:
+            os.unlink(temp_filename)
+            end = time.time()
+            timing = self.timings[vm.instance]
+            timing[1] += 1
+            timing[3] += end - captured
+            timing[4] = max(timing[4], end - start)
+
+    def _convert_screendump(self, vm, vm_pid, temp_filename):
+        test = self.test
+        screendump_dir = "screendumps_%s_%s_iter%s" % (vm.name, vm_pid,
+                                                       test.iteration)
+        screendump_dir = os.path.join(test.debugdir, screendump_dir)
+        try:
+            os.makedirs(screendump_dir)
+        except OSError:
+            pass
+        self.counter[vm.instance] += 1
+        filename = "%04d.jpg" % self.counter[vm.instance]
+        screendump_filename = os.path.join(screendump_dir, filename)
+        vm.verify_bsod(screendump_filename)
+        image_hash = crypto.hash_file(temp_filename)
+        cached_filename = self.cache.get(image_hash)
+        if cached_filename is not None:
+            time_inactive = time.time() - self.inactivity[vm.instance]
+            if time_inactive > self.inactivity_treshold:
+                msg = (
+                    "%s screen is inactive for more than %d s (%d min)" %
+                    (vm.name, time_inactive, time_inactive / 60))
+                if self.inactivity_watcher == "error":
+                    try:
+                        raise virt_vm.VMScreenInactiveError(vm,
+                                                            time_inactive)
+                    except virt_vm.VMScreenInactiveError:
+                        logging.error(msg)
+                        # Let's reset the counter
+                        self.inactivity[vm.instance] = time.time()
+                        test.background_errors.put(sys.exc_info())
+                elif self.inactivity_watcher == 'log':
+                    logging.debug(msg)
+            try:
+                os.link(cached_filename, screendump_filename)
+            except OSError:
+                pass
+        else:
+            self.inactivity[vm.instance] = time.time()
+            try:
+                try:
+                    image = PIL.Image.open(temp_filename)
+                    image.save(screendump_filename, format="JPEG",
+                               quality=self.quality)
+                    self.cache.add(image_hash, screendump_filename)
+                except IOError, error_detail:
+                    logging.warning("VM '%s' failed to produce a "
+                                    "screendump: %s", vm.name, error_detail)
+                    # Decrement the counter as we in fact failed to
+                    # produce a converted screendump
+                    self.counter[vm.instance] -= 1
+            except NameError:
+                pass
+
+
 def _take_screendumps(test, params, env):
     global _screendump_thread_termination_event
     temp_dir = test.debugdir
@@ -1164,101 +1374,28 @@ def _take_screendumps(test, params, env):
             os.makedirs(temp_dir)
         except OSError:
             pass
-    random_id = utils_misc.generate_random_string(6)
-    temp_filename = "scrdump-%s-iter%s.ppm" % (random_id, test.iteration)
-    temp_filename = os.path.join(temp_dir, temp_filename)
     delay = float(params.get("screendump_delay", 5))
-    quality = int(params.get("screendump_quality", 30))
-    inactivity_treshold = float(params.get("inactivity_treshold", 1800))
-    inactivity_watcher = params.get("inactivity_watcher", "log")
-
-    cache = {}
-    counter = {}
-    inactivity = {}
+    pipeline = _ScreendumpPipeline(test, params, temp_dir)
 
-    while True:
-        for vm in env.get_all_vms():
-            if vm.instance not in counter.keys():
-                counter[vm.instance] = 0
-            if vm.instance not in inactivity.keys():
-                inactivity[vm.instance] = time.time()
-            if not vm.is_alive():
-                continue
-            vm_pid = vm.get_pid()
-            try:
-                vm.screendump(filename=temp_filename, debug=False)
-            except qemu_monitor.MonitorError, e:
-                logging.warn(e)
-                continue
-            except AttributeError, e:
-                logging.warn(e)
-                continue
-            if not os.path.exists(temp_filename):
-                logging.warn("VM '%s' failed to produce a screendump", vm.name)
-                continue
-            if not ppm_utils.image_verify_ppm_file(temp_filename):
-                logging.warn("VM '%s' produced an invalid screendump", vm.name)
-                os.unlink(temp_filename)
-                continue
-            screendump_dir = "screendumps_%s_%s_iter%s" % (vm.name, vm_pid,
-                                                           test.iteration)
-            screendump_dir = os.path.join(test.debugdir, screendump_dir)
-            try:
-                os.makedirs(screendump_dir)
-            except OSError:
-                pass
-            counter[vm.instance] += 1
-            filename = "%04d.jpg" % counter[vm.instance]
-            screendump_filename = os.path.join(screendump_dir, filename)
-            vm.verify_bsod(screendump_filename)
-            image_hash = crypto.hash_file(temp_filename)
-            if image_hash in cache:
-                time_inactive = time.time() - inactivity[vm.instance]
-                if time_inactive > inactivity_treshold:
-                    msg = (
-                        "%s screen is inactive for more than %d s (%d min)" %
-                        (vm.name, time_inactive, time_inactive / 60))
-                    if inactivity_watcher == "error":
-                        try:
-                            raise virt_vm.VMScreenInactiveError(vm,
-                                                                time_inactive)
-                        except virt_vm.VMScreenInactiveError:
-                            logging.error(msg)
-                            # Let's reset the counter
-                            inactivity[vm.instance] = time.time()
-                            test.background_errors.put(sys.exc_info())
-                    elif inactivity_watcher == 'log':
-                        logging.debug(msg)
-                try:
-                    os.link(cache[image_hash], screendump_filename)
-                except OSError:
-                    pass
+    try:
+        while True:
+            start = time.time()
+            pipeline.take(env.get_all_vms())
+            elapsed = time.time() - start
+            if elapsed > delay:
+                logging.debug("Taking screendumps took %.1f s, longer than "
+                              "screendump_delay (%s s)", elapsed, delay)
+
+            if _screendump_thread_termination_event is not None:
+                if _screendump_thread_termination_event.isSet():
+                    _screendump_thread_termination_event = None
+                    break
+                _screendump_thread_termination_event.wait(delay)
             else:
-                inactivity[vm.instance] = time.time()
-                try:
-                    try:
-                        image = PIL.Image.open(temp_filename)
-                        image.save(screendump_filename, format="JPEG",
-                                   quality=quality)
-                        cache[image_hash] = screendump_filename
-                    except IOError, error_detail:
-                        logging.warning("VM '%s' failed to produce a "
-                                        "screendump: %s", vm.name, error_detail)
-                        # Decrement the counter as we in fact failed to
-                        # produce a converted screendump
-                        counter[vm.instance] -= 1
-                except NameError:
-                    pass
-            os.unlink(temp_filename)
-
-        if _screendump_thread_termination_event is not None:
-            if _screendump_thread_termination_event.isSet():
-                _screendump_thread_termination_event = None
+                # Exit event was deleted, exit this thread
                 break
-            _screendump_thread_termination_event.wait(delay)
-        else:
-            # Exit event was deleted, exit this thread
-            break
+    finally:
+        pipeline.close()
 
 
 def store_vm_register(vm, log_filename, append=False):
@@ -1,10 +1,27 @@
 import os
+import errno
+import select
 import posixpath
 import urlparse
 import urllib
 import logging
 import BaseHTTPServer
 import SimpleHTTPServer
+import SocketServer
+# Zero-copy file serving, python >= 3.3 or the pysendfile module.
+# Optional, files are streamed in chunks without it.
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+# Bytes read from disk per write when streaming without sendfile()
+CHUNK_SIZE = 64 * 1024
+# Upper bound of bytes handed to a single sendfile() call
+SENDFILE_SIZE = 8 * 1024 * 1024
 
 
 class HTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
@@ -14,48 +31,128 @@ class HTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         Serve a GET request.
         """
         rg = self.parse_header_byte_range()
-        if rg:
-            f = self.send_head_range(rg[0], rg[1])
+        if rg and not os.path.isdir(self.translate_path(self.path)):
+            f, range_begin, range_end = self.send_head_range(rg[0], rg[1])
             if f:
-                self.copyfile_range(f, self.wfile, rg[0], rg[1])
-                f.close()
+                try:
+                    self.copyfile_range(f, self.wfile, range_begin, range_end)
+                finally:
+                    f.close()
         else:
             f = self.send_head()
             if f:
-                self.copyfile(f, self.wfile)
-                f.close()
+                try:
+                    self.copyfile(f, self.wfile)
+                finally:
+                    f.close()
 
     def parse_header_byte_range(self):
+        """
+        Return the (begin, end) tuple of a single byte range request or None
+
+        Either end may be None, for open-ended ("100-") and suffix ("-100")
+        ranges.  Malformed and multiple range requests are ignored, so the
+        whole file is served as RFC 7233 allows.
+        """
         range_param = 'Range'
         range_discard = 'bytes='
         if self.headers.has_key(range_param):
-            rg = self.headers.get(range_param)
+            rg = self.headers.get(range_param).strip()
             if rg.startswith(range_discard):
                 rg = rg[len(range_discard):]
-                begin, end = rg.split('-')
-                return (int(begin), int(end))
+                try:
+                    begin, end = [int(x) if x.strip() else None
+                                  for x in rg.split('-')]
+                except ValueError:
+                    return None
+                if begin is None and end is None:
+                    return None
+                if begin is not None and end is not None and end < begin:
+                    return None
+                return (begin, end)
         return None
 
+    def copyfile(self, source, outputfile):
+        """
+        Copy all data between two file objects, using sendfile() if possible
+        """
+        try:
+            size = os.fstat(source.fileno()).st_size
+        except (AttributeError, IOError, OSError, ValueError):
+            # Not a real file, e.g. a directory listing
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.copyfile(
+                self, source, outputfile)
+        if size:
+            self.copyfile_range(source, outputfile, 0, size - 1)
+
+    def _sendfile(self, source_file, output_file, offset, count):
+        """
+        Send count bytes at offset of source_file, return bytes sent
+
+        Returns less than count if sendfile() is unusable for these files
+        before anything was sent, or the file shrank meanwhile.
+        """
+        try:
+            in_fd = source_file.fileno()
+            out_fd = output_file.fileno()
+        except (AttributeError, IOError, ValueError):
+            return 0
+        # Headers may still be buffered in output_file
+        output_file.flush()
+        sent_total = 0
+        while sent_total < count:
+            try:
+                sent = sendfile(out_fd, in_fd, offset + sent_total,
+                                min(count - sent_total, SENDFILE_SIZE))
+            except OSError, details:
+                if details.errno in (errno.EAGAIN, errno.EINTR):
+                    # Socket with timeout is non-blocking underneath
+                    select.select([], [out_fd], [])
+                    continue
+                if (details.errno in (errno.EINVAL, errno.ENOSYS) and
+                        sent_total == 0):
+                    return 0
+                raise
+            if sent == 0:
+                break
+            sent_total += sent
+        return sent_total
+
     def copyfile_range(self, source_file, output_file, range_begin, range_end):
         """
         Copies a range of a file to destination.
+
+        The range is sent with sendfile() when available, otherwise streamed
+        in CHUNK_SIZE pieces, so it is never held in memory as a whole.
         """
-        range_size = range_end - range_begin + 1
-        source_file.seek(range_begin)
-        buf = source_file.read(range_size)
-        output_file.write(buf)
+        offset = range_begin
+        remaining = range_end - range_begin + 1
+        if sendfile is not None:
+            sent = self._sendfile(source_file, output_file, offset, remaining)
+            offset += sent
+            remaining -= sent
+        if remaining <= 0:
+            return
+        source_file.seek(offset)
+        while remaining > 0:
+            buf = source_file.read(min(remaining, CHUNK_SIZE))
+            if not buf:
+                break
+            output_file.write(buf)
+            remaining -= len(buf)
 
     def send_head_range(self, range_begin, range_end):
+        """
+        Send headers of a partial content response for the requested path
+
+        :param range_begin: First byte of range or None for a suffix range
+        :param range_end: Last byte of range or None for an open-ended range,
+                          the suffix length for suffix ranges
+        :return: Tuple of opened file, first and last byte to copy, with
+                 file set to None if nothing more needs to be sent
+        """
         path = self.translate_path(self.path)
         f = None
-        if os.path.isdir(path):
-            for index in "index.html", "index.htm":
-                index = os.path.join(path, index)
-                if os.path.exists(index):
-                    path = index
-                    break
-            else:
-                return self.list_directory(path)
         ctype = self.guess_type(path)
         try:
             # Always read in binary mode. Opening files in text mode may cause
@@ -64,9 +161,22 @@ class HTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
             f = open(path, 'rb')
         except IOError:
             self.send_error(404, "File not found")
-            return None
+            return (None, None, None)
+        file_size = os.fstat(f.fileno())[6]
+        if range_begin is None:
+            # Suffix range, the last range_end bytes
+            range_begin = max(file_size - range_end, 0)
+            range_end = file_size - 1
+        elif range_end is None or range_end >= file_size:
+            range_end = file_size - 1
+        if range_begin >= file_size or range_end < range_begin:
+            f.close()
+            self.send_response(416, "Requested Range Not Satisfiable")
+            self.send_header("Content-Range", "bytes */%s" % file_size)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return (None, None, None)
         self.send_response(206, "Partial Content")
-        file_size = str(os.fstat(f.fileno())[6])
         range_size = str(range_end - range_begin + 1)
         self.send_header("Accept-Ranges", "bytes")
         self.send_header("Content-Length", range_size)
@@ -75,7 +185,7 @@ class HTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
                                                               file_size))
         self.send_header("Content-type", ctype)
         self.end_headers()
-        return f
+        return (f, range_begin, range_end)
 
     def translate_path(self, path):
         """
@@ -116,8 +226,31 @@ class HTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
                       (self.address_string(), fmt % args))
 
 
-def http_server(port=8000, cwd=None, terminate_callable=None):
-    http = BaseHTTPServer.HTTPServer(('', port), HTTPRequestHandler)
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+
+    """
+    HTTP server handling each request in its own thread
+    """
+
+    # Don't keep a test from finishing on stuck clients
+    daemon_threads = True
+
+
+def http_server(port=8000, cwd=None, terminate_callable=None, threaded=False):
+    """
+    Serve files below cwd over HTTP until terminate_callable returns True
+
+    :param port: Port to listen on
+    :param cwd: Directory to serve, current directory if None
+    :param terminate_callable: Called about every second, stop if True
+    :param threaded: Serve requests concurrently, one thread per request
+    """
+    if threaded:
+        server_class = ThreadingHTTPServer
+    else:
+        server_class = BaseHTTPServer.HTTPServer
+    http = server_class(('', port), HTTPRequestHandler)
     http.timeout = 1
 
     if cwd is None:
@@ -134,6 +267,7 @@ def http_server(port=8000, cwd=None, terminate_callable=None):
             break
 
         http.handle_request()
+    http.server_close()
 
 
 if __name__ == '__main__':
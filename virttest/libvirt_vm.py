@@ -25,10 +25,12 @@ from . import virt_vm
 from . import storage
 from . import remote
 from . import virsh
+from . import virsh_api
 from . import libvirt_xml
 from . import data_dir
 from . import xml_utils
 from . import utils_selinux
+from . import utils_libguestfs
 
 
 def normalize_connect_uri(connect_uri):
@@ -182,17 +184,51 @@ class VM(virt_vm.BaseVM):
             raise virt_vm.VMDeadError("Domain %s is inactive" % self.name,
                                       self.state())
 
+    def _state_tracker(self):
+        """
+        Return the libvirt event driven domain state tracker of connect_uri.
+
+        :raise virsh_api.APINotSupported: if state tracking is disabled or
+                                          not available
+        """
+        if not virsh.LIBVIRT_EVENTS:
+            raise virsh_api.APINotSupported("Domain events are disabled")
+        try:
+            return virsh_api.state_tracker(self.connect_uri)
+        except virsh_api.APINotSupported, details:
+            if virsh_api.libvirt is None:
+                # Won't get any better, don't try again for every call
+                logging.warning("Not tracking domain states: %s", details)
+                virsh.LIBVIRT_EVENTS = False
+            raise
+
+    def _tracked_state(self):
+        """
+        Return the domain state from the domain state tracker.
+
+        :return: State string, None if the domain is not defined
+        :raise virsh_api.APINotSupported: if state tracking is disabled or
+                                          not available
+        """
+        return self._state_tracker().state(self.name)
+
     def is_alive(self):
         """
         Return True if VM is alive.
         """
-        return virsh.is_alive(self.name, uri=self.connect_uri)
+        try:
+            return self._tracked_state() not in virsh_api.DEAD_STATES
+        except virsh_api.APINotSupported:
+            return virsh.is_alive(self.name, uri=self.connect_uri)
 
     def is_dead(self):
         """
         Return True if VM is dead.
         """
-        return virsh.is_dead(self.name, uri=self.connect_uri)
+        try:
+            return self._tracked_state() in virsh_api.DEAD_STATES
+        except virsh_api.APINotSupported:
+            return virsh.is_dead(self.name, uri=self.connect_uri)
 
     def is_paused(self):
         """
@@ -261,7 +297,11 @@ class VM(virt_vm.BaseVM):
         """
         Return domain state.
         """
-        return virsh.domstate(self.name, uri=self.connect_uri).stdout.strip()
+        try:
+            return self._tracked_state() or ""
+        except virsh_api.APINotSupported:
+            return virsh.domstate(self.name,
+                                  uri=self.connect_uri).stdout.strip()
 
     def get_id(self):
         """
@@ -1541,6 +1581,9 @@ class VM(virt_vm.BaseVM):
                 f.close()
 
             # Generate or copy MAC addresses for all NICs
+            if mac_source is None:
+                # Reserve the MAC addresses of all NICs in one go
+                self.virtnet.generate_mac_addresses()
             for nic in self.virtnet:
                 nic_params = dict(nic)
                 if mac_source is not None:
@@ -1555,6 +1598,13 @@ class VM(virt_vm.BaseVM):
                 logging.debug('VM.create activating nic %s' % nic)
                 self.activate_nic(nic.nic_name)
 
+            # Pooled libguestfs appliances must not have the images open
+            if utils_libguestfs.has_pooled_sessions():
+                utils_libguestfs.drop_pooled_sessions(
+                    [storage.get_image_filename(params.object_params(image),
+                                                root_dir)
+                     for image in params.objects("images")])
+
             # Make qemu command
             install_command = self.make_create_command()
 
@@ -1791,7 +1841,7 @@ class VM(virt_vm.BaseVM):
             raise exceptions.TestFail("dumpxml %s failed.\n"
                                       "Detail: %s.\n" % (self.name, cmd_result))
         thexml = cmd_result.stdout.strip()
-        xtf = xml_utils.XMLTreeFile(thexml)
+        xtf = xml_utils.MemXMLTreeFile(thexml)
         interfaces = xtf.find('devices').findall('interface')
         # Range check
         try:
@@ -1950,6 +2000,15 @@ class VM(virt_vm.BaseVM):
         self.uuid = virsh.domuuid(self.name,
                                   uri=self.connect_uri).stdout.strip()
 
+        # Pooled libguestfs appliances must not have the disks open
+        if utils_libguestfs.has_pooled_sessions():
+            disks = []
+            for disk in libvirt_xml.VMXML.get_disk_source(self.name):
+                source = disk.find("source")
+                if source is not None:
+                    disks.append(source.get("file") or source.get("dev"))
+            utils_libguestfs.drop_pooled_sessions(filter(None, disks))
+
         logging.debug("Starting vm '%s'", self.name)
         result = virsh.start(self.name, uri=self.connect_uri)
         if not result.exit_status:
@@ -1996,6 +2055,19 @@ class VM(virt_vm.BaseVM):
         :param name: Optional timeout value
         """
         timeout = count
+        start_time = time.time()
+        try:
+            shutdown = self._state_tracker().wait_for_state(
+                self.name, virsh_api.DEAD_STATES, timeout)
+        except virsh_api.APINotSupported:
+            # Not tracking states, or the connection closed while waiting
+            count = timeout - int(time.time() - start_time)
+        else:
+            if not shutdown:
+                return False
+            logging.debug("Shutdown took %d seconds",
+                          time.time() - start_time)
+            return True
         while count > 0:
             # check every 5 seconds
             if count % 5 == 0:
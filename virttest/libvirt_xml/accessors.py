@@ -3,8 +3,11 @@ Specializations of base.AccessorBase for particular XML manipulation types
 """
 
 import logging
+import StringIO
+import types
 
 from virttest import xml_utils
+from virttest import element_path
 from virttest.propcan import PropCanBase
 from virttest.libvirt_xml import xcepts, base
 
@@ -16,19 +19,16 @@ def type_check(name, thing, expected):
     """
     Check that thing is expected subclass or instance, raise ValueError if not
     """
-    is_a = type(thing)
-    is_a_name = str(is_a)
     if not isinstance(expected, list):
         expected = [expected]
-    for e in expected:
-        try:
-            it_is = issubclass(thing, e)
-        except TypeError:
-            it_is = isinstance(thing, e)
-        if it_is:
+    # Instances are the common case, avoid issubclass() raising TypeError
+    if isinstance(thing, (type, types.ClassType)):
+        if issubclass(thing, tuple(expected)):
             return
+    elif isinstance(thing, tuple(expected)):
+        return
     raise ValueError('%s value is not any of %s, it is a %s'
-                     % (name, expected, is_a_name))
+                     % (name, expected, str(type(thing))))
 
 
 def add_to_slots(*args):
@@ -40,6 +40,29 @@ def add_to_slots(*args):
     return AccessorBase.__all_slots__ + args
 
 
+# Compiled xpath lookups, keyed by LibvirtXMLBase subclass then xpath.
+# Accessors for one class use a fixed set of xpaths, so this never
+# thrashes like the small shared cache inside element_path does.
+_XPATH_CACHE = {}
+
+
+def compiled_xpath(libvirtxml_class, xpath):
+    """
+    Return cached element_path.Path for xpath, relative to the root element
+    """
+    class_cache = _XPATH_CACHE.setdefault(libvirtxml_class, {})
+    try:
+        return class_cache[xpath]
+    except KeyError:
+        # Same as ElementTree.find() on the whole tree
+        if xpath[:1] == "/":
+            relative = "." + xpath
+        else:
+            relative = xpath
+        path = class_cache[xpath] = element_path.Path(relative)
+        return path
+
+
 class AccessorBase(PropCanBase):
 
     """
@@ -69,8 +92,9 @@ class AccessorBase(PropCanBase):
         self.__dict_set__('property_name', property_name)
         self.__dict_set__('libvirtxml', libvirtxml)
 
+        base_slots = AccessorBase.__all_slots__
         for slot in self.__all_slots__:
-            if slot in AccessorBase.__all_slots__:
+            if slot in base_slots:
                 continue  # already checked these
             # Don't care about value type
             if slot not in dargs:
@@ -92,6 +116,17 @@ class AccessorBase(PropCanBase):
         """
         return self.libvirtxml.xmltreefile
 
+    def find_xpath(self, xpath, element=None):
+        """
+        Return first element matching xpath or None, using compiled xpath
+
+        :param xpath: xpath relative to element
+        :param element: Element to search below, root element if None
+        """
+        if element is None:
+            element = self.xmltreefile().getroot()
+        return compiled_xpath(self.libvirtxml.__class__, xpath).find(element)
+
     def element_by_parent(self, parent_xpath, tag_name, create=True):
         """
         Retrieve/create an element instance at parent_xpath/tag_name
@@ -104,27 +139,30 @@ class AccessorBase(PropCanBase):
         """
         type_check('parent_xpath', parent_xpath, str)
         type_check('tag_name', tag_name, str)
-        parent_element = self.xmltreefile().find(parent_xpath)
+        parent_element = self.find_xpath(parent_xpath)
         if (parent_element == self.xmltreefile().getroot() and
                 parent_element.tag == tag_name):
             return parent_element
-        excpt_str = ('Exception thrown from %s for property "%s" while'
-                     ' looking for element tag "%s", on parent at xpath'
-                     ' "%s", in XML\n%s\n' % (self.operation,
-                                              self.property_name, tag_name, parent_xpath,
-                                              str(self.xmltreefile())))
+
+        def excpt_str():
+            # Serializing the whole XML is costly, only do it on failure
+            return ('Exception thrown from %s for property "%s" while'
+                    ' looking for element tag "%s", on parent at xpath'
+                    ' "%s", in XML\n%s\n' % (self.operation,
+                                             self.property_name, tag_name, parent_xpath,
+                                             str(self.xmltreefile())))
         if parent_element is None:
             if create:
                 # This will only work for simple XPath strings
                 self.xmltreefile().create_by_xpath(parent_xpath)
-                parent_element = self.xmltreefile().find(parent_xpath)
+                parent_element = self.find_xpath(parent_xpath)
             # if create or not, raise if not exist
             if parent_element is None:
-                raise xcepts.LibvirtXMLAccessorError(excpt_str)
+                raise xcepts.LibvirtXMLAccessorError(excpt_str())
         try:
-            element = parent_element.find(tag_name)
+            element = self.find_xpath(tag_name, parent_element)
         except:
-            logging.error(excpt_str)
+            logging.error(excpt_str())
             raise
         if element is None:
             if create:  # Create the element
@@ -202,8 +240,11 @@ class AccessorGeneratorBase(object):
         """
         Setup a callable instance for operation only if not already defined
         """
-        # Don't overwrite methods in libvirtxml instance
-        if not hasattr(self.libvirtxml, self.accessor_name(operation)):
+        # Don't overwrite methods in libvirtxml instance, hasattr() would go
+        # through the costly PropCanBase.__getattr__() for undefined ones
+        try:
+            self.libvirtxml.__super_get__(self.accessor_name(operation))
+        except AttributeError:
             if operation not in self.forbidden:
                 self.assign_callable(operation, self.make_callable(operation))
             else:  # operation is forbidden
@@ -332,9 +373,9 @@ class XMLElementText(AccessorGeneratorBase):
                     xcepts.LibvirtXMLAccessorError):  # parent doesn't exist
                 pass  # already gone
             else:
-                parent = self.xmltreefile().find(self.parent_xpath)
+                parent = self.find_xpath(self.parent_xpath)
                 if parent is not None:
-                    parent.remove(element)
+                    self.xmltreefile().remove(element)
                     self.xmltreefile().write()
 
 
@@ -643,20 +684,17 @@ class XMLElementNest(AccessorGeneratorBase):
                                  'subclass_dargs')
 
         def __call__(self):
-            xmltreefile = self.xmltreefile()
-            # Don't re-invent XPath generation method/behavior
             nested_root_element = self.element_by_parent(self.parent_xpath,
                                                          self.tag_name,
                                                          create=False)
-            nested_root_xpath = xmltreefile.get_xpath(nested_root_element)
-            # Try to make XMLTreeFile copy, rooted at nested_root_xpath
-            # with copies of any/all child elements also
-            nested_xtf = xmltreefile.reroot(nested_root_xpath)
-            # Create instance of subclass to assign nested_xtf onto
+            # Serialize the nested element directly, no need for a
+            # re-rooted copy of the whole tree
+            nested_xml = StringIO.StringIO()
+            xml_utils.ElementTree.ElementTree(nested_root_element).write(
+                nested_xml, xml_utils.ENCODING)
+            # Create instance of subclass to assign nested xml onto
             nestedinst = self.subclass(**self.subclass_dargs)
-            # nestedxml.xmltreefile.restore() will fail on nested_xtf.__del__
-            # set from string not filename!
-            nestedinst.set_xml(str(nested_xtf))
+            nestedinst.set_xml(nested_xml.getvalue())
             return nestedinst
 
     class Setter(AccessorBase):
@@ -734,7 +772,7 @@ class XMLElementList(AccessorGeneratorBase):
 
         def __call__(self):
             # Parent structure cannot be pre-determined as in other classes
-            parent = self.xmltreefile().find(self.parent_xpath)
+            parent = self.find_xpath(self.parent_xpath)
             if parent is None:
                 # Used as "undefined" signal, raising exception may
                 # not be appropriate when other accessors are used
@@ -775,7 +813,7 @@ class XMLElementList(AccessorGeneratorBase):
         def __call__(self, value):
             type_check('value', value, list)
             # Allow other classes to generate parent structure
-            parent = self.xmltreefile().find(self.parent_xpath)
+            parent = self.find_xpath(self.parent_xpath)
             if parent is None:
                 raise xcepts.LibvirtXMLNotFoundError
             # Remove existing by calling accessor method, allowing
@@ -844,7 +882,7 @@ class XMLElementList(AccessorGeneratorBase):
         __slots__ = add_to_slots('parent_xpath', 'marshal_to')
 
         def __call__(self):
-            parent = self.xmltreefile().find(self.parent_xpath)
+            parent = self.find_xpath(self.parent_xpath)
             if parent is None:
                 raise xcepts.LibvirtXMLNotFoundError("Parent element %s not "
                                                      "found" % self.parent_xpath)
@@ -870,4 +908,4 @@ class XMLElementList(AccessorGeneratorBase):
                 if item is not None:
                     todel.append(child)
             for child in todel:
-                parent.remove(child)
+                self.xmltreefile().remove(child)
@@ -113,8 +113,9 @@ class LibvirtXMLBase(propcan.PropCanBase):
                     del self['xml']  # clean up old temporary files
             except KeyError:
                 pass  # Allow other exceptions through
-            # value could be filename or a string full of XML
-            self.__dict_set__('xml', xml_utils.XMLTreeFile(value))
+            # value could be filename or a string full of XML, files are
+            # only written when the filename is needed
+            self.__dict_set__('xml', xml_utils.MemXMLTreeFile(value))
 
     def get_xml(self):
         """
@@ -160,9 +161,8 @@ class LibvirtXMLBase(propcan.PropCanBase):
         try:
             # file may not be accessible, obtain XML string value
             xmlstr = str(self.__dict_get__('xml'))
-            # Create fresh/new XMLTreeFile along with tmp files from XML content
-            # content
-            the_copy.__dict_set__('xml', xml_utils.XMLTreeFile(xmlstr))
+            # Create fresh/new XMLTreeFile from XML content
+            the_copy.__dict_set__('xml', xml_utils.MemXMLTreeFile(xmlstr))
         except xcepts.LibvirtXMLError:  # Allow other exceptions through
             pass  # no XML was loaded yet
         return the_copy
@@ -222,6 +222,10 @@ class LibvirtXMLBase(propcan.PropCanBase):
         return cmdresult
 
 
+# Handler classes loaded by load_xml_module(), keyed by (path, name)
+_XML_MODULE_CLASSES = {}
+
+
 def load_xml_module(path, name, type_list):
     """
     Returns named xml element's handler class
@@ -237,12 +241,19 @@ def load_xml_module(path, name, type_list):
               % (str(name), type_list))
     if name not in type_list:
         raise xcepts.LibvirtXMLError(errmsg)
+    # Loading the module again would re-create its classes each time
+    try:
+        return _XML_MODULE_CLASSES[(path, name)]
+    except KeyError:
+        pass
     try:
         filename, pathname, description = imp.find_module(name,
                                                           [path])
         mod_obj = imp.load_module(name, filename, pathname, description)
         # Enforce capitalized class names
-        return getattr(mod_obj, name.capitalize())
+        handler_cl = getattr(mod_obj, name.capitalize())
+        _XML_MODULE_CLASSES[(path, name)] = handler_cl
+        return handler_cl
     except TypeError, detail:
         raise xcepts.LibvirtXMLError(errmsg + ': %s' % str(detail))
     except ImportError, detail:
@@ -5,11 +5,12 @@ Utility functions to deal with ppm (qemu screendump format) files.
 """
 
 import os
-import struct
 import time
 import re
 import glob
 import logging
+import mmap
+from itertools import izip
 try:
     from PIL import Image
 except ImportError:
@@ -22,6 +23,11 @@ try:
     import hashlib
 except ImportError:
     import md5
+# Optional, the image operations fall back to pure python without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Some directory/filename utils, for consistency
 
@@ -105,6 +111,63 @@ def image_read_from_ppm_file(filename):
     return (w, h, data)
 
 
+def image_map_ppm_file(filename):
+    """
+    Map a PPM image into memory instead of reading it.
+
+    The data can be passed to all the functions taking image data, only the
+    pages actually used are read from the file.
+
+    :return: A 3 element tuple containing the width, height and data of the
+            image, the data being a read-only buffer backed by the file.
+    """
+    fin = open(filename, "rb")
+    try:
+        fin.readline()
+        l2 = fin.readline()
+        fin.readline()
+        offset = fin.tell()
+        mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fin.close()
+
+    (w, h) = map(int, l2.split())
+    return (w, h, buffer(mapped, offset))
+
+
+def _image_pixels(width, height, data):
+    """
+    Return the image data as a (pixels, 3) numpy array, without copying.
+    """
+    return numpy.frombuffer(data, dtype=numpy.uint8,
+                            count=width * height * 3).reshape(-1, 3)
+
+
+def _image_clip_region(width, height, x1, y1, dx, dy):
+    """
+    Clip a region to the image, see image_crop().
+    """
+    if x1 > width - 1:
+        x1 = width - 1
+    if y1 > height - 1:
+        y1 = height - 1
+    if dx > width - x1:
+        dx = width - x1
+    if dy > height - y1:
+        dy = height - y1
+    return (x1, y1, dx, dy)
+
+
+def _image_region_rows(width, data, x1, y1, dx, dy):
+    """
+    Yield the data of every row of a (clipped) region.
+    """
+    index = (x1 + y1 * width) * 3
+    for _ in xrange(dy):
+        yield data[index:(index + dx * 3)]
+        index += width * 3
+
+
 def image_write_to_ppm_file(filename, width, height, data):
     """
     Write a PPM image with the given width, height and data.
@@ -135,19 +198,8 @@ def image_crop(width, height, data, x1, y1, dx, dy):
     :return: A 3-tuple containing the width, height and data of the
              cropped image.
     """
-    if x1 > width - 1:
-        x1 = width - 1
-    if y1 > height - 1:
-        y1 = height - 1
-    if dx > width - x1:
-        dx = width - x1
-    if dy > height - y1:
-        dy = height - y1
-    newdata = ""
-    index = (x1 + y1 * width) * 3
-    for _ in range(dy):
-        newdata += data[index:(index + dx * 3)]
-        index += width * 3
+    (x1, y1, dx, dy) = _image_clip_region(width, height, x1, y1, dx, dy)
+    newdata = "".join(_image_region_rows(width, data, x1, y1, dx, dy))
     return (dx, dy, newdata)
 
 
@@ -180,11 +232,17 @@ def get_region_md5sum(width, height, data, x1, y1, dx, dy,
     :param cropped_image_filename: if not None, write the resulting cropped
             image to a file with this name
     """
-    (cw, ch, cdata) = image_crop(width, height, data, x1, y1, dx, dy)
-    # Write cropped image for debugging
     if cropped_image_filename:
+        (cw, ch, cdata) = image_crop(width, height, data, x1, y1, dx, dy)
+        # Write cropped image for debugging
         image_write_to_ppm_file(cropped_image_filename, cw, ch, cdata)
-    return image_md5sum(cw, ch, cdata)
+        return image_md5sum(cw, ch, cdata)
+    # Hash the rows of the region right away instead of building a copy
+    (x1, y1, dx, dy) = _image_clip_region(width, height, x1, y1, dx, dy)
+    hsh = md5eval("P6\n%d %d\n255\n" % (dx, dy))
+    for row in _image_region_rows(width, data, x1, y1, dx, dy):
+        hsh.update(row)
+    return hsh.hexdigest()
 
 
 def image_verify_ppm_file(filename):
@@ -224,31 +282,40 @@ def image_comparison(width, height, data1, data2):
 
     :note: Input images must be the same size.
     """
-    newdata = ""
-    i = 0
-    while i < width * height * 3:
-        # Compute monochromatic value of current pixel in data1
-        pixel1_str = data1[i:i + 3]
-        temp = struct.unpack("BBB", pixel1_str)
-        value1 = int((temp[0] + temp[1] + temp[2]) / 3)
-        # Compute monochromatic value of current pixel in data2
-        pixel2_str = data2[i:i + 3]
-        temp = struct.unpack("BBB", pixel2_str)
-        value2 = int((temp[0] + temp[1] + temp[2]) / 3)
-        # Compute average of the two values
-        value = int((value1 + value2) / 2)
-        # Scale value to the upper half of the range [0, 255]
-        value = 128 + value / 2
-        # Compare pixels
-        if pixel1_str == pixel2_str:
-            # Equal -- give the pixel a greenish hue
-            newpixel = [0, value, 0]
+    if numpy is not None:
+        pixels1 = _image_pixels(width, height, data1)
+        pixels2 = _image_pixels(width, height, data2)
+        # Monochromatic values of both images
+        value1 = pixels1.sum(axis=1) // 3
+        value2 = pixels2.sum(axis=1) // 3
+        # Scale their average to the upper half of the range [0, 255]
+        value = (128 + (value1 + value2) // 4).astype(numpy.uint8)
+        equal = (pixels1 == pixels2).all(axis=1)
+        newpixels = numpy.zeros_like(pixels1)
+        # Equal pixels get a greenish hue, the others a reddish hue
+        newpixels[equal, 1] = value[equal]
+        newpixels[~equal, 0] = value[~equal]
+        return (width, height, newpixels.tostring())
+
+    size = width * height * 3
+    bytes1 = bytearray(data1[:size])
+    bytes2 = bytearray(data2[:size])
+    pixels1 = izip(bytes1[0::3], bytes1[1::3], bytes1[2::3])
+    pixels2 = izip(bytes2[0::3], bytes2[1::3], bytes2[2::3])
+    green = bytearray(width * height)
+    red = bytearray(width * height)
+    for i, (pixel1, pixel2) in enumerate(izip(pixels1, pixels2)):
+        # Average of the monochromatic values of both pixels, scaled to
+        # the upper half of the range [0, 255]
+        value = 128 + (sum(pixel1) // 3 + sum(pixel2) // 3) // 4
+        if pixel1 == pixel2:
+            green[i] = value
         else:
-            # Not equal -- give the pixel a reddish hue
-            newpixel = [value, 0, 0]
-        newdata += struct.pack("BBB", newpixel[0], newpixel[1], newpixel[2])
-        i += 3
-    return (width, height, newdata)
+            red[i] = value
+    newdata = bytearray(size)
+    newdata[0::3] = red
+    newdata[1::3] = green
+    return (width, height, str(newdata))
 
 
 def image_fuzzy_compare(width, height, data1, data2):
@@ -263,19 +330,24 @@ def image_fuzzy_compare(width, height, data1, data2):
 
     :note: Input images must be the same size.
     """
-    equal = 0.0
-    different = 0.0
-    i = 0
-    while i < width * height * 3:
-        pixel1_str = data1[i:i + 3]
-        pixel2_str = data2[i:i + 3]
-        # Compare pixels
-        if pixel1_str == pixel2_str:
-            equal += 1.0
-        else:
-            different += 1.0
-        i += 3
-    return equal / (equal + different)
+    if numpy is not None:
+        pixels1 = _image_pixels(width, height, data1)
+        pixels2 = _image_pixels(width, height, data2)
+        return float((pixels1 == pixels2).all(axis=1).mean())
+
+    # Only the rows which differ are compared pixel by pixel
+    equal = 0
+    row_size = width * 3
+    for index in xrange(0, width * height * 3, row_size):
+        row1 = data1[index:index + row_size]
+        row2 = data2[index:index + row_size]
+        if row1 == row2:
+            equal += width
+            continue
+        for i in xrange(0, row_size, 3):
+            if row1[i:i + 3] == row2[i:i + 3]:
+                equal += 1
+    return float(equal) / (width * height)
 
 
 def image_average_hash(image, img_wd=8, img_ht=8):
@@ -8,10 +8,13 @@ interact and verify the qemu qdev structure.
 """
 
 # Python imports
+import cPickle
+import hashlib
 import logging
 import re
 import os
 import shutil
+import tempfile
 
 # Avocado imports
 from avocado.core import exceptions
@@ -24,6 +27,102 @@ from . import qdevices
 from .utils import (DeviceError, DeviceHotplugError, DeviceInsertError,
                     DeviceRemoveError, DeviceUnplugError, none_or_int)
 
+#
+# Cache of qemu capabilities
+#
+
+
+class QemuCapabilitiesCache(object):
+
+    """
+    Outputs of the qemu capability probes, kept in memory and on disk.
+
+    Entries are keyed by the qemu binary path together with its device,
+    inode, size and mtime, so updated/rebuilt binaries get probed again.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: Where to persist entries (default: data dir cache)
+        """
+        self.cache_dir = cache_dir
+        self.__entries = {}
+
+    @staticmethod
+    def get_key(qemu_binary):
+        """
+        :return: Key identifying the qemu binary or None when not a file
+        """
+        try:
+            stat = os.stat(qemu_binary)
+        except OSError:
+            return None
+        return "%s:%s:%s:%s:%s" % (os.path.realpath(qemu_binary), stat.st_dev,
+                                   stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def __get_path(self, key):
+        if self.cache_dir is None:
+            self.cache_dir = data_dir.get_cache_dir('qemu_caps')
+        return os.path.join(self.cache_dir,
+                            "%s.pickle" % hashlib.sha1(key).hexdigest())
+
+    def get(self, qemu_binary):
+        """
+        :return: Cached capabilities (dict) of qemu_binary or None
+        """
+        key = self.get_key(qemu_binary)
+        if key is None:
+            return None
+        if key not in self.__entries:
+            try:
+                cache_file = open(self.__get_path(key), "rb")
+                try:
+                    entry = cPickle.load(cache_file)
+                finally:
+                    cache_file.close()
+            except Exception:
+                return None
+            if entry.get("key") != key:
+                return None
+            self.__entries[key] = entry["caps"]
+        return self.__entries[key]
+
+    def set(self, qemu_binary, caps):
+        """
+        Store capabilities of qemu_binary.
+
+        :param caps: Dict of probe outputs
+        """
+        key = self.get_key(qemu_binary)
+        if key is None:
+            return
+        self.__entries[key] = caps
+        try:
+            path = self.__get_path(key)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                cache_file = os.fdopen(fd, "wb")
+                try:
+                    cPickle.dump({"key": key, "caps": caps}, cache_file,
+                                 cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    cache_file.close()
+                os.rename(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError), details:
+            logging.warn("Failed to store qemu capabilities of %s: %s",
+                         qemu_binary, details)
+
+    def clear(self):
+        """ Forget the in-memory entries """
+        self.__entries = {}
+
+
+QEMU_CAPS_CACHE = QemuCapabilitiesCache()
+
+
 #
 # Device container (device representation of VM)
 # This class represents VM by storing all devices and their connections (buses)
@@ -87,25 +186,47 @@ class DevContainer(object):
             if cmds:    # If no mathes, return None
                 return cmds
 
-        self.__state = -1    # -1 synchronized, 0 synchronized after hotplug
-        self.__qemu_help = process.system_output("%s -help" % qemu_binary,
-                                                 timeout=10, ignore_status=True,
+        def probe_caps(qemu_binary, workaround_qemu_qmp_crash=False):
+            """ :return: dict of outputs of all capability probes """
+            caps = {}
+            caps['help'] = process.system_output("%s -help" % qemu_binary,
+                                                 timeout=10,
+                                                 ignore_status=True,
                                                  shell=True, verbose=False)
-        # escape the '?' otherwise it will fail if we have a single-char
-        # filename in cwd
-        self.__device_help = process.system_output("%s -device \? 2>&1" %
-                                                   qemu_binary, timeout=10,
-                                                   ignore_status=True,
-                                                   shell=True,
-                                                   verbose=False)
-        self.__machine_types = process.system_output("%s -M ?" % qemu_binary,
-                                                     timeout=10,
-                                                     ignore_status=True,
-                                                     shell=True,
-                                                     verbose=False)
-        self.__hmp_cmds = get_hmp_cmds(qemu_binary)
-        self.__qmp_cmds = get_qmp_cmds(qemu_binary,
-                                       workaround_qemu_qmp_crash == 'always')
+            # escape the '?' otherwise it will fail if we have a single-char
+            # filename in cwd
+            caps['device_help'] = process.system_output("%s -device \? 2>&1"
+                                                        % qemu_binary,
+                                                        timeout=10,
+                                                        ignore_status=True,
+                                                        shell=True,
+                                                        verbose=False)
+            caps['machine_types'] = process.system_output("%s -M ?" %
+                                                          qemu_binary,
+                                                          timeout=10,
+                                                          ignore_status=True,
+                                                          shell=True,
+                                                          verbose=False)
+            caps['hmp_cmds'] = get_hmp_cmds(qemu_binary)
+            caps['qmp_cmds'] = get_qmp_cmds(qemu_binary,
+                                            workaround_qemu_qmp_crash)
+            return caps
+
+        self.__state = -1    # -1 synchronized, 0 synchronized after hotplug
+        caps = QEMU_CAPS_CACHE.get(qemu_binary)
+        if caps is None:
+            caps = probe_caps(qemu_binary,
+                              workaround_qemu_qmp_crash == 'always')
+            # Don't remember failed (timed out or empty) probes
+            if (caps['help'] and caps['device_help'] and
+                    caps['machine_types'] and caps['hmp_cmds'] and
+                    caps['qmp_cmds'] is not None):
+                QEMU_CAPS_CACHE.set(qemu_binary, caps)
+        self.__qemu_help = caps['help']
+        self.__device_help = caps['device_help']
+        self.__machine_types = caps['machine_types']
+        self.__hmp_cmds = caps['hmp_cmds']
+        self.__qmp_cmds = caps['qmp_cmds']
         self.vmname = vmname
         self.strict_mode = strict_mode == 'yes'
         self.__devices = []
@@ -413,7 +534,8 @@ class DevContainer(object):
         :param cmd: Desired command
         :return: Is the desired command supported by this qemu's QMP monitor?
         """
-        return cmd in self.__qmp_cmds
+        # None when the QMP probe failed
+        return bool(self.__qmp_cmds) and cmd in self.__qmp_cmds
 
     def execute_qemu(self, options, timeout=5):
         """
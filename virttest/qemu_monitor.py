@@ -11,6 +11,8 @@ import logging
 import select
 import re
 import os
+import collections
+import weakref
 
 from . import passfd_setup
 from . import utils_misc
@@ -127,7 +129,12 @@ def create_monitor(vm, monitor_name, monitor_params):
 
     monitor_filename = get_monitor_filename(vm, monitor_name)
     logging.info("Connecting to monitor '%s'", monitor_name)
-    monitor = monitor_creator(vm, monitor_name, monitor_filename)
+    if monitor_creator is QMPMonitor:
+        event_reader = monitor_params.get("qmp_event_reader") == "yes"
+        monitor = monitor_creator(vm, monitor_name, monitor_filename,
+                                  event_reader=event_reader)
+    else:
+        monitor = monitor_creator(vm, monitor_name, monitor_filename)
     monitor.verify_responsive()
 
     return monitor
@@ -1137,6 +1144,49 @@ class HumanMonitor(Monitor):
         return self.cmd(cmd)
 
 
+def _qmp_reader(monitor_ref, sock):
+    """
+    Body of the QMPMonitor event reader thread.
+
+    Only a weak reference to the monitor is held between reads, so the
+    monitor can still be garbage collected (closing its socket) while the
+    thread runs.
+
+    :param monitor_ref: weakref.ref to the QMPMonitor
+    :param sock: The monitor socket
+    """
+    while True:
+        error = None
+        data = None
+        try:
+            if select.select([sock], [], [], QMPMonitor.READER_TICK)[0]:
+                data = sock.recv(QMPMonitor.RECV_SIZE)
+                if not data:
+                    error = MonitorSocketError("Monitor connection closed",
+                                               "EOF")
+        except (socket.error, select.error, ValueError), e:
+            error = MonitorSocketError("Could not receive data from monitor",
+                                       e)
+        monitor = monitor_ref()
+        if monitor is None:
+            return
+        if error is not None:
+            monitor._reader_stop(error)
+            return
+        try:
+            if data:
+                monitor._reader_feed(data)
+            else:
+                monitor._reader_tick()
+        except Exception, e:
+            # Don't leave waiters blocked on a dead reader
+            monitor._reader_stop(MonitorError("QMP reader of monitor %s "
+                                              "failed: %s" % (monitor.name,
+                                                              e)))
+            return
+        del monitor
+
+
 class QMPMonitor(Monitor):
 
     """
@@ -1147,15 +1197,29 @@ class QMPMonitor(Monitor):
     CMD_TIMEOUT = 120
     RESPONSE_TIMEOUT = 120
     PROMPT_TIMEOUT = 60
+    GREETING_TIMEOUT = 20
+    # Event reader mode: max number of queued events (the oldest ones are
+    # dropped first), recv() size and how often the reader thread wakes up
+    # waiters to let them check their timeouts
+    MAX_EVENTS = 1024
+    RECV_SIZE = 65536
+    READER_TICK = 0.5
 
-    def __init__(self, vm, name, filename, suppress_exceptions=False):
+    def __init__(self, vm, name, filename, suppress_exceptions=False,
+                 event_reader=False):
         """
         Connect to the monitor socket, read the greeting message and issue the
         qmp_capabilities command.  Also make sure the json module is available.
 
+        With event_reader, a background thread reads and decodes everything
+        QEMU sends.  Replies are handed to the waiting caller by id and events
+        are queued, so several threads can have commands in flight on the
+        same monitor at the same time.
+
         :param vm: The VM which this monitor belongs to.
         :param name: Monitor identifier (a string)
         :param filename: Monitor socket filename
+        :param event_reader: Read the monitor from a background thread
 
         :raise MonitorConnectError: Raised if the connection fails and
                 suppress_exceptions is False
@@ -1173,6 +1237,7 @@ class QMPMonitor(Monitor):
             self._greeting = None
             self._events = []
             self._supported_hmp_cmds = []
+            self._event_reader = event_reader
 
             # Make sure json is available
             try:
@@ -1181,21 +1246,11 @@ class QMPMonitor(Monitor):
                 raise MonitorNotSupportedError("QMP requires the json module "
                                                "(Python 2.6 and up)")
 
-            # Read greeting message
-            end_time = time.time() + 20
-            output_str = ""
-            while time.time() < end_time:
-                for obj in self._read_objects():
-                    output_str += str(obj)
-                    if "QMP" in obj:
-                        self._greeting = obj
-                        break
-                if self._greeting:
-                    break
-                time.sleep(0.1)
+            if event_reader:
+                self._start_reader()
+                self._wait_greeting()
             else:
-                raise MonitorProtocolError("No QMP greeting message received."
-                                           " Output so far: %s" % output_str)
+                self._read_greeting()
 
             # Issue qmp_capabilities
             self.cmd("qmp_capabilities")
@@ -1210,7 +1265,192 @@ class QMPMonitor(Monitor):
             else:
                 raise
 
+    def __getinitargs__(self):
+        return self.vm, self.name, self.filename, True, self._event_reader
+
+    def _close_sock(self):
+        Monitor._close_sock(self)
+        # Don't leave anybody waiting for the reader thread to notice
+        if hasattr(self, "_cond"):
+            self._reader_stop(MonitorSocketError("Monitor socket closed",
+                                                 self.name))
+
     # Private methods
+    def _read_greeting(self):
+        end_time = time.time() + self.GREETING_TIMEOUT
+        output_str = ""
+        while time.time() < end_time:
+            for obj in self._read_objects():
+                output_str += str(obj)
+                if "QMP" in obj:
+                    self._greeting = obj
+                    break
+            if self._greeting:
+                break
+            time.sleep(0.1)
+        else:
+            raise MonitorProtocolError("No QMP greeting message received."
+                                       " Output so far: %s" % output_str)
+
+    def _start_reader(self):
+        """
+        Set up the event reader state and start the reader thread.
+        """
+        self._events = collections.deque(maxlen=self.MAX_EVENTS)
+        # Protects everything below, notified on every decoded object, on
+        # each reader tick and when the reader stops
+        self._cond = threading.Condition(threading.Lock())
+        self._send_lock = threading.Lock()
+        self._raw_lock = threading.RLock()
+        # Replies to cmd(), keyed by id; None until the reply arrives
+        self._replies = {}
+        # Replies nobody waits for by id (cmd_raw() & co)
+        self._untagged = collections.deque()
+        self._reader_buf = ""
+        self._reader_error = None
+        # recv() is only called after select(), the socket doesn't need the
+        # connect timeout anymore
+        self._socket.settimeout(None)
+        self._reader = threading.Thread(target=_qmp_reader,
+                                        name="qmp-reader-%s" % self.name,
+                                        args=(weakref.ref(self),
+                                              self._socket))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _reader_feed(self, data):
+        """
+        Decode the complete lines of the received data and dispatch them.
+        Called from the reader thread only; every line is decoded once.
+
+        :param data: The data just received from the socket
+        """
+        lines = (self._reader_buf + data).split("\n")
+        self._reader_buf = lines.pop()
+        objs = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                logging.warn("(monitor %s) Ignoring undecodable line: %r",
+                             self.name, line)
+                continue
+            self._log_lines(line)
+            objs.append(obj)
+        with self._cond:
+            for obj in objs:
+                if not isinstance(obj, dict):
+                    continue
+                if "event" in obj:
+                    self._events.append(obj)
+                elif "QMP" in obj:
+                    self._greeting = obj
+                elif "return" in obj or "error" in obj:
+                    q_id = obj.get("id")
+                    if q_id is not None and q_id in self._replies:
+                        self._replies[q_id] = obj
+                    else:
+                        self._untagged.append(obj)
+            self._cond.notify_all()
+
+    def _reader_tick(self):
+        """
+        Wake up all waiters so they can check their timeouts.
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def _reader_stop(self, error):
+        """
+        Record why the reader thread stopped and fail all waiters with it.
+
+        :param error: A MonitorError describing why the reader stopped
+        """
+        with self._cond:
+            if self._reader_error is None:
+                self._reader_error = error
+            self._cond.notify_all()
+
+    def _wait_locked(self, func, timeout):
+        """
+        Wait until func() returns something other than None.
+
+        Must be called with self._cond held.  Blocks on the condition, the
+        reader thread wakes it up on new data and every READER_TICK seconds;
+        the wait itself is bounded by timeout too.
+
+        :param func: Function checking the reader state
+        :param timeout: Time to wait in seconds
+        :return: The value returned by func(), or None on timeout
+        :raise MonitorSocketError: Raised if the reader thread has stopped
+        """
+        end_time = time.time() + timeout
+        while True:
+            ret = func()
+            if ret is not None:
+                return ret
+            if self._reader_error is not None:
+                raise self._reader_error
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None
+            self._cond.wait(remaining)
+
+    def _wait_greeting(self):
+        with self._cond:
+            greeting = self._wait_locked(lambda: self._greeting,
+                                         self.GREETING_TIMEOUT)
+        if greeting is None:
+            raise MonitorProtocolError("No QMP greeting message received."
+                                       " Output so far: %r"
+                                       % self._reader_buf)
+
+    def _send_reader(self, data, fd=None):
+        """
+        Send data in event reader mode, optionally passing a file descriptor.
+
+        :param data: Data to send
+        :param fd: file object or file descriptor to pass
+        :raise MonitorSocketError: Raised if a socket error occurs
+        """
+        with self._send_lock:
+            if fd is None:
+                self._send(data)
+                return
+            if self._passfd is None:
+                self._passfd = passfd_setup.import_passfd()
+            try:
+                self._passfd.sendfd(self._socket, fd, data)
+            except socket.error, e:
+                raise MonitorSocketError("Could not send data: %r" % data, e)
+            self._log_lines(data)
+
+    def _cmd_reader(self, cmdobj, timeout, fd=None):
+        """
+        Send a command in event reader mode and wait for the reply with the
+        same id.  Other threads may send commands meanwhile.
+
+        :param cmdobj: The command object, must have an "id" key
+        :param timeout: Time duration to wait for response
+        :param fd: file object or file descriptor to pass
+        :return: The response dict, or None if none was received in time
+        """
+        q_id = cmdobj["id"]
+        with self._cond:
+            if self._reader_error is not None:
+                raise self._reader_error
+            self._replies[q_id] = None
+        try:
+            self._send_reader(json.dumps(cmdobj) + "\n", fd)
+            with self._cond:
+                return self._wait_locked(lambda: self._replies[q_id],
+                                         timeout)
+        finally:
+            with self._cond:
+                self._replies.pop(q_id, None)
+
     def _build_cmd(self, cmd, args=None, q_id=None):
         obj = {"execute": cmd}
         if args is not None:
@@ -1402,6 +1642,14 @@ class QMPMonitor(Monitor):
                             where data is the error data)
         """
         self._log_command(cmd, debug)
+        if self._event_reader:
+            q_id = utils_misc.generate_random_string(8)
+            cmdobj = self._build_cmd(cmd, args, q_id)
+            if debug:
+                logging.debug("Send command: %s" % cmdobj)
+            r = self._cmd_reader(cmdobj, timeout, fd)
+            return self._check_response(cmd, args, r, debug)
+
         if not self._acquire_lock():
             raise MonitorLockError("Could not acquire exclusive lock to send "
                                    "QMP command '%s'" % cmd)
@@ -1425,22 +1673,28 @@ class QMPMonitor(Monitor):
                 self._send(json.dumps(cmdobj) + "\n")
             # Read response
             r = self._get_response(q_id, timeout)
-            if r is None:
-                raise MonitorProtocolError("Received no response to QMP "
-                                           "command '%s', or received a "
-                                           "response with an incorrect id"
-                                           % cmd)
-            if "return" in r:
-                ret = r["return"]
-                if ret:
-                    self._log_response(cmd, ret, debug)
-                return ret
-            if "error" in r:
-                raise QMPCmdError(cmd, args, r["error"])
+            return self._check_response(cmd, args, r, debug)
 
         finally:
             self._lock.release()
 
+    def _check_response(self, cmd, args, r, debug=True):
+        """
+        Return the result of a cmd() response, or raise its error.
+        """
+        if r is None:
+            raise MonitorProtocolError("Received no response to QMP "
+                                       "command '%s', or received a "
+                                       "response with an incorrect id"
+                                       % cmd)
+        if "return" in r:
+            ret = r["return"]
+            if ret:
+                self._log_response(cmd, ret, debug)
+            return ret
+        if "error" in r:
+            raise QMPCmdError(cmd, args, r["error"])
+
     def cmd_raw(self, data, timeout=CMD_TIMEOUT):
         """
         Send a raw string to the QMP monitor and return the response.
@@ -1454,6 +1708,9 @@ class QMPMonitor(Monitor):
         :raise MonitorSocketError: Raised if a socket error occurs
         :raise MonitorProtocolError: Raised if no response is received
         """
+        if self._event_reader:
+            return self._cmd_raw_reader(data, timeout)
+
         if not self._acquire_lock():
             raise MonitorLockError("Could not acquire exclusive lock to send "
                                    "data: %r" % data)
@@ -1470,6 +1727,30 @@ class QMPMonitor(Monitor):
         finally:
             self._lock.release()
 
+    def _cmd_raw_reader(self, data, timeout):
+        """
+        cmd_raw() in event reader mode.  Raw data may carry any id (or none),
+        so the reply is the first one nobody waits for by id; raw commands are
+        serialized against each other, but not against cmd().
+        """
+        if not self._acquire_lock(lock=self._raw_lock):
+            raise MonitorLockError("Could not acquire exclusive lock to send "
+                                   "data: %r" % data)
+        try:
+            with self._cond:
+                self._untagged.clear()
+            self._send_reader(data)
+            with self._cond:
+                r = self._wait_locked(
+                    lambda: self._untagged and self._untagged.popleft() or
+                    None, timeout)
+            if r is None:
+                raise MonitorProtocolError("Received no response to data: %r" %
+                                           data)
+            return r
+        finally:
+            self._raw_lock.release()
+
     def cmd_obj(self, obj, timeout=CMD_TIMEOUT):
         """
         Transform a Python object to JSON, send the resulting string to the QMP
@@ -1542,12 +1823,15 @@ class QMPMonitor(Monitor):
         :return: A list of events (the objects returned have an "event" key)
         :raise MonitorLockError: Raised if the lock cannot be acquired
         """
+        if self._event_reader:
+            with self._cond:
+                return list(self._events)
         if not self._acquire_lock():
             raise MonitorLockError("Could not acquire exclusive lock to read "
                                    "QMP events")
         try:
             self._read_objects()
-            return self._events[:]
+            return list(self._events)
         finally:
             self._lock.release()
 
@@ -1562,6 +1846,63 @@ class QMPMonitor(Monitor):
             if e.get("event") == name:
                 return e
 
+    def wait_for_event(self, name, timeout=CMD_TIMEOUT):
+        """
+        Wait until an event with the given name is in the list of events.
+
+        :param name: The name of the event to wait for (e.g. 'STOP')
+        :param timeout: Time to wait in seconds
+        :return: An event object or None if none was received in time
+        """
+        if not self._event_reader:
+            return utils_misc.wait_for(lambda: self.get_event(name), timeout,
+                                       step=0.1)
+
+        def find():
+            for e in self._events:
+                if e.get("event") == name:
+                    return e
+        with self._cond:
+            return self._wait_locked(find, timeout)
+
+    def pop_events(self, names, timeout=0):
+        """
+        Wait until events with one of the given names are in the list of
+        events, then remove them from the list and return them.
+
+        Unlike repeated get_event()/clear_event() calls, no event received in
+        between can be lost.
+
+        :param names: Names of the events to wait for (e.g. ['MIGRATION'])
+        :param timeout: Time to wait in seconds
+        :return: A list of the events removed, in the order they were
+                received; empty if none was received in time
+        :raise MonitorLockError: Raised if the lock cannot be acquired
+        """
+        def take():
+            events = [e for e in self._events if e.get("event") in names]
+            for e in events:
+                self._events.remove(e)
+            return events or None
+
+        if self._event_reader:
+            with self._cond:
+                return self._wait_locked(take, timeout) or []
+
+        end_time = time.time() + timeout
+        while True:
+            if not self._acquire_lock():
+                raise MonitorLockError("Could not acquire exclusive lock to "
+                                       "read QMP events")
+            try:
+                self._read_objects()
+                events = take()
+            finally:
+                self._lock.release()
+            if events or time.time() >= end_time:
+                return events or []
+            time.sleep(0.1)
+
     def human_monitor_cmd(self, cmd="", timeout=CMD_TIMEOUT,
                           debug=True, fd=None):
         """
@@ -1589,6 +1930,10 @@ class QMPMonitor(Monitor):
 
         :raise MonitorLockError: Raised if the lock cannot be acquired
         """
+        if self._event_reader:
+            with self._cond:
+                self._events.clear()
+            return
         if not self._acquire_lock():
             raise MonitorLockError("Could not acquire exclusive lock to clear "
                                    "QMP event list")
@@ -1601,6 +1946,12 @@ class QMPMonitor(Monitor):
 
         :raise MonitorLockError: Raised if the lock cannot be acquired
         """
+        if self._event_reader:
+            with self._cond:
+                kept = [e for e in self._events if e.get("event") != name]
+                self._events.clear()
+                self._events.extend(kept)
+            return
         if not self._acquire_lock():
             raise MonitorLockError("Could not acquire exclusive lock to clear "
                                    "QMP event list")
@@ -1797,6 +2148,35 @@ class QMPMonitor(Monitor):
         args = {"value": val}
         return self.cmd("migrate_set_downtime", args)
 
+    def migrate_set_capability(self, state, capability):
+        """
+        Set the capability of migrate to state.
+
+        :param state: Bool value of capability.
+        :param capability: capability which need to set.
+
+        :return: The response to the command
+        """
+        cmd = "migrate-set-capabilities"
+        self.verify_supported_cmd(cmd)
+        args = {"capabilities": [{"state": state,
+                                  "capability": capability}]}
+        return self.cmd(cmd, args)
+
+    def get_migrate_capability(self, capability):
+        """
+        Get the state of a migrate capability.
+
+        :param capability: capability which need to get.
+
+        :return: The state of the capability, None if it is not supported
+        """
+        cmd = "query-migrate-capabilities"
+        self.verify_supported_cmd(cmd)
+        for cap in self.cmd(cmd):
+            if cap["capability"] == capability:
+                return cap["state"]
+
     def live_snapshot(self, device, snapshot_file, snapshot_format="qcow2"):
         """
         Take a live disk snapshot.
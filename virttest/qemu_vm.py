@@ -28,6 +28,7 @@ from . import utils_net
 from . import arch
 from . import storage
 from . import error_context
+from . import utils_libguestfs
 
 
 class QemuSegFaultError(virt_vm.VMError):
@@ -88,6 +89,8 @@ class VM(virt_vm.BaseVM):
     """
 
     MIGRATION_PROTOS = ['rdma', 'x-rdma', 'tcp', 'unix', 'exec', 'fd']
+    # Migration states after which QEMU doesn't change the status anymore
+    MIGRATION_END_STATES = ['completed', 'failed', 'cancelled', 'canceled']
 
     # By default we inherit all timeouts from the base VM class except...
     CLOSE_SESSION_TIMEOUT = 30
@@ -125,6 +128,7 @@ class VM(virt_vm.BaseVM):
             self.logs = {}
             self.remote_sessions = []
             self.logsessions = {}
+            self.migration_stats = {}
 
         self.name = name
         self.params = params
@@ -2392,6 +2396,9 @@ class VM(virt_vm.BaseVM):
             getattr(self, 'virtnet').__init__(self.params,
                                               self.name,
                                               self.instance)
+            if mac_source is None:
+                # Reserve the MAC addresses of all NICs in one go
+                self.virtnet.generate_mac_addresses()
 
             # Generate basic parameter values for all NICs and create TAP fd
             for nic in self.virtnet:
@@ -2520,6 +2527,13 @@ class VM(virt_vm.BaseVM):
                                            'executing make_create_command(). '
                                            'Check the log for traceback.')
 
+            # Pooled libguestfs appliances must not have the images open
+            if utils_libguestfs.has_pooled_sessions():
+                utils_libguestfs.drop_pooled_sessions(
+                    [dev.get_param("file") for dev in self.devices
+                     if (isinstance(dev, qdevices.QDrive) and
+                         dev.get_param("file"))])
+
             # Add migration parameters if required
             if migration_mode in ["tcp", "rdma", "x-rdma"]:
                 self.migration_port = utils_misc.find_free_port(5200, 6000)
@@ -3510,6 +3524,93 @@ class VM(virt_vm.BaseVM):
             raise virt_vm.VMMigrateTimeoutError("Timeout expired while waiting"
                                                 " for migration to finish")
 
+    def enable_migration_events(self):
+        """
+        Enable the 'events' migration capability, so QEMU reports the
+        migration status changes with MIGRATION and MIGRATION_PASS events.
+
+        :return: True if the events are enabled, False if the monitor can't
+                report them (HMP monitor or too old QEMU)
+        """
+        if not isinstance(self.monitor, qemu_monitor.QMPMonitor):
+            return False
+        try:
+            if self.monitor.get_migrate_capability("events") is None:
+                return False
+            self.monitor.migrate_set_capability(True, "events")
+        except qemu_monitor.MonitorNotSupportedCmdError:
+            return False
+        # Forget the events of the previous migrations
+        self.monitor.pop_events(["MIGRATION", "MIGRATION_PASS"])
+        return True
+
+    def wait_for_migration_events(self, timeout, check=None):
+        """
+        Wait for the migration to end on MIGRATION events instead of polling
+        its status.  Requires enable_migration_events() before the migration
+        is started.
+
+        The migration status is queried once per MIGRATION_PASS event and
+        once at the end, the statistics of each pass and of the whole
+        migration are stored in self.migration_stats.
+
+        :param timeout: Time to wait for migration to complete.
+        :param check: Function called every second while waiting, it may
+                raise an exception to stop waiting.
+        :return: The final migration status (e.g. 'completed')
+        """
+        def event_time(event):
+            stamp = event.get("timestamp", {})
+            if "seconds" not in stamp:
+                return time.time()
+            return stamp["seconds"] + stamp.get("microseconds", 0) / 1e6
+
+        end_time = time.time() + timeout
+        status = None
+        end_stamp = None
+        passes = []
+        while status not in self.MIGRATION_END_STATES:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                raise virt_vm.VMMigrateTimeoutError("Timeout expired while "
+                                                    "waiting for migration "
+                                                    "to finish")
+            if check:
+                check()
+            events = self.monitor.pop_events(["MIGRATION", "MIGRATION_PASS"],
+                                             min(remaining, 1))
+            for event in events:
+                if event["event"] == "MIGRATION":
+                    status = event["data"]["status"]
+                    end_stamp = event_time(event)
+                    logging.debug("Migration status of VM '%s': %s",
+                                  self.name, status)
+                else:
+                    o = self.monitor.info("migrate", debug=False)
+                    passes.append((event["data"]["pass"], event_time(event),
+                                   o.get("ram", {})))
+
+        o = self.monitor.info("migrate", debug=False)
+        stats = {"status": status, "passes": len(passes)}
+        for key in ("total-time", "downtime", "setup-time"):
+            stats[key] = o.get(key)
+        ram = o.get("ram", {})
+        for key in ("transferred", "mbps", "dirty-sync-count"):
+            stats[key] = ram.get(key)
+        for index, (num, start, ram) in enumerate(passes):
+            if index + 1 < len(passes):
+                end = passes[index + 1][1]
+            else:
+                end = end_stamp
+            prefix = "pass%d-" % num
+            stats[prefix + "time"] = "%.3f" % (end - start)
+            for key in ("remaining", "dirty-pages-rate", "mbps"):
+                stats[prefix + key] = ram.get(key)
+        self.migration_stats = dict((key.replace("-", "_"), value)
+                                    for key, value in stats.iteritems()
+                                    if value is not None)
+        return status
+
     @error_context.context_aware
     def migrate(self, timeout=virt_vm.BaseVM.MIGRATE_TIMEOUT, protocol="tcp",
                 cancel_delay=None, offline=False, stable_check=False,
@@ -3557,6 +3658,7 @@ class VM(virt_vm.BaseVM):
 
         error_context.base_context("migrating '%s'" % self.name)
 
+        self.migration_stats = {}
         local = dest_host == "localhost"
         mig_fd_name = None
 
@@ -3655,6 +3757,11 @@ class VM(virt_vm.BaseVM):
             if offline is True:
                 self.monitor.cmd("stop")
 
+            migration_events = (not not_wait_for_migration and
+                                not cancel_delay and
+                                self.params.get("migration_events") == "yes"
+                                and self.enable_migration_events())
+
             logging.info("Migrating to %s", uri)
             self.monitor.migrate(uri)
             if not_wait_for_migration:
@@ -3670,7 +3777,14 @@ class VM(virt_vm.BaseVM):
                         "Cannot cancel migration")
                 return
 
-            self.wait_for_migration(timeout)
+            if migration_events:
+                status = self.wait_for_migration_events(timeout)
+                if status == "completed" and not self.mig_finished():
+                    # Seamless spice migration still in progress
+                    self.wait_for_migration(timeout)
+            else:
+                self.wait_for_migration(timeout)
+                status = None
 
             if (local and (migration_exec_cmd_src and
                            "gzip" in migration_exec_cmd_src)):
@@ -3686,17 +3800,23 @@ class VM(virt_vm.BaseVM):
             self.verify_alive()
 
             # Report migration status
-            if self.mig_succeeded():
+            if status == "completed" or (status is None and
+                                         self.mig_succeeded()):
                 logging.info("Migration completed successfully")
-            elif self.mig_failed():
+            elif status == "failed" or (status is None and self.mig_failed()):
                 raise virt_vm.VMMigrateFailedError("Migration failed")
             else:
                 raise virt_vm.VMMigrateFailedError("Migration ended with "
                                                    "unknown status")
 
             # Switch self <-> clone
+            if migration_events:
+                migration_stats = self.migration_stats
+            else:
+                migration_stats = {}
             temp = self.clone(copy_state=True)
             self.__dict__ = clone.__dict__
+            self.migration_stats = migration_stats
             clone = temp
 
             # From now on, clone is the source VM that will soon be destroyed
@@ -276,7 +276,8 @@ class AexpectIOWrapperOut(messenger.StdIOWrapperOutBase64):
 
 
 def remote_commander(client, host, port, username, password, prompt,
-                     linesep="\n", log_filename=None, timeout=10, path=None):
+                     linesep="\n", log_filename=None, timeout=10, path=None,
+                     binary=False):
     """
     Log into a remote host (guest) using SSH/Telnet/Netcat.
 
@@ -293,6 +294,8 @@ def remote_commander(client, host, port, username, password, prompt,
             each step of the login procedure (i.e. the "Are you sure" prompt
             or the password prompt)
     :param path: The path to place where remote_runner.py is placed.
+    :param binary: Use binary framing instead of base64 encoded messages,
+            the channel to the guest has to be 8-bit clean.
     :raise LoginBadClientError: If an unknown client is requested
     :raise: Whatever handle_prompts() raises
     :return: A ShellSession object.
@@ -329,7 +332,7 @@ def remote_commander(client, host, port, username, password, prompt,
     outw = AexpectIOWrapperOut(session)
     # Create commander
 
-    cmd = remote_master.CommanderMaster(inw, outw, False)
+    cmd = remote_master.CommanderMaster(inw, outw, False, binary)
     return cmd
 
 
@@ -13,9 +13,19 @@ import cPickle
 import time
 import cStringIO
 import base64
+import struct
 
 import remote_interface
 
+# Binary mode frame header: flags and payload length in network byte order
+_BIN_HEADER = struct.Struct("!BI")
+# Flag of a frame followed by further frames of the same message
+_BIN_MORE = 1
+# Largest payload of one binary frame, bigger messages are chunked
+BIN_CHUNK_SIZE = 1024 * 1024
+# Bytes asked from the input per read
+READ_SIZE = 65536
+
 
 class IOWrapper(object):
 
@@ -204,6 +214,11 @@ class Messenger(object):
         """
         self.stdin = stdin
         self.stdout = stdout
+        # Binary framing negotiated, wrappers' encoding is bypassed then
+        self.binary = False
+        # Data read ahead from stdin, list of strings and total length
+        self._rbuf = []
+        self._rbuf_len = 0
 
         # Unfortunately only static length of data length is supported.
         self.enc_len_length = len(stdout.encode("0" * 10))
@@ -226,6 +241,8 @@ class Messenger(object):
         """
         Flush all input data from communication interface.
         """
+        self._rbuf = []
+        self._rbuf_len = 0
         const = 16384
         r, _, _ = select.select([self.stdin.fileno()], [], [], 1)
         while r:
@@ -233,38 +250,110 @@ class Messenger(object):
                 break
             r, _, _ = select.select([self.stdin.fileno()], [], [], 1)
 
+    def pending(self):
+        """
+        Return True when data read ahead is waiting in the input buffer.
+
+        select() on stdin doesn't see it, so check this before waiting.
+        """
+        return self._rbuf_len > 0
+
     def write_msg(self, data):
         """
         Write formated message to communication interface.
         """
-        self.stdout.write(self.format_msg(data))
-
-    def _read_until_len(self, timeout=None):
+        if not self.binary:
+            self.stdout.write(self.format_msg(data))
+            return
+        pdata = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+        pdata_len = len(pdata)
+        if pdata_len <= BIN_CHUNK_SIZE:
+            self.stdout.write(_BIN_HEADER.pack(0, pdata_len) + pdata)
+            return
+        for offset in xrange(0, pdata_len, BIN_CHUNK_SIZE):
+            chunk = pdata[offset:offset + BIN_CHUNK_SIZE]
+            if offset + BIN_CHUNK_SIZE < pdata_len:
+                flags = _BIN_MORE
+            else:
+                flags = 0
+            self.stdout.write(_BIN_HEADER.pack(flags, len(chunk)) + chunk)
+
+    def _read_buffered(self, length, timeout=None):
         """
-        Deal with terminal interfaces... Read input until gets string
-        contains " " and digits len(string) == 10
+        Read exactly length bytes, reading ahead in big blocks.
 
         :param timeout: timeout of reading.
+        :return: Data, None on timeout and "" when other side is closed.
+                 Data read before a timeout stays buffered for next call.
         """
-        data = ""
-
         endtime = None
         if timeout is not None:
             endtime = time.time() + timeout
 
-        while (len(data) < self.enc_len_length and
-               (endtime is None or time.time() < endtime)):
-            d = self.stdin.read(1, timeout)
+        while self._rbuf_len < length:
+            if endtime is not None:
+                timeout = endtime - time.time()
+                if timeout <= 0:
+                    return None
+            d = self.stdin.read(max(READ_SIZE,
+                                    min(length - self._rbuf_len,
+                                        BIN_CHUNK_SIZE)), timeout)
             if d is None:
                 return None
             if len(d) == 0:
                 return d
-            data += d
-        if len(data) < self.enc_len_length:
-            return None
+            self._rbuf.append(d)
+            self._rbuf_len += len(d)
+
+        if len(self._rbuf) == 1:
+            data = self._rbuf[0]
+        else:
+            data = "".join(self._rbuf)
+        if len(data) > length:
+            self._rbuf = [data[length:]]
+        else:
+            self._rbuf = []
+        self._rbuf_len -= length
+        return data[:length]
+
+    def _read_until_len(self, timeout=None):
+        """
+        Deal with terminal interfaces... Read input until gets string
+        contains " " and digits len(string) == 10
+
+        :param timeout: timeout of reading.
+        """
+        data = self._read_buffered(self.enc_len_length, timeout)
+        if not data:
+            return data
 
         return self.stdout.decode(data)
 
+    def _read_binary(self, timeout=None):
+        """
+        Read all frames of one binary message.
+
+        :param timeout: timeout of reading first frame header.
+        :return: Pickled message, None on timeout and "" when other side
+                 is closed.
+        """
+        header = self._read_buffered(_BIN_HEADER.size, timeout)
+        if not header:
+            return header
+        chunks = []
+        while True:
+            flags, length = _BIN_HEADER.unpack(header)
+            chunk = self._read_buffered(length)
+            if len(chunk) < length:
+                raise MessengerError("Connection closed inside message.")
+            chunks.append(chunk)
+            if not flags & _BIN_MORE:
+                break
+            header = self._read_buffered(_BIN_HEADER.size)
+            if len(header) < _BIN_HEADER.size:
+                raise MessengerError("Connection closed inside message.")
+        return "".join(chunks)
+
     def read_msg(self, timeout=None):
         """
         Read data from com interface.
@@ -275,20 +364,23 @@ class Messenger(object):
                  (False, None) when other side is closed.
                  (None, None) when reading is timeouted.
         """
-        data = self._read_until_len(timeout)
+        if self.binary:
+            data = self._read_binary(timeout)
+        else:
+            data = self._read_until_len(timeout)
         if data is None:
             return (None, None)
         if len(data) == 0:
             return (False, None)
         rdata = None
         try:
-            cmd_len = int(data)
-            rdata = ""
-            rdata_len = 0
-            while (rdata_len < cmd_len):
-                rdata += self.stdin.read(cmd_len - rdata_len)
-                rdata_len = len(rdata)
-            rdataIO = cStringIO.StringIO(self.stdin.decode(rdata))
+            if self.binary:
+                rdata = data
+            else:
+                cmd_len = int(data)
+                rdata = self._read_buffered(cmd_len)
+                rdata = self.stdin.decode(rdata)
+            rdataIO = cStringIO.StringIO(rdata)
             unp = cPickle.Unpickler(rdataIO)
             unp.find_global = _map_path
             data = unp.load()
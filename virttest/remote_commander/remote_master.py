@@ -46,6 +46,9 @@ class CmdMaster(object):
         self.commander = commander
         self._stdout = ""
         self._stderr = ""
+        # Output received since last reading, joined on reading
+        self._stdout_parts = []
+        self._stderr_parts = []
         self._results_cnt = 0
         self._stdout_cnt = 0
         self._stderr_cnt = 0
@@ -73,6 +76,9 @@ class CmdMaster(object):
         Property stdout getter
         """
         self._stdout_cnt = 0
+        if self._stdout_parts:
+            self._stdout += "".join(self._stdout_parts)
+            self._stdout_parts = []
         return self._stdout
 
     def setstdout(self, value):
@@ -81,6 +87,14 @@ class CmdMaster(object):
         last reading.
         """
         self._stdout = value
+        self._stdout_parts = []
+        self._stdout_cnt += 1
+
+    def add_stdout(self, msg):
+        """
+        Append msg to stdout without copying all output received before.
+        """
+        self._stdout_parts.append(msg)
         self._stdout_cnt += 1
 
     stdout = property(getstdout, setstdout)
@@ -90,6 +104,9 @@ class CmdMaster(object):
         Property stderr getter
         """
         self._stderr_cnt = 0
+        if self._stderr_parts:
+            self._stderr += "".join(self._stderr_parts)
+            self._stderr_parts = []
         return self._stderr
 
     def setstderr(self, value):
@@ -98,6 +115,14 @@ class CmdMaster(object):
         last reading.
         """
         self._stderr = value
+        self._stderr_parts = []
+        self._stderr_cnt += 1
+
+    def add_stderr(self, msg):
+        """
+        Append msg to stderr without copying all output received before.
+        """
+        self._stderr_parts.append(msg)
         self._stderr_cnt += 1
 
     stderr = property(getstderr, setstderr)
@@ -194,19 +219,27 @@ class CommanderMaster(messenger.Messenger):
     slave part.
     """
 
-    def __init__(self, stdin, stdout, debug=False):
+    def __init__(self, stdin, stdout, debug=False, binary=False):
         """
         :type stdin: IOWrapper with implemented write function.
         :type stout: IOWrapper with implemented read function.
+        :param binary: Ask slave for binary framing, only for 8-bit clean
+                       channels.  Messages keep the wrappers' encoding
+                       when the slave doesn't agree.
         """
         super(CommanderMaster, self).__init__(stdin, stdout)
         self.cmds = {}
         self.debug = debug
 
         self.flush_stdin()
-        self.write_msg("start")
+        if binary:
+            self.write_msg("start_binary")
+        else:
+            self.write_msg("start")
         succ, msg = self.read_msg()
-        if not succ or msg != "Started":
+        if succ and binary and msg == "Started_binary":
+            self.binary = True
+        elif not succ or msg != "Started":
             raise remote_interface.CommanderError("Remote commander"
                                                   " not started.")
 
@@ -242,9 +275,9 @@ class CommanderMaster(messenger.Messenger):
                 print cmd.msg
             if cmd.isCmdMsg():
                 if isinstance(cmd, remote_interface.StdOut):
-                    self.cmds[cmd.cmd_id].stdout += cmd.msg
+                    self.cmds[cmd.cmd_id].add_stdout(cmd.msg)
                 elif isinstance(cmd, remote_interface.StdErr):
-                    self.cmds[cmd.cmd_id].stderr += cmd.msg
+                    self.cmds[cmd.cmd_id].add_stderr(cmd.msg)
             else:
                 if isinstance(cmd, remote_interface.StdOut):
                     sys.stdout.write(cmd.msg)
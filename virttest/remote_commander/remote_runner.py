@@ -537,10 +537,16 @@ class CommanderSlave(ms.Messenger):
                 stderrs = [cmd.stderr_pipe for cmd in self.cmds.values()
                            if cmd.stderr_pipe is not None]
 
+                # Don't block while commands are already read ahead
+                select_timeout = None
+                if self.pending():
+                    select_timeout = 0
                 r, _, _ = select.select(
-                    stdios + r_pipes + stdouts + stderrs, [], [])
+                    stdios + r_pipes + stdouts + stderrs, [], [],
+                    select_timeout)
 
-                if self.stdin in r:  # command from controller
+                # command from controller
+                if self.stdin in r or self.pending():
                     cmd = CmdSlave(self.read_msg()[1])
                     self.cmds[cmd.cmd_id] = cmd
                     try:
@@ -603,9 +609,14 @@ class CommanderSlaveCmds(CommanderSlave):
 
         while (1):
             succ, data = self.read_msg()
-            if succ and data == "start":
+            if succ and data in ("start", "start_binary"):
                 break
-        self.write_msg("Started")
+        if data == "start_binary":
+            # Last message with text encoding, binary framing follows
+            self.write_msg("Started_binary")
+            self.binary = True
+        else:
+            self.write_msg("Started")
 
     def shell(self, cmd):
         """
@@ -9,9 +9,13 @@ import logging
 import os
 import shutil
 import re
+import fcntl
+import struct
 
 from avocado.utils import process
+from avocado.utils import path as utils_path
 
+from . import arch
 from . import iscsi
 from . import utils_misc
 from . import virt_vm
@@ -221,6 +225,48 @@ def get_image_filename_filesytem(params, root_dir):
     return image_filename
 
 
+def reflink_file(src, dst):
+    """
+    Make dst a copy-on-write clone of src, sharing its data blocks.
+
+    Cloning is a metadata only operation, so it's instant regardless of the
+    file size, but it only works within one filesystem supporting it (btrfs,
+    xfs with reflink=1, ...).
+
+    :param src: Source file.
+    :param dst: Destination file, overwritten if it exists.
+    :raise IOError: Raised if the file can't be cloned.
+    """
+    with open(src, "rb") as src_file:
+        with open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), arch.FICLONE,
+                            src_file.fileno())
+            except IOError:
+                os.unlink(dst)
+                raise
+    shutil.copymode(src, dst)
+
+
+def get_qcow2_backing_file(filename):
+    """
+    Read the backing file name from a qcow2 image header.
+
+    :param filename: Image file name.
+    :return: The backing file name, or None if the file is not a qcow2 image
+             or has no backing file.
+    """
+    with open(filename, "rb") as image:
+        header = image.read(20)
+        if len(header) < 20 or header[:4] != "QFI\xfb":
+            return None
+        offset, size = struct.unpack(">QI", header[8:20])
+        if not offset:
+            return None
+        image.seek(offset)
+        return image.read(size)
+
+
 class OptionMissing(Exception):
 
     """
@@ -315,7 +361,15 @@ class QemuImg(object):
         :note: params should contain:
                image_name -- the name of the image file, without extension
                image_format -- the format of the image (qcow2, raw etc)
+               image_restore_strategy -- how image files are copied:
+                 copy -- plain copy
+                 reflink -- copy-on-write clone where the filesystem
+                            supports it, plain copy otherwise (default)
+                 overlay -- restore qcow2 images as an empty overlay on
+                            top of the backup, falls back to reflink
         """
+        strategy = params.get("image_restore_strategy", "reflink")
+
         def backup_raw_device(src, dst):
             if os.path.exists(src):
                 _dst = dst + '.part'
@@ -324,14 +378,57 @@ class QemuImg(object):
             else:
                 logging.info("No source %s, skipping dd...", src)
 
+        def create_overlay(src, dst):
+            if params.get("image_format", "qcow2") != "qcow2":
+                logging.debug("Image %s is not qcow2, can't restore it as an "
+                              "overlay", dst)
+                return False
+            try:
+                qemu_img = utils_misc.get_qemu_img_binary(params)
+            except utils_path.CmdNotFoundError, details:
+                logging.debug("Can't restore %s as an overlay: %s", dst,
+                              details)
+                return False
+            cmd = "%s create -f qcow2 -b %s -F qcow2 %s" % (
+                qemu_img, os.path.abspath(src), dst)
+            if process.run(cmd, ignore_status=True).exit_status:
+                logging.debug("Could not create overlay on %s", src)
+                return False
+            return True
+
         def backup_image_file(src, dst):
-            logging.debug("Copying %s -> %s", src, dst)
-            if os.path.isfile(src):
-                _dst = dst + '.part'
-                shutil.copy(src, _dst)
-                os.rename(_dst, dst)
-            else:
+            if not os.path.isfile(src):
                 logging.info("No source file %s, skipping copy...", src)
+                return
+            _dst = dst + '.part'
+            if action == 'restore' and strategy == 'overlay':
+                logging.debug("Creating overlay %s -> %s", src, dst)
+                if create_overlay(src, _dst):
+                    os.rename(_dst, dst)
+                    return
+            backing_file = get_qcow2_backing_file(src)
+            if (action == 'backup' and backing_file and
+                    os.path.abspath(backing_file) == good_backup):
+                # src is an overlay created by a previous restore, don't
+                # let the copy depend on the backup being replaced
+                logging.debug("Flattening overlay %s -> %s", src, dst)
+                qemu_img = utils_misc.get_qemu_img_binary(params)
+                process.run("%s convert -O qcow2 %s %s" %
+                            (qemu_img, src, _dst))
+                os.rename(_dst, dst)
+                return
+            if strategy in ('reflink', 'overlay'):
+                logging.debug("Cloning %s -> %s", src, dst)
+                try:
+                    reflink_file(src, _dst)
+                    os.rename(_dst, dst)
+                    return
+                except IOError, details:
+                    logging.debug("Could not clone %s (%s), copying it "
+                                  "instead", src, details)
+            logging.debug("Copying %s -> %s", src, dst)
+            shutil.copy(src, _dst)
+            os.rename(_dst, dst)
 
         def get_backup_set(filename, backup_dir, action, good):
             """
@@ -373,6 +470,8 @@ class QemuImg(object):
         backup_dir = params.get("backup_dir", "")
         if not os.path.isabs(backup_dir):
             backup_dir = os.path.join(root_dir, backup_dir)
+        good_backup = os.path.abspath(os.path.join(
+            backup_dir, "%s.backup" % os.path.basename(image_filename)))
         if params.get('image_raw_device') == 'yes':
             iname = "raw_device"
             iformat = params.get("image_format", "qcow2")
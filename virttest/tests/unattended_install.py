@@ -13,6 +13,7 @@ from avocado.utils import iso9660
 from avocado.utils import process
 from avocado.utils import crypto
 from avocado.utils import download
+from avocado.utils import path as utils_path
 
 from .. import virt_vm
 from .. import asset
@@ -51,7 +52,8 @@ def start_auto_content_server_thread(port, path):
         _url_auto_content_server_thread_event = threading.Event()
         _url_auto_content_server_thread = threading.Thread(
             target=http_server.http_server,
-            args=(port, path, terminate_auto_content_server_thread))
+            args=(port, path, terminate_auto_content_server_thread),
+            kwargs={"threaded": True})
         _url_auto_content_server_thread.start()
 
 
@@ -63,7 +65,8 @@ def start_unattended_server_thread(port, path):
         _unattended_server_thread_event = threading.Event()
         _unattended_server_thread = threading.Thread(
             target=http_server.http_server,
-            args=(port, path, terminate_unattended_server_thread))
+            args=(port, path, terminate_unattended_server_thread),
+            kwargs={"threaded": True})
         _unattended_server_thread.start()
 
 
@@ -173,6 +176,12 @@ class UnattendedInstallConfig(object):
         self.tmpdir = test.tmpdir
         self.qemu_img_binary = utils_misc.get_qemu_img_binary(params)
 
+        self.media_cache = None
+        if params.get('unattended_media_cache', 'no') == 'yes':
+            self.media_cache = utils_disk.ImageCache(
+                max_entries=int(params.get('unattended_media_cache_entries',
+                                           10)))
+
         def get_unattended_file(backend):
             providers = asset.get_test_provider_names(backend)
             if not providers:
@@ -572,24 +581,41 @@ class UnattendedInstallConfig(object):
         """
         logging.debug("Remastering initrd.gz file with preseed file")
         dest_fname = 'preseed.cfg'
-        remaster_path = os.path.join(self.image_path, "initrd_remaster")
-        if not os.path.isdir(remaster_path):
-            os.makedirs(remaster_path)
-
-        base_initrd = os.path.basename(self.initrd)
-        os.chdir(remaster_path)
-        process.run("gzip -d < ../%s | fakeroot cpio --extract --make-directories "
-                    "--no-absolute-filenames" % base_initrd, verbose=DEBUG,
-                    shell=True)
-        process.run("cp %s %s" % (self.unattended_file, dest_fname),
-                    verbose=DEBUG)
-
-        # For libvirt initrd.gz will be renamed to initrd.img in setup_cdrom()
-        process.run("find . | fakeroot cpio -H newc --create | gzip -9 > ../%s" %
-                    base_initrd, verbose=DEBUG, shell=True)
-
-        os.chdir(self.image_path)
-        process.run("rm -rf initrd_remaster", verbose=DEBUG)
+
+        def remaster():
+            remaster_path = os.path.join(self.image_path, "initrd_remaster")
+            if not os.path.isdir(remaster_path):
+                os.makedirs(remaster_path)
+
+            base_initrd = os.path.basename(self.initrd)
+            os.chdir(remaster_path)
+            process.run("gzip -d < ../%s | fakeroot cpio --extract "
+                        "--make-directories --no-absolute-filenames" %
+                        base_initrd, verbose=DEBUG, shell=True)
+            process.run("cp %s %s" % (self.unattended_file, dest_fname),
+                        verbose=DEBUG)
+
+            # Multi-threaded pigz when available, -9 costs a lot of time
+            # for little size gain on initrds.
+            try:
+                gzip = "%s -6" % utils_path.find_command("pigz")
+            except utils_path.CmdNotFoundError:
+                gzip = "gzip -6"
+            # For libvirt initrd.gz will be renamed to initrd.img in
+            # setup_cdrom()
+            process.run("find . | fakeroot cpio -H newc --create | %s > ../%s"
+                        % (gzip, base_initrd), verbose=DEBUG, shell=True)
+
+            os.chdir(self.image_path)
+            process.run("rm -rf initrd_remaster", verbose=DEBUG)
+
+        if self.media_cache is None:
+            remaster()
+        else:
+            self.media_cache.build(
+                self.initrd, remaster, "preseed_initrd",
+                self.media_cache.file_digest(self.initrd),
+                self.media_cache.file_digest(self.unattended_file))
         contents = open(self.unattended_file).read()
 
         logging.debug("Unattended install contents:")
@@ -638,7 +664,8 @@ class UnattendedInstallConfig(object):
             setup_file = 'winnt.bat'
             boot_disk = utils_disk.FloppyDisk(self.floppy,
                                               self.qemu_img_binary,
-                                              self.tmpdir, self.vfd_size)
+                                              self.tmpdir, self.vfd_size,
+                                              cache=self.media_cache)
             answer_path = boot_disk.get_answer_file_path(dest_fname)
             self.answer_windows_ini(answer_path)
             setup_file_path = os.path.join(self.unattended_dir, setup_file)
@@ -674,7 +701,9 @@ class UnattendedInstallConfig(object):
                     self.cdrom_unattended,
                     self.tmpdir,
                     self.cdrom_cd1_mount,
-                    kernel_params)
+                    kernel_params,
+                    cache=self.media_cache,
+                    source_iso=self.cdrom_cd1)
             elif self.params.get('unattended_delivery_method') == 'url':
                 if self.unattended_server_port is None:
                     self.unattended_server_port = utils_misc.find_free_port(
@@ -705,11 +734,13 @@ class UnattendedInstallConfig(object):
                 self.kernel_params = kernel_params
             elif self.params.get('unattended_delivery_method') == 'cdrom':
                 boot_disk = utils_disk.CdromDisk(self.cdrom_unattended,
-                                                 self.tmpdir)
+                                                 self.tmpdir,
+                                                 cache=self.media_cache)
             elif self.params.get('unattended_delivery_method') == 'floppy':
                 boot_disk = utils_disk.FloppyDisk(self.floppy,
                                                   self.qemu_img_binary,
-                                                  self.tmpdir, self.vfd_size)
+                                                  self.tmpdir, self.vfd_size,
+                                                  cache=self.media_cache)
                 ks_param = 'ks=floppy'
                 kernel_params = self.kernel_params
                 if 'ks=' in kernel_params:
@@ -741,7 +772,8 @@ class UnattendedInstallConfig(object):
                 if (self.cdrom_unattended and
                         self.params.get('unattended_delivery_method') == 'cdrom'):
                     boot_disk = utils_disk.CdromDisk(self.cdrom_unattended,
-                                                     self.tmpdir)
+                                                     self.tmpdir,
+                                                     cache=self.media_cache)
                 elif self.floppy:
                     autoyast_param = 'autoyast=device://fd0/autoinst.xml'
                     kernel_params = self.kernel_params
@@ -757,7 +789,8 @@ class UnattendedInstallConfig(object):
                     boot_disk = utils_disk.FloppyDisk(self.floppy,
                                                       self.qemu_img_binary,
                                                       self.tmpdir,
-                                                      self.vfd_size)
+                                                      self.vfd_size,
+                                                      cache=self.media_cache)
                 else:
                     raise ValueError("Neither cdrom_unattended nor floppy set "
                                      "on the config file, please verify")
@@ -769,7 +802,8 @@ class UnattendedInstallConfig(object):
                 dest_fname = "autounattend.xml"
                 if self.params.get('unattended_delivery_method') == 'cdrom':
                     boot_disk = utils_disk.CdromDisk(self.cdrom_unattended,
-                                                     self.tmpdir)
+                                                     self.tmpdir,
+                                                     cache=self.media_cache)
                     if self.install_virtio == "yes":
                         boot_disk.setup_virtio_win2008(self.virtio_floppy,
                                                        self.cdrom_virtio)
@@ -779,7 +813,8 @@ class UnattendedInstallConfig(object):
                     boot_disk = utils_disk.FloppyDisk(self.floppy,
                                                       self.qemu_img_binary,
                                                       self.tmpdir,
-                                                      self.vfd_size)
+                                                      self.vfd_size,
+                                                      cache=self.media_cache)
                     if self.install_virtio == "yes":
                         boot_disk.setup_virtio_win2008(self.virtio_floppy)
                 answer_path = boot_disk.get_answer_file_path(dest_fname)
@@ -1080,14 +1115,11 @@ def string_in_serial_log(serial_log_file_path, string):
     :return: Whether the string is found in serial log file.
     :raise: IOError: Serial console log file could not be read.
     """
-    with open(serial_log_file_path, 'r') as serial_log_file:
-        serial_log_msg = serial_log_file.read()
-
-    if string in serial_log_msg:
-        logging.debug("Message read from serial console log: %s", string)
-        return True
-    else:
-        return False
+    serial_log = utils_misc.LogFollower(serial_log_file_path, [string])
+    try:
+        return string in serial_log.poll()
+    finally:
+        serial_log.close()
 
 
 @error_context.context_aware
@@ -1187,6 +1219,7 @@ def run(test, params, env):
 
     logging.debug("Monitoring serial console log for completion message: %s",
                   log_file)
+    serial_log = utils_misc.LogFollower(log_file, [post_finish_str])
     serial_read_fails = 0
 
     # As the install process start, we may need collect information from
@@ -1208,8 +1241,7 @@ def run(test, params, env):
         except (virt_vm.VMDeadError, qemu_monitor.MonitorError), e:
             if wait_ack:
                 try:
-                    post_finish_str_found = string_in_serial_log(
-                        log_file, post_finish_str)
+                    post_finish_str_found = bool(serial_log.poll())
                 except IOError:
                     logging.warn("Could not read final serial log file")
                 else:
@@ -1230,8 +1262,7 @@ def run(test, params, env):
 
         if wait_ack:
             try:
-                post_finish_str_found = string_in_serial_log(
-                    log_file, post_finish_str)
+                post_finish_str_found = bool(serial_log.poll())
             except IOError:
                 # Only make noise after several failed reads
                 serial_read_fails += 1
@@ -1254,13 +1285,22 @@ def run(test, params, env):
 
         if migrate_background:
             vm.migrate(timeout=mig_timeout, protocol=mig_protocol)
+            utils_test.qemu.write_migration_keyvals(test, vm)
+        elif wait_ack:
+            # Wakes up as soon as the finish message is logged
+            try:
+                serial_log.wait_for(1)
+            except IOError:
+                time.sleep(1)
         else:
             time.sleep(1)
     else:
+        serial_log.close()
         logging.warn("Timeout elapsed while waiting for install to finish ")
         copy_images()
         raise exceptions.TestFail("Timeout elapsed while waiting for install to "
                                   "finish")
+    serial_log.close()
 
     logging.debug('cleaning up threads and mounts that may be active')
     global _url_auto_content_server_thread
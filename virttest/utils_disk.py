@@ -10,10 +10,12 @@ import tempfile
 import logging
 import ConfigParser
 import re
+import hashlib
 
 from avocado.core import exceptions
 from avocado.utils import process
 
+from . import data_dir
 from . import error_context
 
 
@@ -136,12 +138,167 @@ def clean_old_image(image):
         os.remove(image)
 
 
+class ImageCache(object):
+
+    """
+    On-disk cache of built install media.
+
+    Entries are keyed by digests of everything an image is built from
+    (answer file, drivers, source initrd or ISO, build options), so media
+    built from identical inputs are copied from the cache instead of being
+    built again. The least recently used entries beyond max_entries are
+    removed.
+    """
+
+    FORMAT_VERSION = 1
+    _READ_SIZE = 1024 * 1024
+
+    def __init__(self, cache_dir=None, max_entries=10):
+        """
+        :param cache_dir: Where to keep the images (default: data dir cache)
+        :param max_entries: Number of images to keep
+        """
+        if cache_dir is None:
+            cache_dir = data_dir.get_cache_dir('install_media')
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.__digests = {}
+
+    @classmethod
+    def _hash_file(cls, path, digest):
+        with open(path, "rb") as src:
+            while True:
+                data = src.read(cls._READ_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+
+    def file_digest(self, path):
+        """
+        :return: SHA1 hex digest of the content of path
+
+        Digests are remembered by path, size and mtime, so unchanged big
+        files (ISOs) are not read again by this object.
+        """
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime)
+        if key not in self.__digests:
+            digest = hashlib.sha1()
+            self._hash_file(path, digest)
+            self.__digests[key] = digest.hexdigest()
+        return self.__digests[key]
+
+    def tree_digest(self, path):
+        """
+        :return: SHA1 hex digest of names and contents of the tree at path
+
+        Symlinks are not followed, their targets are hashed instead.
+        """
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                full_path = os.path.join(root, name)
+                digest.update("\0%s\0" % os.path.relpath(full_path, path))
+                if os.path.islink(full_path):
+                    digest.update("L%s" % os.readlink(full_path))
+                elif os.path.isfile(full_path):
+                    digest.update("F")
+                    self._hash_file(full_path, digest)
+                else:
+                    digest.update("D")
+        return digest.hexdigest()
+
+    def get_key(self, *parts):
+        """
+        :return: Cache key for an image built from parts
+        """
+        return hashlib.sha1(repr((self.FORMAT_VERSION,) + parts)).hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.cache_dir, "%s.img" % key)
+
+    def get(self, key, path):
+        """
+        Copy the image stored under key to path.
+
+        :return: True when the image was found, False otherwise
+        """
+        cached = self.__get_path(key)
+        try:
+            shutil.copyfile(cached, path)
+        except IOError:
+            return False
+        try:
+            os.utime(cached, None)
+        except OSError:
+            pass
+        return True
+
+    def put(self, key, path):
+        """
+        Store a copy of the image at path under key.
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(path, tmp_path)
+                os.rename(tmp_path, self.__get_path(key))
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError), details:
+            logging.warn("Failed to cache image %s: %s", path, details)
+            return
+        self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently used images beyond max_entries.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".img"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def build(self, path, build, *parts):
+        """
+        Create the image at path, using the cache when possible.
+
+        :param path: Image to create
+        :param build: Callable creating the image at path on cache misses
+        :param parts: What the image is built from (see get_key)
+        """
+        key = self.get_key(*parts)
+        if self.get(key, path):
+            logging.debug("Using cached image %s for %s", key, path)
+            return
+        build()
+        self.put(key, path)
+
+
 class Disk(object):
 
     """
     Abstract class for Disk objects, with the common methods implemented.
     """
 
+    # ImageCache used by close(), if any
+    cache = None
+
     def __init__(self):
         self.path = None
 
@@ -161,51 +318,80 @@ class Disk(object):
         cleanup(self.mount)
         logging.debug("Disk %s successfully set", self.path)
 
+    def _get_cache_key_parts(self):
+        """
+        :return: Tuple of everything the image content depends on
+        """
+        return (self.cache.tree_digest(self.mount),)
+
+    def _build_image(self, build):
+        """
+        Call build() to create the image, or take it from self.cache.
+        """
+        if self.cache is None:
+            build()
+        else:
+            self.cache.build(self.path, build, self.__class__.__name__,
+                             *self._get_cache_key_parts())
+
 
 class FloppyDisk(Disk):
 
     """
     Represents a floppy disk. We can copy files to it, and setup it in
     convenient ways.
+
+    Files are gathered in the mountpoint and the image is created from them
+    on close(), which lets identical floppies be taken from an ImageCache.
     """
-    @error_context.context_aware
-    def __init__(self, path, qemu_img_binary, tmpdir, vfd_size):
-        error_context.context(
-            "Creating unattended install floppy image %s" % path)
+
+    def __init__(self, path, qemu_img_binary, tmpdir, vfd_size, cache=None):
         self.mount = tempfile.mkdtemp(prefix='floppy_virttest_', dir=tmpdir)
         self.path = path
+        self.qemu_img_binary = qemu_img_binary
         self.vfd_size = vfd_size
+        self.cache = cache
         clean_old_image(path)
+
+    @error_context.context_aware
+    def _create_image(self):
+        """
+        Create the floppy image and copy the mountpoint content to it.
+        """
+        error_context.context(
+            "Creating unattended install floppy image %s" % self.path)
         try:
-            c_cmd = '%s create -f raw %s %s' % (qemu_img_binary, path,
-                                                self.vfd_size)
+            c_cmd = '%s create -f raw %s %s' % (self.qemu_img_binary,
+                                                self.path, self.vfd_size)
             process.run(c_cmd, verbose=DEBUG)
-            f_cmd = 'mkfs.msdos -s 1 %s' % path
+            f_cmd = 'mkfs.msdos -s 1 %s' % self.path
             process.run(f_cmd, verbose=DEBUG)
         except process.CmdError, e:
             logging.error("Error during floppy initialization: %s" % e)
-            cleanup(self.mount)
             raise
-
-    def close(self):
-        """
-        Copy everything that is in the mountpoint to the floppy.
-        """
         pwd = os.getcwd()
         try:
             os.chdir(self.mount)
             path_list = glob.glob('*')
             for path in path_list:
-                self.copy_to(path)
+                logging.debug("Copying %s to floppy image", path)
+                mcopy_cmd = "mcopy -s -o -n -i %s %s ::/" % (self.path, path)
+                process.run(mcopy_cmd, verbose=DEBUG)
         finally:
             os.chdir(pwd)
 
-        cleanup(self.mount)
+    def close(self):
+        """
+        Create the floppy with everything that is in the mountpoint.
+        """
+        try:
+            self._build_image(self._create_image)
+        finally:
+            cleanup(self.mount)
 
-    def copy_to(self, src):
-        logging.debug("Copying %s to floppy image", src)
-        mcopy_cmd = "mcopy -s -o -n -i %s %s ::/" % (self.path, src)
-        process.run(mcopy_cmd, verbose=DEBUG)
+    def _get_cache_key_parts(self):
+        parts = super(FloppyDisk, self)._get_cache_key_parts()
+        return parts + (self.vfd_size,)
 
     def _copy_virtio_drivers(self, virtio_floppy):
         """
@@ -284,10 +470,11 @@ class CdromDisk(Disk):
     Represents a CDROM disk that we can master according to our needs.
     """
 
-    def __init__(self, path, tmpdir):
+    def __init__(self, path, tmpdir, cache=None):
         self.mount = tempfile.mkdtemp(prefix='cdrom_virttest_', dir=tmpdir)
         self.tmpdir = tmpdir
         self.path = path
+        self.cache = cache
         clean_old_image(path)
         if not os.path.isdir(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
@@ -337,7 +524,7 @@ class CdromDisk(Disk):
         g_cmd = ('mkisofs -o %s -max-iso9660-filenames '
                  '-relaxed-filenames -D --input-charset iso8859-1 '
                  '%s' % (self.path, self.mount))
-        process.run(g_cmd, verbose=DEBUG)
+        self._build_image(lambda: process.run(g_cmd, verbose=DEBUG))
 
         os.chmod(self.path, 0755)
         cleanup(self.mount)
@@ -349,13 +536,21 @@ class CdromInstallDisk(Disk):
 
     """
     Represents a install CDROM disk that we can master according to our needs.
+
+    The image is only taken from the cache when source_iso, the image
+    mounted at source_cdrom, is known.
     """
 
-    def __init__(self, path, tmpdir, source_cdrom, extra_params):
+    def __init__(self, path, tmpdir, source_cdrom, extra_params, cache=None,
+                 source_iso=None):
         self.mount = tempfile.mkdtemp(prefix='cdrom_unattended_', dir=tmpdir)
         self.path = path
         self.extra_params = extra_params
         self.source_cdrom = source_cdrom
+        if source_iso is None:
+            cache = None
+        self.cache = cache
+        self.source_iso = source_iso
         cleanup(path)
         if not os.path.isdir(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
@@ -371,6 +566,14 @@ class CdromInstallDisk(Disk):
     def get_answer_file_path(self, filename):
         return os.path.join(self.mount, 'isolinux', filename)
 
+    def _get_cache_key_parts(self):
+        # Everything but isolinux links to the source cdrom mountpoint,
+        # which changes between runs, so hash the source image instead.
+        isolinux = os.path.join(self.mount, 'isolinux')
+        return (self.cache.file_digest(self.source_iso),
+                sorted(os.listdir(self.mount)),
+                os.path.isdir(isolinux) and self.cache.tree_digest(isolinux))
+
     @error_context.context_aware
     def close(self):
         error_context.context(
@@ -389,7 +592,7 @@ class CdromInstallDisk(Disk):
         m_cmd = ('mkisofs -o %s %s -c isolinux/boot.cat -no-emul-boot '
                  '-boot-load-size 4 -boot-info-table -f -R -J -V -T %s'
                  % (self.path, boot, self.mount))
-        process.run(m_cmd)
+        self._build_image(lambda: process.run(m_cmd))
         os.chmod(self.path, 0755)
         cleanup(self.mount)
         cleanup(self.source_cdrom)
@@ -1,18 +1,22 @@
 import cPickle
 import UserDict
+import cStringIO
+import hashlib
 import os
 import logging
 import re
+import sqlite3
+import tempfile
 import threading
 
 import aexpect
 from avocado.core import exceptions
-from avocado.utils import path as utils_path
 from avocado.utils import process
 
 import utils_misc
 import virt_vm
 import remote
+import dhcp_sniffer
 
 ENV_VERSION = 1
 
@@ -25,6 +29,298 @@ class EnvSaveError(Exception):
     pass
 
 
+# Values never shared between keys by reference
+_IMMUTABLE_TYPES = (type(None), bool, int, long, float, complex, str,
+                    unicode, tuple, frozenset)
+
+
+class _PickledValue(object):
+
+    """
+    A value of an env file not unpickled yet.
+    """
+
+    __slots__ = ('blob',)
+
+    def __init__(self, blob):
+        self.blob = blob
+
+
+class EnvData(dict):
+
+    """
+    Env contents, unpickling values loaded by EnvStore on first access.
+
+    A value which fails to unpickle is dropped with a warning, as if it
+    wasn't there.
+    """
+
+    def __init__(self, store, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._store = store
+        # Background threads (screendumps, DHCP sniffers) read the env too
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _load(self, key, value):
+        if not isinstance(value, _PickledValue):
+            return value
+        with self._lock:
+            # Another thread may have loaded or dropped the key meanwhile
+            value = dict.__getitem__(self, key)
+            if not isinstance(value, _PickledValue):
+                return value
+            loading = self._local.__dict__.setdefault("keys", set())
+            if key in loading:
+                raise cPickle.UnpicklingError("Circular reference to env "
+                                              "key %r" % key)
+            loading.add(key)
+            try:
+                value = self._store.loads(value.blob, self)
+            # Almost any exception can be raised during unpickling
+            except Exception, details:
+                logging.warn("Dropping env key %r, can't load it: %s",
+                             key, details)
+                dict.__delitem__(self, key)
+                raise KeyError(key)
+            finally:
+                loading.discard(key)
+            dict.__setitem__(self, key, value)
+            return value
+
+    def is_loaded(self, key):
+        """
+        Return True if the value of key was unpickled already.
+        """
+        return not isinstance(dict.__getitem__(self, key), _PickledValue)
+
+    def __getitem__(self, key):
+        return self._load(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = iter(self).next()
+        return key, self.pop(key)
+
+    def itervalues(self):
+        for key in self.keys():
+            try:
+                yield self[key]
+            except KeyError:
+                pass
+
+    def iteritems(self):
+        for key in self.keys():
+            try:
+                yield key, self[key]
+            except KeyError:
+                pass
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return dict(self.iteritems())
+
+
+class EnvStore(object):
+
+    """
+    Env file storing each key as a separate pickle in an sqlite database.
+
+    Values are unpickled on first access, and saving writes only the keys
+    whose pickle changed, in one transaction, so an interrupted save leaves
+    the previous contents intact. Values referenced by other values are
+    pickled by reference to their key, so they are the same object again
+    after loading.
+
+    Env files written by older versions (a single pickle of the whole
+    dict) are loaded and converted on the first save.
+    """
+
+    HEADER = "SQLite format 3\0"
+
+    def __init__(self, filename):
+        """
+        :param filename: Path to the env file.
+        """
+        self.filename = filename
+        # Blob, digest and referenced keys of each key in the file
+        self._rows = {}
+        # Whether self._rows describes the contents of the file
+        self._synced = False
+
+    @staticmethod
+    def _connect(filename):
+        conn = sqlite3.connect(filename)
+        conn.text_factory = str
+        conn.execute("CREATE TABLE IF NOT EXISTS env "
+                     "(key BLOB PRIMARY KEY, value BLOB, refs BLOB)")
+        return conn
+
+    def load(self):
+        """
+        Load the env file, without unpickling the values.
+
+        :return: EnvData instance
+        """
+        with open(self.filename) as env_file:
+            header = env_file.read(len(self.HEADER))
+            if header != self.HEADER:
+                env_file.seek(0)
+                self._rows = {}
+                self._synced = False
+                return EnvData(self, cPickle.load(env_file))
+        conn = self._connect(self.filename)
+        try:
+            rows = conn.execute("SELECT key, value, refs FROM env").fetchall()
+        finally:
+            conn.close()
+        data = EnvData(self)
+        self._rows = {}
+        for key, blob, refs in rows:
+            key = cPickle.loads(str(key))
+            blob = str(blob)
+            self._rows[key] = (blob, hashlib.sha1(blob).digest(),
+                               cPickle.loads(str(refs)))
+            dict.__setitem__(data, key, _PickledValue(blob))
+        self._synced = True
+        return data
+
+    def loads(self, blob, data):
+        """
+        Unpickle a value, resolving references to other keys through data.
+
+        Keys removed from data since the last save are resolved to their
+        saved value.
+        """
+        def persistent_load(key):
+            try:
+                return data[key]
+            except KeyError:
+                return self.loads(self._rows[key][0], data)
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(blob))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    @staticmethod
+    def _dumps(value, shared):
+        refs = set()
+
+        def persistent_id(obj):
+            if obj is value:
+                return None
+            key = shared.get(id(obj))
+            if key is not None:
+                refs.add(key[0])
+                return key[0]
+            return None
+        output = cStringIO.StringIO()
+        # Protocol 2 would restore list subclasses like VirtNet by appending
+        # the items before __setstate__(), 1 takes any object as key reference
+        pickler = cPickle.Pickler(output, 1)
+        pickler.persistent_id = persistent_id
+        pickler.dump(value)
+        return output.getvalue(), sorted(refs)
+
+    def save(self, data, filename=None):
+        """
+        Write the changes in data since the last load or save.
+
+        :param data: Env contents, a dict or EnvData instance.
+        :param filename: Write a complete copy to this file instead.
+        """
+        filename = filename or self.filename
+        removed = [key for key in self._rows if key not in data]
+        if removed:
+            # Values still referencing removed keys need to be repickled,
+            # which inlines the removed values
+            removed_set = set(removed)
+            for key, (_, _, refs) in self._rows.items():
+                if key in data and removed_set.intersection(refs):
+                    data.get(key)
+
+        # Keyed by id, the key in a tuple as keys may be None
+        shared = {}
+        for key, value in dict.iteritems(data):
+            if not isinstance(value, _IMMUTABLE_TYPES + (_PickledValue,)):
+                shared[id(value)] = (key,)
+        rows = {}
+        changed = []
+        for key, value in dict.items(data):
+            if isinstance(value, _PickledValue):
+                rows[key] = self._rows[key]
+                continue
+            blob, refs = self._dumps(value, shared)
+            rows[key] = (blob, hashlib.sha1(blob).digest(), refs)
+            if self._rows.get(key, (None, None))[1] != rows[key][1]:
+                changed.append(key)
+
+        if (filename == self.filename and self._synced and
+                os.path.isfile(filename)):
+            if changed or removed:
+                self._write(filename, rows, changed, removed)
+        else:
+            self._write_new(filename, rows)
+        if filename == self.filename:
+            self._rows = rows
+            self._synced = True
+
+    def _write(self, filename, rows, changed, removed):
+        conn = self._connect(filename)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO env VALUES (?, ?, ?)",
+                    ((sqlite3.Binary(cPickle.dumps(key, 2)),
+                      sqlite3.Binary(rows[key][0]),
+                      sqlite3.Binary(cPickle.dumps(rows[key][2], 2)))
+                     for key in changed))
+                conn.executemany(
+                    "DELETE FROM env WHERE key = ?",
+                    ((sqlite3.Binary(cPickle.dumps(key, 2)),)
+                     for key in removed))
+        finally:
+            conn.close()
+
+    def _write_new(self, filename, rows):
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=os.path.basename(filename) + ".",
+            dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(fd)
+        try:
+            self._write(tmp_filename, rows, rows.keys(), [])
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+
+
 def lock_safe(function):
     """
     Get the environment safe lock, run the function, then release the lock.
@@ -106,20 +402,17 @@ def _update_address_cache(env, line):
         return
 
 
-def _tcpdump_handler(env, filename, line):
+@lock_safe
+def _dhcp_sniffer_handler(env, mac, ip, family):
     """
-    Helper for handler tcpdump output.
-
-    :params address_cache: address cache path.
-    :params filename: Log file name for tcpdump message.
-    :params line: Tcpdump output message.
+    Record a lease seen by the DHCP sniffer into the address cache.
     """
-    try:
-        utils_misc.log_line(filename, line)
-    except Exception, reason:
-        logging.warn("Can't log tcpdump output, '%s'", reason)
-
-    _update_address_cache(env, line)
+    address_cache = env["address_cache"]
+    key = mac if family == 4 else "%s_6" % mac
+    if address_cache.get(key) != ip:
+        address_cache[key] = ip
+        logging.info("Update MAC(%s)<->(%s)IP pair into address_cache",
+                     mac, ip)
 
 
 class Env(UserDict.IterableUserDict):
@@ -133,24 +426,25 @@ class Env(UserDict.IterableUserDict):
         Create an empty Env object or load an existing one from a file.
 
         If the version recorded in the file is lower than version, or if some
-        error occurs during unpickling, or if filename is not supplied,
+        error occurs during loading, or if filename is not supplied,
         create an empty Env object.
 
+        The values are unpickled when first accessed, see EnvStore.
+
         :param filename: Path to an env file.
         :param version: Required env version (int).
         """
         UserDict.IterableUserDict.__init__(self)
         empty = {"version": version}
         self._filename = filename
+        self._store = EnvStore(filename)
         self._tcpdump = None
         self._params = None
         self.save_lock = threading.RLock()
         if filename:
             try:
                 if os.path.isfile(filename):
-                    f = open(filename, "r")
-                    env = cPickle.load(f)
-                    f.close()
+                    env = self._store.load()
                     if env.get("version", 0) >= version:
                         self.data = env
                     else:
@@ -174,9 +468,12 @@ class Env(UserDict.IterableUserDict):
 
     def save(self, filename=None):
         """
-        Pickle the contents of the Env object into a file.
+        Save the contents of the Env object into a file.
 
-        :param filename: Filename to pickle the dict into.  If not supplied,
+        Only the values changed since loading or the last save are written
+        to the env file, atomically.
+
+        :param filename: Filename to save the dict into.  If not supplied,
                 use the filename from which the dict was loaded.
         """
         filename = filename or self._filename
@@ -184,9 +481,7 @@ class Env(UserDict.IterableUserDict):
             raise EnvSaveError("No filename specified for this env file")
         self.save_lock.acquire()
         try:
-            f = open(filename, "w")
-            cPickle.dump(self.data, f)
-            f.close()
+            self._store.save(self.data, filename)
         finally:
             self.save_lock.release()
 
@@ -197,7 +492,9 @@ class Env(UserDict.IterableUserDict):
         vm_list = []
         for key in self.data.keys():
             if key and key.startswith("vm__"):
-                vm_list.append(self.data[key])
+                vm = self.data.get(key)
+                if vm is not None:
+                    vm_list.append(vm)
         return vm_list
 
     def clean_objects(self):
@@ -205,7 +502,7 @@ class Env(UserDict.IterableUserDict):
         Destroy all objects registered in this Env object.
         """
         self.stop_tcpdump()
-        for key in self.data:
+        for key in self.data.keys():
             try:
                 if key.startswith("vm__"):
                     self.data[key].destroy(gracefully=False)
@@ -351,10 +648,9 @@ class Env(UserDict.IterableUserDict):
             self._tcpdump.sendline(cmd)
 
         else:
-            cmd = cmd_template % utils_path.find_command("tcpdump")
-            self._tcpdump = aexpect.Tail(command=cmd,
-                                         output_func=_tcpdump_handler,
-                                         output_params=(self, "tcpdump.log"))
+            self._tcpdump = dhcp_sniffer.DhcpSniffer(
+                _dhcp_sniffer_handler, handler_params=(self,),
+                log_filename="tcpdump.log")
 
         if utils_misc.wait_for(lambda: not self._tcpdump.is_alive(),
                                0.1, 0.1, 1.0):
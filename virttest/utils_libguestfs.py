@@ -2,10 +2,15 @@
 libguestfs tools test utility functions.
 """
 
+import atexit
 import logging
 import signal
 import os
+import pipes
 import re
+import shlex
+import threading
+import time
 
 import aexpect
 from avocado.utils import path
@@ -13,6 +18,11 @@ from avocado.utils import process
 
 from . import propcan
 
+try:
+    import guestfs
+except ImportError:
+    guestfs = None
+
 
 class LibguestfsCmdError(Exception):
 
@@ -160,13 +170,18 @@ class Guestfish(LibguestfsBase):
 
     """
     Execute guestfish, using a new guestfish shell each time.
+
+    With pooled=True, commands on disk images only (no domain, inspection,
+    mounts or uri) run in a pooled appliance of the images instead, see
+    GuestfsSessionPool.
     """
 
-    __slots__ = []
+    __slots__ = ['pool_key']
 
     def __init__(self, disk_img=None, ro_mode=False,
                  libvirt_domain=None, inspector=False,
-                 uri=None, mount_options=None, run_mode="interactive"):
+                 uri=None, mount_options=None, run_mode="interactive",
+                 pooled=False):
         """
         Initialize guestfish command with options.
 
@@ -177,6 +192,9 @@ class Guestfish(LibguestfsBase):
         :param uri: guestfish's connect uri
         :param mount_options: Mount the named partition or logical volume
                                on the given mountpoint.
+        :param pooled: Run commands in a pooled appliance of disk_img; the
+                       caller has to drop_pooled_sessions() before anything
+                       else uses the image
         """
         guestfs_exec = "guestfish"
         if lgf_cmd_check(guestfs_exec) is None:
@@ -213,6 +231,12 @@ class Guestfish(LibguestfsBase):
 
         super(Guestfish, self).__init__(guestfs_exec)
 
+        pool_key = None
+        if (pooled and disk_img and run_mode == "interactive" and
+                not (libvirt_domain or inspector or uri or mount_options)):
+            pool_key = GuestfsSessionPool.get_key(disk_img, ro_mode)
+        self.__dict_set__('pool_key', pool_key)
+
     def complete_cmd(self, command):
         """
         Execute built-in command in a complete guestfish command
@@ -223,12 +247,87 @@ class Guestfish(LibguestfsBase):
         ignore_status = self.__dict_get__('ignore_status')
         debug = self.__dict_get__('debug')
         timeout = self.__dict_get__('timeout')
-        if command:
+        if command and self.get('pool_key') is not None:
+            return self.pooled_cmd(command)
+        elif command:
             guestfs_exec += " %s" % command
             return lgf_command(guestfs_exec, ignore_status, debug, timeout)
         else:
             raise LibguestfsCmdError("No built-in command was passed.")
 
+    def pooled_cmd(self, command):
+        """
+        Execute the ':' separated built-in commands of a complete guestfish
+        command in a pooled appliance of the disk images.
+
+        run/launch are skipped, the pooled appliance is launched already.
+        Error messages of the commands are returned as stderr.
+        """
+        guestfs_exec = self.__dict_get__('lgf_exec')
+        ignore_status = self.__dict_get__('ignore_status')
+        debug = self.__dict_get__('debug')
+        timeout = self.__dict_get__('timeout')
+        disks, readonly = self.__dict_get__('pool_key')
+        if debug:
+            logging.debug("Running command %s in pooled appliance.", command)
+        stdout = []
+        stderr = []
+        exit_status = 0
+        broken = False
+        start = time.time()
+        pool = get_session_pool("guestfish")
+        session = pool.acquire(disks, readonly)
+        try:
+            gf_session = session.open_session()
+            for inner in split_guestfish_cmds(command):
+                if inner in ("run", "launch"):
+                    continue
+                try:
+                    status, output = gf_session.cmd_status_output(
+                        inner, timeout=timeout)
+                except aexpect.ShellError, details:
+                    # The session is in an unknown state, don't reuse it
+                    broken = True
+                    status, output = 1, "%s\n" % details
+                for line in output.splitlines(True):
+                    if gf_session.match_patterns(
+                            line, gf_session.ERROR_REGEX_LIST) is None:
+                        stdout.append(line)
+                    else:
+                        stderr.append(line)
+                if status:
+                    exit_status = status
+                    break
+        finally:
+            pool.release(session, close=broken)
+        ret = process.CmdResult("%s %s" % (guestfs_exec, command),
+                                "".join(stdout), "".join(stderr),
+                                exit_status, time.time() - start)
+        if debug:
+            logging.debug("status: %s", ret.exit_status)
+            logging.debug("stdout: %s", ret.stdout.strip())
+            logging.debug("stderr: %s", ret.stderr.strip())
+        if exit_status and not ignore_status:
+            raise LibguestfsCmdError(ret)
+        return ret
+
+
+def split_guestfish_cmds(command):
+    """
+    Split the built-in commands of a guestfish command line.
+
+    :param command: Commands as passed to guestfish, separated by ':'
+                    arguments and quoted for the shell
+    :return: List of the commands, quoted for the guestfish shell
+    """
+    cmds = [[]]
+    for arg in shlex.split(command):
+        if arg == ":":
+            cmds.append([])
+        else:
+            cmds[-1].append(arg)
+    return [" ".join(pipes.quote(arg) for arg in cmd) for cmd in cmds if cmd]
+
 
 class GuestfishSession(aexpect.ShellSession):
 
@@ -373,22 +472,34 @@ class GuestfishPersistent(Guestfish):
 
     """
     Execute operations using persistent guestfish session.
+
+    With pooled=True the session of disk images is taken from the
+    guestfish GuestfsSessionPool, already launched, and close_session()
+    hands it back to the pool.
     """
 
-    __slots__ = ['session_id', 'run_mode']
+    __slots__ = ['session_id', 'run_mode', 'pooled_session']
 
     # Help detect leftover sessions
     SESSION_COUNTER = 0
 
     def __init__(self, disk_img=None, ro_mode=False,
                  libvirt_domain=None, inspector=False,
-                 uri=None, mount_options=None, run_mode="interactive"):
+                 uri=None, mount_options=None, run_mode="interactive",
+                 pooled=False):
         super(GuestfishPersistent, self).__init__(disk_img, ro_mode,
                                                   libvirt_domain, inspector,
-                                                  uri, mount_options, run_mode)
+                                                  uri, mount_options, run_mode,
+                                                  pooled)
         self.__dict_set__('run_mode', run_mode)
 
-        if self.get('session_id') is None:
+        pool_key = self.get('pool_key')
+        if pool_key is not None:
+            pooled_session = get_session_pool("guestfish").acquire(*pool_key)
+            self.__dict_set__('pooled_session', pooled_session)
+            self.__dict_set__('session_id',
+                              pooled_session.__dict_get__('session_id'))
+        elif self.get('session_id') is None:
             # set_uri does not call when INITIALIZED = False
             # and no session_id passed to super __init__
             self.new_session()
@@ -407,6 +518,12 @@ class GuestfishPersistent(Guestfish):
         """
         If a persistent session exists, close it down.
         """
+        pooled_session = self.get('pooled_session')
+        if pooled_session is not None:
+            self.__dict_del__('pooled_session')
+            self.__dict_del__('session_id')
+            get_session_pool("guestfish").release(pooled_session)
+            return
         try:
             run_mode = self.get('run_mode')
             existing = self.open_session()
@@ -589,6 +706,9 @@ class GuestfishPersistent(Guestfish):
         Internally libguestfs is implemented by running a virtual machine
         using qemu.
         """
+        if self.get('pooled_session') is not None:
+            # Pooled appliances are launched already
+            return process.CmdResult("launch", "", "", 0)
         return self.inner_cmd("launch")
 
     def df(self):
@@ -3859,6 +3979,295 @@ class GuestfishPersistent(Guestfish):
         return self.inner_cmd("aug-save")
 
 
+class GuestfsSessionPool(object):
+
+    """
+    Pool of launched libguestfs appliances, keyed by disk images and mode.
+
+    Launching an appliance takes several seconds, so sessions released to
+    the pool are handed out again to the next user of the same disks.
+    Sessions idle for longer than idle_timeout are closed.
+
+    With the "guestfs" backend sessions are guestfs.GuestFS handles of the
+    Python binding, with the "guestfish" backend they are launched
+    GuestfishPersistent objects. The binding is used when installed.
+
+    Released read-only sessions get their filesystems unmounted and are
+    kept; writable ones are closed, so nothing keeps the disks open for
+    writing. Only one session at a time is handed out for writable disks,
+    and callers must drop() pooled sessions before something else opens
+    the disks.
+    """
+
+    def __init__(self, idle_timeout=300, backend=None):
+        """
+        :param idle_timeout: Seconds after which unused sessions are closed
+        :param backend: "guestfs" or "guestfish" (default: guestfs when the
+                        Python binding is available)
+        """
+        if backend is None:
+            backend = "guestfish" if guestfs is None else "guestfs"
+        if backend not in ("guestfs", "guestfish"):
+            raise ValueError("Unknown libguestfs backend %s" % backend)
+        if backend == "guestfs" and guestfs is None:
+            raise LibguestfsCmdError("Python libguestfs binding is not "
+                                     "installed")
+        self.backend = backend
+        self.idle_timeout = idle_timeout
+        self.__lock = threading.RLock()
+        # key -> list of (session, release time)
+        self.__idle = {}
+        # id(session) -> (key, session)
+        self.__busy = {}
+        # keys of writable sessions handed out or launching
+        self.__writers = set()
+        self.__timer = None
+
+    @staticmethod
+    def get_key(disks, readonly=False):
+        """
+        :param disks: Disk image path or list of paths
+        :return: Pool key of the session for disks
+        """
+        if isinstance(disks, basestring):
+            disks = [disks]
+        return (tuple(os.path.realpath(disk) for disk in disks),
+                bool(readonly))
+
+    def _launch(self, key):
+        disks, readonly = key
+        logging.debug("Launching libguestfs appliance for %s (readonly=%s)",
+                      ", ".join(disks), readonly)
+        if self.backend == "guestfs":
+            session = guestfs.GuestFS(python_return_dict=True)
+            try:
+                for disk in disks:
+                    session.add_drive_opts(disk, readonly=readonly)
+                session.launch()
+            except RuntimeError, details:
+                session.close()
+                raise LibguestfsCmdError(details)
+            return session
+        session = GuestfishPersistent()
+        commands = [(session.add_drive_opts, (disk, readonly))
+                    for disk in disks]
+        commands.append((session.run, ()))
+        for command, args in commands:
+            result = command(*args)
+            if result.exit_status:
+                session.close_session()
+                raise LibguestfsCmdError(result)
+        return session
+
+    def _reset(self, key, session):
+        """
+        Unmount everything in a released read-only session.
+        """
+        if self.backend == "guestfs":
+            session.umount_all()
+            return
+        result = session.inner_cmd("umount-all")
+        if result.exit_status:
+            raise LibguestfsCmdError(result)
+
+    def _close(self, session):
+        try:
+            if self.backend == "guestfs":
+                session.shutdown()
+                session.close()
+            else:
+                session.close_session()
+        except Exception, details:
+            logging.warning("Failed to close libguestfs session: %s", details)
+
+    def acquire(self, disks, readonly=False):
+        """
+        Get a launched session for disks, booting a new appliance only
+        when no idle one is pooled.
+
+        :param disks: Disk image path or list of paths
+        :param readonly: Whether to add the disks read-only
+        :raise LibguestfsCmdError: Writable disks are already in use
+        """
+        key = self.get_key(disks, readonly)
+        with self.__lock:
+            if not readonly:
+                if key in self.__writers:
+                    raise LibguestfsCmdError(
+                        "Writable libguestfs session for %s is in use" %
+                        ", ".join(key[0]))
+                self.__writers.add(key)
+            idle = self.__idle.get(key)
+            if idle:
+                session = idle.pop()[0]
+                if not idle:
+                    del self.__idle[key]
+                self.__busy[id(session)] = (key, session)
+                return session
+        try:
+            session = self._launch(key)
+        except Exception:
+            with self.__lock:
+                self.__writers.discard(key)
+            raise
+        with self.__lock:
+            self.__busy[id(session)] = (key, session)
+        return session
+
+    def release(self, session, close=False):
+        """
+        Return a session got by acquire() to the pool.
+
+        :param close: Close the session instead of keeping it, e.g. when it
+                      is in an unknown state. Writable sessions are always
+                      closed.
+        """
+        with self.__lock:
+            key, session = self.__busy.pop(id(session))
+        if close or not key[1]:
+            self._close(session)
+            session = None
+        else:
+            try:
+                self._reset(key, session)
+            except (LibguestfsCmdError, RuntimeError), details:
+                logging.warning("Closing libguestfs session that failed to "
+                                "reset: %s", details)
+                self._close(session)
+                session = None
+        with self.__lock:
+            if session is not None:
+                self.__idle.setdefault(key, []).append((session,
+                                                        time.time()))
+                self._schedule_eviction()
+            self.__writers.discard(key)
+
+    def session(self, disks, readonly=False):
+        """
+        Context manager acquiring a session and releasing it on exit.
+        """
+        return _PooledSession(self, disks, readonly)
+
+    def _schedule_eviction(self):
+        if self.__timer is None and self.__idle:
+            # Fire when the oldest idle session expires
+            oldest = min(released for idle in self.__idle.values()
+                         for _, released in idle)
+            delay = max(oldest + self.idle_timeout - time.time(), 0)
+            self.__timer = threading.Timer(delay, self.evict_idle)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def evict_idle(self):
+        """
+        Close sessions unused for longer than idle_timeout.
+        """
+        expired = []
+        deadline = time.time() - self.idle_timeout
+        with self.__lock:
+            timer, self.__timer = self.__timer, None
+            if timer is not None and timer is not threading.current_thread():
+                timer.cancel()
+            for key, idle in self.__idle.items():
+                expired.extend(s for s, released in idle
+                               if released <= deadline)
+                idle[:] = [(s, released) for s, released in idle
+                           if released > deadline]
+                if not idle:
+                    del self.__idle[key]
+            self._schedule_eviction()
+        for session in expired:
+            self._close(session)
+
+    def has_idle(self):
+        """
+        :return: Whether idle sessions are pooled
+        """
+        with self.__lock:
+            return bool(self.__idle)
+
+    def drop(self, disks=None):
+        """
+        Close idle sessions using any of disks (default: all idle sessions).
+
+        :param disks: Disk image path or list of paths
+        """
+        if disks is not None:
+            disks = set(self.get_key(disks)[0])
+        dropped = []
+        with self.__lock:
+            for key in self.__idle.keys():
+                if disks is None or disks.intersection(key[0]):
+                    dropped.extend(s for s, _ in self.__idle.pop(key))
+        for session in dropped:
+            self._close(session)
+
+    def close(self):
+        """
+        Close all idle sessions and stop the eviction timer.
+        """
+        with self.__lock:
+            timer, self.__timer = self.__timer, None
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        self.drop()
+
+
+class _PooledSession(object):
+
+    def __init__(self, pool, disks, readonly):
+        self.pool = pool
+        self.disks = disks
+        self.readonly = readonly
+        self.session = None
+
+    def __enter__(self):
+        self.session = self.pool.acquire(self.disks, self.readonly)
+        return self.session
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.session)
+
+
+_SESSION_POOLS = {}
+_SESSION_POOLS_LOCK = threading.Lock()
+
+
+def get_session_pool(backend=None):
+    """
+    :param backend: Backend of the pool, see GuestfsSessionPool
+    :return: GuestfsSessionPool of backend shared in this process
+    """
+    if backend is None:
+        backend = "guestfish" if guestfs is None else "guestfs"
+    with _SESSION_POOLS_LOCK:
+        pool = _SESSION_POOLS.get(backend)
+        if pool is None:
+            pool = GuestfsSessionPool(backend=backend)
+            _SESSION_POOLS[backend] = pool
+            atexit.register(pool.close)
+    return pool
+
+
+def has_pooled_sessions():
+    """
+    :return: Whether idle sessions are pooled in this process
+    """
+    return any(pool.has_idle() for pool in _SESSION_POOLS.values())
+
+
+def drop_pooled_sessions(disks=None):
+    """
+    Close pooled sessions using any of disks, before something else (e.g.
+    a VM) opens the disks.
+
+    :param disks: Disk image path or list of paths (default: all)
+    """
+    for pool in _SESSION_POOLS.values():
+        pool.drop(disks)
+
+
 def libguest_test_tool_cmd(qemuarg=None, qemudirarg=None,
                            timeoutarg=None, ignore_status=True,
                            debug=False, timeout=60):
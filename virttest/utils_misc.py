@@ -22,6 +22,7 @@ import tarfile
 import shutil
 import getpass
 import ctypes
+import select
 import threading
 import platform
 
@@ -619,6 +620,155 @@ def wait_for(func, timeout, first=0.0, step=1.0, text=None):
     return None
 
 
+class LogFollower(object):
+
+    """
+    Follow a growing log file, like tail -f, looking for strings in it.
+
+    Only data appended since the last poll() is read, and strings split
+    between two reads are still found.  The log may not exist yet, and
+    starts over from the beginning when truncated or replaced.  Waiting
+    for new data uses inotify where libc provides it, sleeping otherwise.
+    """
+
+    # Bytes of new data read and searched at once
+    read_size = 1024 * 1024
+    # Sleep between polls when inotify is not available
+    poll_interval = 1.0
+
+    # inotify_init1() flags and inotify event masks from <sys/inotify.h>
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_DELETE_SELF = 0x00000400
+    _IN_MOVE_SELF = 0x00000800
+
+    def __init__(self, filename, strings):
+        """
+        :param filename: Path of the log file to follow.
+        :param strings: List of strings to look for.
+        """
+        self.filename = filename
+        self.strings = list(strings)
+        # Strings seen so far, in the order they were found
+        self.found = []
+        self.offset = 0
+        self._inode = None
+        # End of data already searched, to match across read boundaries
+        self._tail = ""
+        self._inotify_fd = None
+        self._watch = None
+        try:
+            self._libc = ctypes.CDLL("libc.so.6", use_errno=True)
+            self._libc.inotify_init1
+            self._libc.inotify_add_watch
+        except (OSError, AttributeError):
+            self._libc = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Release the inotify file descriptor, if any.
+        """
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+            self._watch = None
+
+    def _search(self, data):
+        if not self.strings:
+            return
+        overlap = max(len(string) for string in self.strings) - 1
+        window = self._tail + data
+        for string in self.strings:
+            if string not in self.found and string in window:
+                logging.debug("Message read from %s: %s", self.filename,
+                              string)
+                self.found.append(string)
+        if overlap > 0:
+            self._tail = window[-overlap:]
+
+    def _add_watch(self):
+        if self._libc is None:
+            return
+        if self._inotify_fd is None:
+            fd = self._libc.inotify_init1(self._IN_NONBLOCK |
+                                          self._IN_CLOEXEC)
+            if fd < 0:
+                self._libc = None
+                return
+            self._inotify_fd = fd
+        mask = (self._IN_MODIFY | self._IN_ATTRIB | self._IN_DELETE_SELF |
+                self._IN_MOVE_SELF)
+        watch = self._libc.inotify_add_watch(self._inotify_fd,
+                                             self.filename, mask)
+        if watch < 0:
+            watch = None
+        self._watch = watch
+
+    def poll(self):
+        """
+        Read the data appended to the log since last call and search it.
+
+        :return: List of the strings found so far.
+        :raise IOError: The log file could not be read.
+        """
+        log_file = open(self.filename, 'rb')
+        try:
+            stat_result = os.fstat(log_file.fileno())
+            if (stat_result.st_ino != self._inode or
+                    stat_result.st_size < self.offset):
+                # New or truncated log, start over
+                self._inode = stat_result.st_ino
+                self.offset = 0
+                self._tail = ""
+                self._add_watch()
+            log_file.seek(self.offset)
+            while True:
+                data = log_file.read(self.read_size)
+                if not data:
+                    break
+                self.offset += len(data)
+                self._search(data)
+        finally:
+            log_file.close()
+        return self.found
+
+    def wait(self, timeout):
+        """
+        Sleep until the log changes or timeout seconds passed.
+        """
+        if self._watch is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return
+        readable, _, _ = select.select([self._inotify_fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self._inotify_fd, 4096):
+                    pass
+            except OSError:
+                pass  # Drained, EAGAIN
+
+    def wait_for(self, timeout):
+        """
+        Wait until one of the strings shows up in the log or timeout passed.
+
+        :param timeout: Timeout in seconds.
+        :return: List of the strings found so far.
+        :raise IOError: The log file could not be read.
+        """
+        end_time = time.time() + timeout
+        while True:
+            found = self.poll()
+            remaining = end_time - time.time()
+            if found or remaining <= 0:
+                return found
+            self.wait(remaining)
+
+
 def get_hash_from_file(hash_path, dvd_basename):
     """
     Get the a hash from a given DVD image from a hash file
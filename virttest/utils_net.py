@@ -1,5 +1,6 @@
 import re
 import os
+import errno
 import socket
 import fcntl
 import struct
@@ -10,6 +11,8 @@ import time
 import shelve
 import commands
 import signal
+import cPickle
+import tempfile
 
 import aexpect
 from avocado.core import exceptions
@@ -2556,6 +2559,8 @@ class DbNet(VMNet):
         if hasattr(self, 'db'):
             self.db.close()
             del self.db
+            # Only valid while holding the lock
+            self.mac_db = None
             if hasattr(self, 'lock'):
                 utils_misc.unlock_file(self.lock)
                 del self.lock
@@ -2599,24 +2604,139 @@ class DbNet(VMNet):
         if db_key is None:
             db_key = self.db_key
         data = str(self)
+        # Load before changing the database, which would trigger a rebuild
+        index = self.load_mac_index()
         # Avoid saving empty entries
         if len(data) > 3:
-            try:
-                self.db[self.db_key] = data
-            except AttributeError:
-                raise DbNoLockError
+            self.db[db_key] = data
+            self.index_macs(index, db_key, True)
         else:
             try:
                 # make sure old db entry is removed
                 del self.db[db_key]
             except KeyError:
                 pass
+            self.index_macs(index, db_key, False)
 
     def update_db(self):
         self.lock_db()
         self.save_to_db()
         self.unlock_db()
 
+    @property
+    def mac_index_filename(self):
+        return self.db_filename + ".macs"
+
+    def load_mac_index(self, reclaim=False):
+        """
+        Return the allocated mac address index of the locked database
+
+        The index maps every allocated mac address to the database key
+        owning it ('macs') and every database key to the process group
+        which saved it last ('owners'). It is rebuilt from the database
+        entries when missing or out of sync.
+
+        :param reclaim: Remove the entries of dead process groups
+        :return: index dictionary
+        """
+        try:
+            db_keys = self.db.keys()
+        except AttributeError:
+            raise DbNoLockError
+        index = getattr(self, 'mac_db', None)
+        if index is None:
+            try:
+                index_file = open(self.mac_index_filename, "r")
+                try:
+                    index = cPickle.load(index_file)
+                finally:
+                    index_file.close()
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                index = None
+        if index is None or set(index['owners']) != set(db_keys):
+            # Keep the known owners, entries of others are never reclaimed
+            owners = index and index['owners'] or {}
+            index = {'macs': {}, 'owners': {}}
+            for db_key in db_keys:
+                index['owners'][db_key] = owners.get(db_key)
+                for nic in self.db_entry(db_key):
+                    if nic.get('mac'):
+                        index['macs'][nic['mac'].lower()] = db_key
+            self.save_mac_index(index)
+        self.mac_db = index
+        if reclaim:
+            self.reclaim_mac_addresses(index)
+        return index
+
+    def save_mac_index(self, index):
+        """
+        Atomically write the mac address index of the locked database
+        """
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=os.path.basename(self.mac_index_filename) + ".",
+            dir=os.path.dirname(os.path.abspath(self.mac_index_filename)))
+        try:
+            index_file = os.fdopen(fd, "w")
+            try:
+                cPickle.dump(index, index_file, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                index_file.close()
+            os.rename(tmp_filename, self.mac_index_filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+        self.mac_db = index
+
+    def reclaim_mac_addresses(self, index):
+        """
+        Remove the database entries saved by dead process groups
+
+        :param index: mac address index of the locked database
+        """
+        own_group = os.getpgrp()
+        dead = {}
+        stale_keys = []
+        for db_key, owner in index['owners'].items():
+            if owner is None or owner == own_group:
+                continue
+            if owner not in dead:
+                dead[owner] = not process_group_is_alive(owner)
+            if dead[owner]:
+                stale_keys.append(db_key)
+        if not stale_keys:
+            return
+        for db_key in stale_keys:
+            logging.debug("Reclaiming mac addresses of %s, its process "
+                          "group %s is gone", db_key,
+                          index['owners'][db_key])
+            del self.db[db_key]
+            del index['owners'][db_key]
+        stale_keys = set(stale_keys)
+        for mac, db_key in index['macs'].items():
+            if db_key in stale_keys:
+                del index['macs'][mac]
+        self.save_mac_index(index)
+
+    def index_macs(self, index, db_key, saved):
+        """
+        Update the mac address index after saving or removing db_key
+
+        :param index: mac address index of the locked database
+        :param db_key: database key written
+        :param saved: False if the entry was removed
+        """
+        for mac, owner in index['macs'].items():
+            if owner == db_key:
+                del index['macs'][mac]
+        if saved:
+            index['owners'][db_key] = os.getpgrp()
+            for mac in self.mac_list():
+                if mac:
+                    index['macs'][mac.lower()] = db_key
+        else:
+            index['owners'].pop(db_key, None)
+        self.save_mac_index(index)
+
     def mac_index(self):
         """Generator of mac addresses found in database"""
         try:
@@ -2630,8 +2750,20 @@ class DbNet(VMNet):
         except AttributeError:
             raise DbNoLockError
 
+
+def process_group_is_alive(pgid):
+    """
+    Return True if any process of process group pgid is alive
+    """
+    try:
+        os.killpg(pgid, 0)
+    except OSError, details:
+        return details.errno != errno.ESRCH
+    return True
+
 ADDRESS_POOL_FILENAME = os.path.join(data_dir.get_tmp_dir(), "address_pool")
 ADDRESS_POOL_LOCK_FILENAME = ADDRESS_POOL_FILENAME + ".lock"
+ADDRESS_POOL_INDEX_FILENAME = ADDRESS_POOL_FILENAME + ".macs"
 
 
 def clean_tmp_files():
@@ -2642,6 +2774,8 @@ def clean_tmp_files():
         os.unlink(ADDRESS_POOL_LOCK_FILENAME)
     if os.path.isfile(ADDRESS_POOL_FILENAME):
         os.unlink(ADDRESS_POOL_FILENAME)
+    if os.path.isfile(ADDRESS_POOL_INDEX_FILENAME):
+        os.unlink(ADDRESS_POOL_INDEX_FILENAME)
 
 
 class VirtNet(DbNet, ParamsNet):
@@ -2718,32 +2852,72 @@ class VirtNet(DbNet, ParamsNet):
         :return: MAC address string
         :raise: NetError if mac generation failed
         """
-        nic = self[nic_index_or_name]
-        if nic.has_key('mac'):
-            logging.warning("Overwriting mac %s for nic %s with random"
-                            % (nic.mac, str(nic_index_or_name)))
-        self.free_mac_address(nic_index_or_name)
-        attempts_remaining = attempts
-        while attempts_remaining > 0:
-            mac_attempt = nic.complete_mac_address(self.mac_prefix)
-            self.lock_db()
-            if mac_attempt not in self.mac_index():
-                nic.mac = mac_attempt.lower()
-                self.unlock_db()
-                self.update_db()
-                return self[nic_index_or_name].mac
-            else:
-                attempts_remaining -= 1
-                self.unlock_db()
-        raise NetError("%s/%s MAC generation failed with prefix %s after %d "
-                       "attempts for NIC %s on VM %s (%s)" % (
-                           self.vm_type,
-                           self.driver_type,
-                           self.mac_prefix,
-                           attempts,
-                           str(nic_index_or_name),
-                           self.vm_name,
-                           self.db_key))
+        return self.generate_mac_addresses([nic_index_or_name], attempts)[0]
+
+    def generate_mac_addresses(self, nic_indexes_or_names=None,
+                               attempts=1024):
+        """
+        Set & return valid mac addresses for several NICs at once
+
+        All addresses are reserved while holding the database lock once,
+        checking candidates against the mac address index of the database.
+
+        :param nic_indexes_or_names: index numbers or names of the NICs,
+                                     by default all NICs without a mac
+        :param attempts: Candidates to try per NIC
+        :return: List of MAC address strings
+        :raise: NetError if mac generation failed
+        """
+        if nic_indexes_or_names is None:
+            nic_indexes_or_names = [nic.nic_name for nic in self
+                                    if not nic.has_key('mac')]
+        nics = [self[nic_index_or_name]
+                for nic_index_or_name in nic_indexes_or_names]
+        if not nics:
+            return []
+        for nic in nics:
+            if nic.has_key('mac'):
+                logging.warning("Overwriting mac %s for nic %s with random"
+                                % (nic.mac, nic.nic_name))
+            # Reset to params definition if any, or None
+            self.reset_mac(nic.nic_name)
+        nic_names = set(nic.nic_name for nic in nics)
+        self.lock_db()
+        try:
+            index = self.load_mac_index(reclaim=True)
+            allocated = set(mac for mac, db_key in index['macs'].iteritems()
+                            if db_key != self.db_key)
+            allocated.update(mac.lower() for mac in
+                             ParamsNet.mac_index(self))
+            allocated.update(nic.mac.lower() for nic in self
+                             if nic.nic_name not in nic_names and
+                             nic.has_key('mac'))
+            try:
+                for nic in nics:
+                    for _ in xrange(attempts):
+                        mac_attempt = nic.complete_mac_address(
+                            self.mac_prefix).lower()
+                        if mac_attempt not in allocated:
+                            break
+                    else:
+                        raise NetError(
+                            "%s/%s MAC generation failed with prefix %s "
+                            "after %d attempts for NIC %s on VM %s (%s)" % (
+                                self.vm_type,
+                                self.driver_type,
+                                self.mac_prefix,
+                                attempts,
+                                nic.nic_name,
+                                self.vm_name,
+                                self.db_key))
+                    nic.mac = mac_attempt
+                    allocated.add(mac_attempt)
+            finally:
+                # Keep the addresses generated before a failure
+                self.save_to_db()
+        finally:
+            self.unlock_db()
+        return [nic.mac for nic in nics]
 
     def free_mac_address(self, nic_index_or_name):
         """
@@ -18,7 +18,6 @@ More specifically:
 
 import commands
 import glob
-import imp
 import locale
 import logging
 import os
@@ -1184,38 +1183,29 @@ def run_virt_sub_test(test, params, env, sub_type=None, tag=None):
                                    "sub test type")
 
     provider = params.get("provider", None)
-    subtest_dirs = []
-    subtest_dir = None
+    test_dirs = []
 
     if provider is None:
         # Verify if we have the correspondent source file for it
-        for generic_subdir in asset.get_test_provider_subdirs('generic'):
-            subtest_dirs += data_dir.SubdirList(generic_subdir,
-                                                bootstrap.test_filter)
-
-        for specific_subdir in asset.get_test_provider_subdirs(params.get("vm_type")):
-            subtest_dirs += data_dir.SubdirList(specific_subdir,
-                                                bootstrap.test_filter)
+        test_dirs += asset.get_test_provider_subdirs('generic')
+        test_dirs += asset.get_test_provider_subdirs(params.get("vm_type"))
     else:
         provider_info = asset.get_test_provider_info(provider)
         for key in provider_info['backends']:
-            subtest_dirs += data_dir.SubdirList(
-                provider_info['backends'][key]['path'],
-                bootstrap.test_filter)
-
-    for d in subtest_dirs:
-        module_path = os.path.join(d, "%s.py" % sub_type)
-        if os.path.isfile(module_path):
-            subtest_dir = d
-            break
+            test_dirs.append(provider_info['backends'][key]['path'])
+
+    test_indexes = [asset.get_test_dir_index(d, bootstrap.test_filter)
+                    for d in test_dirs]
+    subtest_dir = asset.find_test_dir(sub_type, test_indexes)
 
     if subtest_dir is None:
+        subtest_dirs = []
+        for index in test_indexes:
+            subtest_dirs += index.subdirs
         raise exceptions.TestError("Could not find test file %s.py "
                                    "on directories %s" % (sub_type, subtest_dirs))
 
-    f, p, d = imp.find_module(sub_type, [subtest_dir])
-    test_module = imp.load_module(sub_type, f, p, d)
-    f.close()
+    test_module = asset.load_test_module(sub_type, subtest_dir)
     # Run the test function
     run_func = utils_misc.get_test_entrypoint_func(sub_type, test_module)
     if tag is not None:
@@ -526,10 +526,12 @@ class GuestfishTools(lgf.GuestfishPersistent):
         inspector = bool(params.get("gf_inspector", False))
         mount_options = params.get("mount_options")
         run_mode = params.get("gf_run_mode", "interactive")
+        pooled = params.get("gf_pooled_session", "no") == "yes"
         super(GuestfishTools, self).__init__(disk_img, ro_mode,
                                              libvirt_domain, inspector,
                                              mount_options=mount_options,
-                                             run_mode=run_mode)
+                                             run_mode=run_mode,
+                                             pooled=pooled)
 
     def get_root(self):
         """
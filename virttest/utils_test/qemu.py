@@ -37,6 +37,7 @@ from .. import remote
 from .. import storage
 from .. import utils_misc
 from .. import qemu_monitor
+from .. import virt_vm
 from ..qemu_devices import qdevices
 from ..staging import utils_memory
 
@@ -183,7 +184,8 @@ def setup_runlevel(params, session):
 
 def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
             mig_cancel=False, offline=False, stable_check=False,
-            clean=False, save_path=None, dest_host='localhost', mig_port=None):
+            clean=False, save_path=None, dest_host='localhost', mig_port=None,
+            test=None):
     """
     Migrate a VM locally and re-register it in the environment.
 
@@ -195,14 +197,19 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
     :param mig_cancel: Test migrate_cancel or not when protocol is tcp.
     :param dest_host: Destination host (defaults to 'localhost').
     :param mig_port: Port that will be used for migration.
+    :param test: The test object.  If given, the migration statistics are
+            written as its keyvals (see write_migration_keyvals()).
     :return: The post-migration VM, in case of same host migration, True in
             case of multi-host migration.
     """
-    def mig_finished():
-        if dest_vm.is_dead():
+    def vms_alive():
+        if dest_vm is not None and dest_vm.is_dead():
             raise exceptions.TestFail("Dest VM died during migration.")
         if not offline and vm.is_dead():
             raise exceptions.TestFail("Source VM died during migration")
+
+    def mig_finished():
+        vms_alive()
         try:
             o = vm.monitor.info("migrate")
             if isinstance(o, str):
@@ -236,6 +243,12 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
                     o.get("status") == "canceled")
 
     def wait_for_migration():
+        if migration_events:
+            try:
+                return vm.wait_for_migration_events(mig_timeout, vms_alive)
+            except virt_vm.VMMigrateTimeoutError:
+                raise exceptions.TestFail("Timeout expired while waiting for "
+                                          "migration to finish")
         if not utils_misc.wait_for(mig_finished, mig_timeout, 2, 2,
                                    "Waiting for migration to finish"):
             raise exceptions.TestFail("Timeout expired while waiting for migration "
@@ -251,6 +264,14 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
 
     if dest_host == 'localhost':
         dest_vm.create(migration_mode=mig_protocol, mac_source=vm)
+    else:
+        dest_vm = None
+
+    migration_events = (not mig_cancel and
+                        vm.params.get("migration_events") == "yes" and
+                        vm.enable_migration_events())
+    vm.migration_stats = {}
+    status = None
 
     try:
         try:
@@ -281,7 +302,7 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
                     dest_vm.destroy(gracefully=False)
                 return vm
             else:
-                wait_for_migration()
+                status = wait_for_migration()
                 if (dest_host == 'localhost') and stable_check:
                     save_path = None or data_dir.get_tmp_dir()
                     save1 = os.path.join(save_path, "src")
@@ -313,9 +334,11 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
                 os.remove(save2)
 
     # Report migration status
-    if mig_succeeded():
+    if status == "completed" or (status is None and mig_succeeded()):
         logging.info("Migration finished successfully")
-    elif mig_failed():
+        if test is not None:
+            write_migration_keyvals(test, vm)
+    elif status == "failed" or (status is None and mig_failed()):
         raise exceptions.TestFail("Migration failed")
     else:
         status = vm.monitor.info("migrate")
@@ -336,11 +359,31 @@ def migrate(vm, env=None, mig_timeout=3600, mig_protocol="tcp",
 
     # Return the new cloned VM
     if dest_host == 'localhost':
+        if migration_events:
+            dest_vm.migration_stats = vm.migration_stats
         return dest_vm
     else:
         return vm
 
 
+def write_migration_keyvals(test, vm):
+    """
+    Write the statistics of the last migration of a VM as test keyvals.
+
+    The statistics are only gathered for migrations waited for with
+    'migration_events = yes'; the keys are prefixed with 'migration_' and
+    the VM name.
+
+    :param test: The test object.
+    :param vm: The migrated VM.
+    """
+    stats = getattr(vm, "migration_stats", None)
+    if not stats:
+        return
+    test.write_test_keyval(dict(("migration_%s_%s" % (vm.name, key), value)
+                                for key, value in stats.iteritems()))
+
+
 class MigrationData(object):
 
     def __init__(self, params, srchost, dsthost, vms_name, params_append):
@@ -538,6 +581,8 @@ class MultihostMigration(object):
                                             not_wait_for_migration,
                                             mig_offline, mig_data)))
         utils_misc.parallel(multi_mig)
+        for vm in mig_data.vms:
+            write_migration_keyvals(self.test, vm)
 
     def migrate_vms_dest(self, mig_data):
         """
@@ -973,6 +1018,8 @@ class MultihostMigrationFd(MultihostMigration):
                                             not_wait_for_migration,
                                             fd)))
         utils_misc.parallel(multi_mig)
+        for vm in mig_data.vms:
+            write_migration_keyvals(self.test, vm)
 
     def _check_vms_source(self, mig_data):
         start_mig_tout = mig_data.params.get("start_migration_timeout", None)
@@ -1151,6 +1198,8 @@ class MultihostMigrationExec(MultihostMigration):
                                             not_wait_for_migration,
                                             mig_data)))
         utils_misc.parallel(multi_mig)
+        for vm in mig_data.vms:
+            write_migration_keyvals(self.test, vm)
 
     def _check_vms_source(self, mig_data):
         start_mig_tout = mig_data.params.get("start_migration_timeout", None)
@@ -1291,6 +1340,8 @@ class MultihostMigrationRdma(MultihostMigration):
                                             not_wait_for_migration,
                                             mig_offline, mig_data)))
         utils_misc.parallel(multi_mig)
+        for vm in mig_data.vms:
+            write_migration_keyvals(self.test, vm)
 
 
 class GuestSuspend(object):
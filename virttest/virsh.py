@@ -36,6 +36,7 @@ from avocado.utils import process
 from . import propcan
 from . import remote
 from . import utils_misc
+from . import virsh_api
 
 
 # list of symbol names NOT to wrap as Virsh class methods
@@ -44,7 +45,8 @@ NOCLOSE = globals().keys() + [
     'NOCLOSE', 'SCREENSHOT_ERROR_COUNT', 'VIRSH_COMMAND_CACHE',
     'VIRSH_EXEC', 'VirshBase', 'VirshClosure', 'VirshSession', 'Virsh',
     'VirshPersistent', 'VirshConnectBack', 'VIRSH_COMMAND_GROUP_CACHE',
-    'VIRSH_COMMAND_GROUP_CACHE_NO_DETAIL',
+    'VIRSH_COMMAND_GROUP_CACHE_NO_DETAIL', 'VirshAPI', 'LIBVIRT_API',
+    'LIBVIRT_EVENTS', '_command_or_api',
 ]
 
 # Needs to be in-scope for Virsh* class screenshot method and module function
@@ -64,6 +66,14 @@ except path.CmdNotFoundError:
                     "virsh module will not function normally")
     VIRSH_EXEC = '/bin/true'
 
+# Default for the 'libvirt_api' keyword: run the functions supported by
+# virsh_api through libvirt-python instead of the virsh executable
+LIBVIRT_API = False
+
+# Track domain states from libvirt events (virsh_api.DomainStateTracker) for
+# the state checks and waits of libvirt_vm.VM
+LIBVIRT_EVENTS = False
+
 
 class VirshBase(propcan.PropCanBase):
 
@@ -400,6 +410,21 @@ class Virsh(VirshBase):
                 self.__super_set__(sym, VirshClosure(ref, self))
 
 
+class VirshAPI(Virsh):
+
+    """
+    Execute libvirt operations through libvirt-python where supported,
+    using a new virsh shell for everything else.
+    """
+
+    __slots__ = ('libvirt_api',)
+
+    def __init__(self, *args, **dargs):
+        init_dict = dict(*args, **dargs)
+        init_dict['libvirt_api'] = init_dict.get('libvirt_api', True)
+        super(VirshAPI, self).__init__(init_dict)
+
+
 class VirshPersistent(Virsh):
 
     """
@@ -690,6 +715,27 @@ def command(cmd, **dargs):
     return ret
 
 
+def _command_or_api(cmd, api_function, *args, **dargs):
+    """
+    Call virsh_api function api_function if the libvirt API backend is
+    enabled and supports the call, run the virsh cmd otherwise.
+
+    :param cmd: Command line to append to virsh command
+    :param api_function: Name of the virsh_api function
+    :param args: Positional arguments of the virsh_api function
+    :param dargs: standardized virsh function API keywords
+    :return: CmdResult object
+    """
+    if (dargs.get('libvirt_api', LIBVIRT_API) and
+            dargs.get('virsh_exec', VIRSH_EXEC) == VIRSH_EXEC):
+        try:
+            return getattr(virsh_api, api_function)(*args, **dargs)
+        except virsh_api.APINotSupported, details:
+            if dargs.get('debug', False):
+                logging.debug("Running '%s' with virsh: %s", cmd, details)
+    return command(cmd, **dargs)
+
+
 def domname(dom_id_or_uuid, **dargs):
     """
     Convert a domain id or UUID to domain name
@@ -698,7 +744,8 @@ def domname(dom_id_or_uuid, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object
     """
-    return command("domname --domain %s" % dom_id_or_uuid, **dargs)
+    return _command_or_api("domname --domain %s" % dom_id_or_uuid,
+                           "domname", dom_id_or_uuid, **dargs)
 
 
 def qemu_monitor_command(name, cmd, options="", **dargs):
@@ -890,7 +937,8 @@ def dom_list(options="", **dargs):
     :param options: options to pass to list command
     :return: CmdResult object
     """
-    return command("list %s" % options, **dargs)
+    return _command_or_api("list %s" % options, "dom_list", options,
+                           **dargs)
 
 
 def reboot(name, options="", **dargs):
@@ -948,7 +996,8 @@ def domstate(name, extra="", **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object
     """
-    return command("domstate %s %s" % (name, extra), **dargs)
+    return _command_or_api("domstate %s %s" % (name, extra), "domstate",
+                           name, extra, **dargs)
 
 
 def domid(name_or_uuid, **dargs):
@@ -959,7 +1008,8 @@ def domid(name_or_uuid, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult instance
     """
-    return command("domid %s" % (name_or_uuid), **dargs)
+    return _command_or_api("domid %s" % (name_or_uuid), "domid",
+                           name_or_uuid, **dargs)
 
 
 def dominfo(name, **dargs):
@@ -970,7 +1020,7 @@ def dominfo(name, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult instance
     """
-    return command("dominfo %s" % (name), **dargs)
+    return _command_or_api("dominfo %s" % (name), "dominfo", name, **dargs)
 
 
 def domuuid(name_or_id, **dargs):
@@ -981,7 +1031,8 @@ def domuuid(name_or_id, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult instance
     """
-    return command("domuuid %s" % name_or_id, **dargs)
+    return _command_or_api("domuuid %s" % name_or_id, "domuuid", name_or_id,
+                           **dargs)
 
 
 def screenshot(name, filename, **dargs):
@@ -1033,7 +1084,8 @@ def domblkstat(name, device, option, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult instance
     """
-    return command("domblkstat %s %s %s" % (name, device, option), **dargs)
+    return _command_or_api("domblkstat %s %s %s" % (name, device, option),
+                           "domblkstat", name, device, option, **dargs)
 
 
 def dumpxml(name, extra="", to_file="", **dargs):
@@ -1046,7 +1098,7 @@ def dumpxml(name, extra="", to_file="", **dargs):
     :return: CmdResult object.
     """
     cmd = "dumpxml %s %s" % (name, extra)
-    result = command(cmd, **dargs)
+    result = _command_or_api(cmd, "dumpxml", name, extra, **dargs)
     if to_file:
         result_file = open(to_file, 'w')
         result_file.write(result.stdout.strip())
@@ -1062,7 +1114,8 @@ def domifstat(name, interface, **dargs):
     :param interface: interface device
     :return: CmdResult object
     """
-    return command("domifstat %s %s" % (name, interface), **dargs)
+    return _command_or_api("domifstat %s %s" % (name, interface),
+                           "domifstat", name, interface, **dargs)
 
 
 def domjobinfo(name, **dargs):
@@ -1200,7 +1253,7 @@ def suspend(name, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object
     """
-    return command("suspend %s" % (name), **dargs)
+    return _command_or_api("suspend %s" % (name), "suspend", name, **dargs)
 
 
 def resume(name, **dargs):
@@ -1211,7 +1264,7 @@ def resume(name, **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object
     """
-    return command("resume %s" % (name), **dargs)
+    return _command_or_api("resume %s" % (name), "resume", name, **dargs)
 
 
 def dommemstat(name, extra="", **dargs):
@@ -1271,7 +1324,8 @@ def start(name, options="", **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object.
     """
-    return command("start %s %s" % (name, options), **dargs)
+    return _command_or_api("start %s %s" % (name, options), "start", name,
+                           options, **dargs)
 
 
 def shutdown(name, options="", **dargs):
@@ -1295,7 +1349,8 @@ def destroy(name, options="", **dargs):
     :param dargs: standardized virsh function API keywords
     :return: CmdResult object
     """
-    return command("destroy %s %s" % (name, options), **dargs)
+    return _command_or_api("destroy %s %s" % (name, options), "destroy",
+                           name, options, **dargs)
 
 
 def define(xml_path, **dargs):
@@ -0,0 +1,702 @@
+"""
+libvirt-python backend for the most frequently used virsh functions.
+
+The functions here take the same arguments as their virsh module
+counterparts and return CmdResult objects with the same output virsh
+prints, but talk to libvirtd through pooled connections instead of forking
+a virsh process (and opening a new connection) for every call.
+
+Calls this backend can't handle the same way as virsh (unknown options,
+libvirt-python missing, ...) raise APINotSupported, the virsh module then
+runs the virsh command instead.
+
+DomainStateTracker keeps the state of all domains of a connection up to date
+from libvirt lifecycle events, so state checks and waits don't need to query
+libvirtd at all.
+
+:copyright: 2016 Red Hat Inc.
+"""
+
+import logging
+import threading
+import time
+
+from avocado.utils import process
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+
+class APINotSupported(Exception):
+
+    """
+    The call can't be handled by the libvirt API backend.
+    """
+    pass
+
+
+# Domain states and state reasons as printed by virsh, indexed by the
+# virDomainState and vir*Reason values
+DOMAIN_STATES = ['no state', 'running', 'idle', 'paused', 'in shutdown',
+                 'shut off', 'crashed', 'pmsuspended']
+
+DOMAIN_STATE_REASONS = {
+    0: ['unknown'],
+    1: ['unknown', 'booted', 'migrated', 'restored', 'from snapshot',
+        'unpaused', 'migration canceled', 'save canceled', 'event wakeup',
+        'crashed', 'post-copy'],
+    2: ['unknown'],
+    3: ['unknown', 'user', 'migrating', 'saving', 'dumping', 'I/O error',
+        'watchdog', 'from snapshot', 'shutting down', 'creating snapshot',
+        'crashed', 'starting up', 'post-copy', 'post-copy failed'],
+    4: ['unknown', 'user'],
+    5: ['unknown', 'shutdown', 'destroyed', 'crashed', 'migrated', 'saved',
+        'failed', 'from snapshot', 'daemon'],
+    6: ['unknown', 'panicked'],
+    7: ['unknown'],
+}
+
+# Domain states is_dead() considers dead, None being an undefined domain
+DEAD_STATES = (None, 'shut off', 'crashed', 'no state')
+
+# Domain state after each virDomainEventType, indexed by its value. None for
+# DEFINED and UNDEFINED, which don't change the state of running domains
+LIFECYCLE_EVENT_STATES = [None, None, 'running', 'paused', 'running',
+                          'shut off', 'in shutdown', 'pmsuspended', 'crashed']
+
+# virConnectListAllDomainsFlags for the supported list options
+LIST_FLAGS = {
+    '--all': 0,
+    '--inactive': 2,
+    '--persistent': 4,
+    '--transient': 8,
+    '--state-running': 16,
+    '--state-paused': 32,
+    '--state-shutoff': 64,
+    '--state-other': 128,
+}
+
+# virDomainXMLFlags for the supported dumpxml options
+DUMPXML_FLAGS = {
+    '--security-info': 1,
+    '--inactive': 2,
+    '--update-cpu': 4,
+    '--migratable': 8,
+}
+
+# virsh names and order of the block stats fields
+BLKSTAT_FIELDS = [('rd_operations', 'rd_req'), ('rd_bytes', 'rd_bytes'),
+                  ('wr_operations', 'wr_req'), ('wr_bytes', 'wr_bytes'),
+                  ('flush_operations', 'flush_operations'),
+                  ('rd_total_times', 'rd_total_times'),
+                  ('wr_total_times', 'wr_total_times'),
+                  ('flush_total_times', 'flush_total_times'),
+                  ('errs', 'errs')]
+
+IFSTAT_FIELDS = ['rx_bytes', 'rx_packets', 'rx_errs', 'rx_drop',
+                 'tx_bytes', 'tx_packets', 'tx_errs', 'tx_drop']
+
+
+class ConnectionPool(object):
+
+    """
+    Idle libvirt connections, per URI and access mode.
+
+    A connection is taken from the pool for the duration of one call and put
+    back afterwards, so concurrent callers never share a connection and the
+    number of open connections stays at the peak concurrency.
+    """
+
+    MAX_IDLE = 4
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, uri=None, readonly=False):
+        """
+        Get a live connection to uri, opening a new one if none is idle.
+
+        :param uri: libvirt URI, None for the default one
+        :param readonly: Open a read-only connection
+        :return: virConnect instance
+        """
+        key = (uri, readonly)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            try:
+                if conn.isAlive():
+                    return conn
+            except libvirt.libvirtError:
+                pass
+            self._close(conn)
+        if readonly:
+            return libvirt.openReadOnly(uri)
+        return libvirt.open(uri)
+
+    def release(self, conn, uri=None, readonly=False):
+        """
+        Put a connection acquired with the same uri and mode back.
+        """
+        with self._lock:
+            idle = self._idle.setdefault((uri, readonly), [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        self._close(conn)
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+
+POOL = ConnectionPool()
+
+
+class DomainStateTracker(object):
+
+    """
+    In-memory state table of the domains of a connection, kept up to date
+    from libvirt lifecycle events.
+
+    Events are dispatched by the default libvirt event loop, which must be
+    registered and running (see state_tracker()) before creating a tracker.
+    The event loop also calls the tracker every TICK milliseconds, to wake
+    waiters up and let them check their timeouts.
+    """
+
+    TICK = 500
+
+    def __init__(self, uri=None):
+        """
+        :param uri: libvirt URI, None for the default one
+        """
+        self.uri = uri
+        self.closed = False
+        self._states = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._conn = libvirt.openReadOnly(uri)
+        self._callback_id = self._conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self._lifecycle_event, None)
+        self._conn.registerCloseCallback(self._connection_closed, None)
+        self._timer = libvirt.virEventAddTimeout(self.TICK, self._tick, None)
+        # Fill the table in after subscribing, so no change is missed.
+        # States from events which arrived meanwhile are newer, keep them
+        for dom in self._conn.listAllDomains(0):
+            state = DOMAIN_STATES[dom.state()[0]]
+            with self._cond:
+                self._states.setdefault(dom.name(), state)
+
+    def close(self):
+        """
+        Stop tracking, waking all waiters up, and close the connection.
+        """
+        self._stop()
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.unregisterCloseCallback()
+            conn.domainEventDeregisterAny(self._callback_id)
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    def _stop(self):
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+        libvirt.virEventRemoveTimeout(self._timer)
+
+    def state(self, name):
+        """
+        Return the state of domain name as printed by virsh domstate.
+
+        :param name: Domain name
+        :return: State string, None if the domain is not defined
+        :raise APINotSupported: if the tracker was closed
+        """
+        with self._cond:
+            if self.closed:
+                raise APINotSupported("Domain state tracker for %s is closed"
+                                      % self.uri)
+            return self._states.get(name)
+
+    def wait_for_state(self, name, states, timeout):
+        """
+        Wait until domain name gets into one of states.
+
+        :param name: Domain name
+        :param states: Collection of state strings, None matches a domain
+                       which is not defined
+        :param timeout: Time in seconds to wait
+        :return: True if the domain got into one of states, False on timeout
+        :raise APINotSupported: if the tracker was closed
+        """
+        end_time = time.time() + timeout
+        with self._cond:
+            while not self.closed:
+                if self._states.get(name) in states:
+                    return True
+                if time.time() >= end_time:
+                    return False
+                # Woken up by events and ticks
+                self._cond.wait()
+        raise APINotSupported("Domain state tracker for %s is closed"
+                              % self.uri)
+
+    def _lifecycle_event(self, conn, dom, event, detail, opaque):
+        name = dom.name()
+        with self._cond:
+            if event < len(LIFECYCLE_EVENT_STATES):
+                state = LIFECYCLE_EVENT_STATES[event]
+            else:
+                logging.debug("Unknown lifecycle event %s of domain %s",
+                              event, name)
+                state = None
+            if state is not None:
+                self._states[name] = state
+            elif event == 0:
+                self._states.setdefault(name, 'shut off')
+            elif event == 1 and self._states.get(name) == 'shut off':
+                del self._states[name]
+            self._cond.notify_all()
+
+    def _tick(self, timer, opaque):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _connection_closed(self, conn, reason, opaque):
+        logging.debug("Connection to %s closed (reason %s), stopped tracking "
+                      "domain states", self.uri, reason)
+        # The connection is released by close() outside of the event loop
+        self._stop()
+
+
+_TRACKERS = {}
+_TRACKERS_LOCK = threading.Lock()
+_EVENT_LOOP = None
+
+
+def _run_event_loop():
+    try:
+        while True:
+            libvirt.virEventRunDefaultImpl()
+    finally:
+        logging.error("libvirt event loop stopped, domain states are not "
+                      "tracked anymore")
+        with _TRACKERS_LOCK:
+            trackers = _TRACKERS.values()
+        for tracker in trackers:
+            tracker._stop()
+
+
+def state_tracker(uri=None):
+    """
+    Return the DomainStateTracker of uri, starting the libvirt event loop
+    and the tracker on first use and after the connection was closed.
+
+    :param uri: libvirt URI, None for the default one
+    :return: DomainStateTracker instance
+    :raise APINotSupported: if libvirt-python is missing or the tracker
+                            can't be started
+    """
+    global _EVENT_LOOP
+    if libvirt is None:
+        raise APINotSupported("libvirt-python is not installed")
+    with _TRACKERS_LOCK:
+        tracker = _TRACKERS.get(uri)
+        if tracker is not None:
+            if not tracker.closed:
+                return tracker
+            tracker.close()
+        if _EVENT_LOOP is None:
+            libvirt.virEventRegisterDefaultImpl()
+            _EVENT_LOOP = threading.Thread(target=_run_event_loop,
+                                           name="libvirt-event-loop")
+            _EVENT_LOOP.daemon = True
+            _EVENT_LOOP.start()
+        elif not _EVENT_LOOP.is_alive():
+            raise APINotSupported("libvirt event loop stopped")
+        try:
+            tracker = DomainStateTracker(uri)
+        except libvirt.libvirtError, details:
+            raise APINotSupported("Can't track domain states of %s: %s" %
+                                  (uri, details.get_error_message()))
+        _TRACKERS[uri] = tracker
+        return tracker
+
+
+def _check_supported(dargs):
+    """
+    Raise APINotSupported for calls needing the virsh executable.
+    """
+    if libvirt is None:
+        raise APINotSupported("libvirt-python is not installed")
+    # Persistent sessions may run virsh on another host (VirshConnectBack)
+    for key in ('session_id', 'unprivileged_user'):
+        if dargs.get(key):
+            raise APINotSupported("%s is not supported" % key)
+
+
+def _parse_options(options, known):
+    """
+    Split an option string, raising APINotSupported for unknown options.
+
+    :param options: Option string, as passed to virsh
+    :param known: Collection of the supported options
+    :return: List of the options
+    """
+    options = options.split()
+    for option in options:
+        if option not in known:
+            raise APINotSupported("Option %s is not supported" % option)
+    return options
+
+
+def _lookup_domain(conn, name):
+    """
+    Look a domain up by id, uuid or name, in the same order as virsh.
+    """
+    if name.isdigit():
+        try:
+            return conn.lookupByID(int(name))
+        except libvirt.libvirtError:
+            pass
+    if len(name) == 36:
+        try:
+            return conn.lookupByUUIDString(name)
+        except libvirt.libvirtError:
+            pass
+    return conn.lookupByName(name)
+
+
+def _run(cmd, func, dargs):
+    """
+    Run func(conn) on a pooled connection, mimicking virsh.command().
+
+    :param cmd: Equivalent virsh command line, for logging and the result
+    :param func: Function taking a virConnect, returning virsh's output
+    :param dargs: standardized virsh function API keywords
+    :return: CmdResult object
+    :raise: CmdError if the call failed and ignore_status=False
+    """
+    uri = dargs.get('uri', None)
+    readonly = dargs.get('readonly', False)
+    debug = dargs.get('debug', False)
+    ignore_status = dargs.get('ignore_status', True)
+    if debug:
+        logging.debug("Running virsh command (libvirt API): %s", cmd)
+
+    start = time.time()
+    stdout = stderr = ""
+    exit_status = 0
+    try:
+        conn = POOL.acquire(uri, readonly)
+    except libvirt.libvirtError, details:
+        conn = None
+        stderr = "error: %s\n" % details.get_error_message()
+        exit_status = 1
+    if conn is not None:
+        try:
+            stdout = func(conn)
+        except libvirt.libvirtError, details:
+            stderr = "error: %s\n" % details.get_error_message()
+            exit_status = 1
+        POOL.release(conn, uri, readonly)
+    ret = process.CmdResult(cmd, stdout, stderr, exit_status,
+                            time.time() - start)
+    ret.from_session_id = None
+
+    if debug:
+        logging.debug("status: %s", ret.exit_status)
+        logging.debug("stdout: %s", ret.stdout.strip())
+        logging.debug("stderr: %s", ret.stderr.strip())
+    if exit_status and not ignore_status:
+        raise process.CmdError(cmd, ret,
+                               "Virsh Command returned non-zero exit status")
+    return ret
+
+
+def _state_string(dom, reason=False):
+    state, state_reason = dom.state()
+    text = DOMAIN_STATES[state]
+    if reason:
+        reasons = DOMAIN_STATE_REASONS.get(state, ['unknown'])
+        if state_reason >= len(reasons):
+            state_reason = 0
+        text = "%s (%s)" % (text, reasons[state_reason])
+    return text
+
+
+def _flag(func, yes, no):
+    """
+    Format a boolean domain property like virsh, "unknown" on errors.
+    """
+    try:
+        return func() and yes or no
+    except libvirt.libvirtError:
+        return "unknown"
+
+
+def domstate(name, extra="", **dargs):
+    """
+    Return the state about a running domain.
+    """
+    _check_supported(dargs)
+    options = _parse_options(extra, ('--reason',))
+
+    def run(conn):
+        dom = _lookup_domain(conn, name)
+        return "%s\n\n" % _state_string(dom, '--reason' in options)
+    return _run("domstate %s %s" % (name, extra), run, dargs)
+
+
+def domid(name_or_uuid, **dargs):
+    """
+    Return VM's ID.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        dom_id = _lookup_domain(conn, name_or_uuid).ID()
+        if dom_id < 0:
+            return "-\n\n"
+        return "%d\n\n" % dom_id
+    return _run("domid %s" % name_or_uuid, run, dargs)
+
+
+def domuuid(name_or_id, **dargs):
+    """
+    Return the Converted domain name or id to the domain UUID.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        return "%s\n\n" % _lookup_domain(conn, name_or_id).UUIDString()
+    return _run("domuuid %s" % name_or_id, run, dargs)
+
+
+def domname(dom_id_or_uuid, **dargs):
+    """
+    Convert a domain id or UUID to domain name
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        return "%s\n\n" % _lookup_domain(conn, dom_id_or_uuid).name()
+    return _run("domname --domain %s" % dom_id_or_uuid, run, dargs)
+
+
+def dominfo(name, **dargs):
+    """
+    Return the VM information.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        dom = _lookup_domain(conn, name)
+        state, max_mem, memory, vcpus, cpu_time = dom.info()
+        lines = []
+
+        def add(label, value):
+            lines.append("%-15s %s" % (label, value))
+        dom_id = dom.ID()
+        add("Id:", dom_id if dom_id >= 0 else "-")
+        add("Name:", dom.name())
+        add("UUID:", dom.UUIDString())
+        add("OS Type:", dom.OSType())
+        add("State:", DOMAIN_STATES[state])
+        add("CPU(s):", vcpus)
+        if cpu_time:
+            add("CPU time:", "%.1fs" % (cpu_time / 1000000000.0))
+        if max_mem == 0xffffffffffffffff:
+            add("Max memory:", "no limit")
+        else:
+            add("Max memory:", "%d KiB" % max_mem)
+        add("Used memory:", "%d KiB" % memory)
+        add("Persistent:", _flag(dom.isPersistent, "yes", "no"))
+        add("Autostart:", _flag(dom.autostart, "enable", "disable"))
+        add("Managed save:", _flag(lambda: dom.hasManagedSaveImage(0),
+                                   "yes", "no"))
+        model, doi = conn.getSecurityModel()
+        if model:
+            add("Security model:", model)
+            add("Security DOI:", doi)
+            if dom_id >= 0:
+                label, enforcing = dom.securityLabel()
+                if label:
+                    add("Security label:", "%s (%s)" % (
+                        label, enforcing and "enforcing" or "permissive"))
+        return "\n".join(lines) + "\n\n"
+    return _run("dominfo %s" % name, run, dargs)
+
+
+def dumpxml(name, extra="", **dargs):
+    """
+    Return the domain information as an XML dump.
+    """
+    _check_supported(dargs)
+    flags = 0
+    for option in _parse_options(extra, DUMPXML_FLAGS):
+        flags |= DUMPXML_FLAGS[option]
+
+    def run(conn):
+        return _lookup_domain(conn, name).XMLDesc(flags)
+    return _run("dumpxml %s %s" % (name, extra), run, dargs)
+
+
+def domblkstat(name, device, option, **dargs):
+    """
+    Get block device stats for a running domain.
+    """
+    _check_supported(dargs)
+    _parse_options(option, ())
+
+    def run(conn):
+        dom = _lookup_domain(conn, name)
+        try:
+            stats = dom.blockStatsFlags(device, 0)
+        except (libvirt.libvirtError, AttributeError):
+            # Old libvirt, only the legacy fields
+            stats = dict(zip(['rd_operations', 'rd_bytes', 'wr_operations',
+                              'wr_bytes', 'errs'],
+                             dom.blockStats(device)))
+        lines = ["%s %s %s" % (device, label, stats[field])
+                 for field, label in BLKSTAT_FIELDS
+                 if stats.get(field, -1) >= 0]
+        return "\n".join(lines) + "\n\n"
+    return _run("domblkstat %s %s %s" % (name, device, option), run, dargs)
+
+
+def domifstat(name, interface, **dargs):
+    """
+    Get network interface stats for a running domain.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        stats = _lookup_domain(conn, name).interfaceStats(interface)
+        lines = ["%s %s %s" % (interface, label, value)
+                 for label, value in zip(IFSTAT_FIELDS, stats) if value >= 0]
+        return "\n".join(lines) + "\n\n"
+    return _run("domifstat %s %s" % (name, interface), run, dargs)
+
+
+def dom_list(options="", **dargs):
+    """
+    Return the list of domains.
+    """
+    _check_supported(dargs)
+    options = _parse_options(options,
+                             LIST_FLAGS.keys() + ['--name', '--uuid'])
+    flags = 0
+    for option in options:
+        flags |= LIST_FLAGS.get(option, 0)
+    if not flags & 3 and '--all' not in options:
+        # Only running domains by default
+        flags |= 1
+
+    def run(conn):
+        doms = conn.listAllDomains(flags)
+        # Running domains by id first, then the others by name
+        active = sorted((dom for dom in doms if dom.ID() >= 0),
+                        key=lambda dom: dom.ID())
+        inactive = sorted((dom for dom in doms if dom.ID() < 0),
+                          key=lambda dom: dom.name())
+        doms = active + inactive
+        if '--name' in options:
+            lines = [dom.name() for dom in doms]
+        elif '--uuid' in options:
+            lines = [dom.UUIDString() for dom in doms]
+        else:
+            lines = [" %-5s %-30s %s" % ("Id", "Name", "State"),
+                     "-" * 52]
+            for dom in doms:
+                dom_id = dom.ID()
+                lines.append(" %-5s %-30s %s" % (dom_id if dom_id >= 0
+                                                 else "-", dom.name(),
+                                                 _state_string(dom)))
+        return "\n".join(lines) + "\n\n"
+    return _run("list %s" % " ".join(options), run, dargs)
+
+
+def start(name, options="", **dargs):
+    """
+    Start a (previously defined) inactive domain.
+    """
+    _check_supported(dargs)
+    flags = 0
+    for option in _parse_options(options, ('--paused', '--autodestroy',
+                                           '--bypass-cache',
+                                           '--force-boot')):
+        flags |= {'--paused': 1, '--autodestroy': 2, '--bypass-cache': 4,
+                  '--force-boot': 8}[option]
+
+    def run(conn):
+        dom = _lookup_domain(conn, name)
+        dom.createWithFlags(flags)
+        return "Domain %s started\n\n" % name
+    return _run("start %s %s" % (name, options), run, dargs)
+
+
+def destroy(name, options="", **dargs):
+    """
+    Destroy a domain.
+    """
+    _check_supported(dargs)
+    flags = 0
+    if _parse_options(options, ('--graceful',)):
+        flags = 1
+
+    def run(conn):
+        dom = _lookup_domain(conn, name)
+        dom.destroyFlags(flags)
+        return "Domain %s destroyed\n\n" % name
+    return _run("destroy %s %s" % (name, options), run, dargs)
+
+
+def suspend(name, **dargs):
+    """
+    Suspend a running domain.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        _lookup_domain(conn, name).suspend()
+        return "Domain %s suspended\n\n" % name
+    return _run("suspend %s" % name, run, dargs)
+
+
+def resume(name, **dargs):
+    """
+    Resume a suspended domain.
+    """
+    _check_supported(dargs)
+
+    def run(conn):
+        _lookup_domain(conn, name).resume()
+        return "Domain %s resumed\n\n" % name
+    return _run("resume %s" % name, run, dargs)
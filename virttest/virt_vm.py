@@ -981,9 +981,10 @@ class BaseVM(object):
         self.copy_files_to(f_path, commander_path)
 
         # start remote commander
+        binary = self.params.get("commander_binary", "no") == "yes"
         cmd = remote.remote_commander(client, address, port, username,
                                       password, prompt, linesep, log_filename,
-                                      timeout, commander_path)
+                                      timeout, commander_path, binary)
         self.remote_sessions.append(cmd)
         return cmd
 
@@ -25,6 +25,10 @@
     file object attribute sourcebackupfile.  See the ElementTree documentation
     for methods provided by that class.
 
+    The MemXMLTreeFile class is an XMLTreeFile keeping the original XML in
+    memory instead of in temporary files.  A temporary file holding the
+    current tree is only written when its name attribute is used.
+
     Finally, the TemplateXML class represents XML templates that support
     dynamic keyword substitution based on a dictionary.  Substitution keys
     in the XML template (string or file) follow the 'bash' variable reference
@@ -174,6 +178,9 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
     # Closed file object of original source or TempXMLFile
     # self.sourcefilename inherited from parent
     sourcebackupfile = None
+    # Cached child to parent mapping and the root it was built for
+    _parent_map = None
+    _parent_map_root = None
 
     def __init__(self, xml):
         """
@@ -259,6 +266,28 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
                 d[c] = p
         return d
 
+    def _parent_of(self, element):
+        """
+        Return the parent of element from the cached parent map or None
+
+        The map is built once per root and kept up to date by remove() and
+        create_by_xpath(), its entries are trusted.  Elements added through
+        the Element API are missing from it and cause a single rebuild,
+        elements removed through it must be removed with remove() instead.
+        """
+        root = self.getroot()
+        if element is root:
+            return None
+        if self._parent_map is None or self._parent_map_root is not root:
+            self._parent_map = self.get_parent_map()
+            self._parent_map_root = root
+        try:
+            return self._parent_map[element]
+        except KeyError:
+            # Added behind our back, or not part of the tree at all
+            self._parent_map = self.get_parent_map()
+            return self._parent_map.get(element)
+
     def get_parent(self, element, relative_root=None):
         """
         Return the parent node of an element or None
@@ -266,6 +295,8 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
         param: element: Element to retrieve parent of
         param: relative_root: Search only below this element
         """
+        if relative_root is None:
+            return self._parent_of(element)
         try:
             return self.get_parent_map(relative_root)[element]
         except KeyError:
@@ -273,9 +304,7 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
 
     def get_xpath(self, element):
         """Return the XPath string formed from first-match tag names"""
-        parent_map = self.get_parent_map()
         root = self.getroot()
-        assert root in parent_map.values()
         if element == root:
             return '.'
         # List of strings reversed at end
@@ -289,8 +318,9 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
             # else:
             #     path_list.append(u"%s" % element.tag)
             path_list.append(u"%s" % element.tag)
-            element = parent_map[element]
-        assert element == root
+            element = self._parent_of(element)
+            if element is None:
+                raise KeyError("Element is not part of this tree")
         path_list.reverse()
         return "/".join(path_list)
 
@@ -301,6 +331,9 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
         :param element: element to be removed.
         """
         self.get_parent(element).remove(element)
+        # Forget the detached subtree, it may be re-parented elsewhere
+        for child in element.getiterator():
+            self._parent_map.pop(child, None)
 
     def remove_by_xpath(self, xpath, remove_all=False):
         """
@@ -323,6 +356,8 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
             next_element = cur_element.find(tag)
             if next_element is None:
                 next_element = ElementTree.SubElement(cur_element, tag)
+                if self._parent_map is not None:
+                    self._parent_map[next_element] = cur_element
             cur_element = next_element
 
     def get_element_string(self, xpath):
@@ -347,6 +382,119 @@ class XMLTreeFile(ElementTree.ElementTree, XMLBackup):
         self.__init__(xml)
 
 
+class MemXMLTreeFile(XMLTreeFile):
+
+    """
+    XMLTreeFile keeping the original XML source in memory.
+
+    Nothing is written to disk until the name attribute is used.  Reading
+    it writes the current tree to an auto-removed TempXMLFile and returns
+    that file's name.  The file-like methods of XMLTreeFile are not
+    available.
+    """
+
+    # Auto-removed TempXMLFile, created on first access to name
+    _tempfile = None
+
+    def __init__(self, xml):
+        """
+        Initialize from a string or filename containing XML source.
+
+        param: xml: A filename or string containing XML
+        """
+        try:
+            # Test if xml is a valid filename
+            source_file = file(xml, "rb")
+        except (IOError, OSError):
+            # Assume xml is a string, it has no source file to restore
+            self.sourcefilename = None
+            if isinstance(xml, unicode):
+                xml = xml.encode(ENCODING)
+            self._pristine = xml
+        else:
+            try:
+                self._pristine = source_file.read()
+            finally:
+                source_file.close()
+            self.sourcefilename = xml
+        self._parse(xml)
+
+    def _parse(self, xml):
+        try:
+            ElementTree.ElementTree.__init__(
+                self, element=None, file=StringIO.StringIO(self._pristine))
+        except expat.ExpatError:
+            raise IOError("Error parsing XML: '%s'" % xml)
+
+    @property
+    def name(self):
+        """
+        Name of a temporary file holding the current tree
+        """
+        if self._tempfile is None:
+            self._tempfile = TempXMLFile()
+            self._tempfile.close()
+        ElementTree.ElementTree.write(self, self._tempfile.name, ENCODING)
+        return self._tempfile.name
+
+    def __str__(self):
+        xmlstr = StringIO.StringIO()
+        ElementTree.ElementTree.write(self, xmlstr, ENCODING)
+        return xmlstr.getvalue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+    def __del__(self):
+        self.unlink()
+
+    def unlink(self):
+        """
+        Delete the temporary file, if any
+        """
+        if self._tempfile is not None:
+            self._tempfile.unlink()
+            self._tempfile = None
+
+    def flush(self):
+        """
+        Nothing to flush, kept for XMLTreeFile compatibility
+        """
+        pass
+
+    def backup(self):
+        """Overwrite original source from current tree"""
+        self._pristine = str(self)
+        if self.sourcefilename is not None:
+            source_file = file(self.sourcefilename, "wb")
+            try:
+                source_file.write(self._pristine)
+            finally:
+                source_file.close()
+
+    def restore(self):
+        """Reparse current tree from original source"""
+        self._parse(self.sourcefilename)
+
+    def backup_copy(self):
+        """Return a copy of instance, sharing no files with it"""
+        return self.__class__(str(self))
+
+    def write(self, filename=None, encoding=ENCODING):
+        """
+        Write current XML tree to filename, or to the temporary file if
+        name was already used.
+        """
+        if filename is None:
+            if self._tempfile is None:
+                return
+            filename = self._tempfile.name
+        ElementTree.ElementTree.write(self, filename, encoding)
+
+
 class Sub(object):
 
     """String substituter using string.Template"""